@@ -2,8 +2,17 @@ Option Explicit
 
 ' API設定
 Private Const API_URL As String = "YOUR_API_GATEWAY_URL/query"
+Private Const BATCH_API_URL As String = "YOUR_API_GATEWAY_URL/batch"
+Private Const JOBS_API_URL As String = "YOUR_API_GATEWAY_URL/jobs"
+Private Const REFRESH_API_URL As String = "YOUR_API_GATEWAY_URL/refresh"
 Private Const API_KEY As String = "YOUR_API_KEY"
 
+' 差分更新の1回の取得行数（応答時間がREFRESH_TARGET_MSに収まるよう増減）
+Private Const REFRESH_INITIAL_ROWS As Long = 2000
+Private Const REFRESH_MIN_ROWS As Long = 500
+Private Const REFRESH_MAX_ROWS As Long = 20000
+Private Const REFRESH_TARGET_MS As Long = 3000
+
 ' RDSクエリ実行関数
 Function ExecuteRDSQuery(sqlQuery As String) As String
     On Error GoTo ErrorHandler
@@ -34,6 +43,303 @@ ErrorHandler:
     ExecuteRDSQuery = "Error: " & Err.Description
 End Function
 
+' 複数クエリの一括実行関数（queriesJson: [{"name":..., "sql":...}, ...]）
+Function ExecuteRDSBatch(queriesJson As String) As String
+    On Error GoTo ErrorHandler
+    
+    Dim http As Object
+    
+    Set http = CreateObject("MSXML2.XMLHTTP")
+    
+    http.Open "POST", BATCH_API_URL, False
+    http.setRequestHeader "Content-Type", "application/json"
+    http.setRequestHeader "x-api-key", API_KEY
+    http.Send "{""queries"":" & queriesJson & "}"
+    
+    ExecuteRDSBatch = http.responseText
+    
+    Exit Function
+    
+ErrorHandler:
+    ExecuteRDSBatch = "Error: " & Err.Description
+End Function
+
+'長時間クエリのジョブ操作関数（action: submit / status / cancel）
+' submit時はparamにSQL、status/cancel時はparamにjob_idを指定
+Function ExecuteRDSJob(action As String, param As String) As String
+    On Error GoTo ErrorHandler
+    
+    Dim http As Object
+    Dim jsonBody As String
+    
+    If action = "submit" Then
+        jsonBody = "{""action"":""submit"",""sql"":""" & Replace(param, """", "\""") & """}"
+    Else
+        jsonBody = "{""action"":""" & action & """,""job_id"":""" & param & """}"
+    End If
+    
+    Set http = CreateObject("MSXML2.XMLHTTP")
+    
+    http.Open "POST", JOBS_API_URL, False
+    http.setRequestHeader "Content-Type", "application/json"
+    http.setRequestHeader "x-api-key", API_KEY
+    http.Send jsonBody
+    
+    ExecuteRDSJob = http.responseText
+    
+    Exit Function
+    
+ErrorHandler:
+    ExecuteRDSJob = "Error: " & Err.Description
+End Function
+
+' クエリ結果（columns/rows）をワークシートに書き込み、最終行を返す
+Function WriteResultToSheet(ws As Worksheet, resultObj As Object) As Long
+    Dim row As Long, col As Long
+    
+    ws.Cells.Clear
+    For col = 1 To resultObj("columns").Count
+        ws.Cells(1, col).Value = resultObj("columns")(col)
+        ws.Cells(1, col).Font.Bold = True
+    Next col
+    
+    row = 2
+    Dim recordItem As Variant
+    For Each recordItem In resultObj("rows")
+        col = 1
+        Dim colName As Variant
+        For Each colName In resultObj("columns")
+            ws.Cells(row, col).Value = recordItem(colName)
+            col = col + 1
+        Next colName
+        row = row + 1
+    Next recordItem
+    
+    ws.Columns.AutoFit
+    WriteResultToSheet = row
+End Function
+
+' 「Queries」シート（A列: 出力シート名, B列: SQL）のクエリを一括実行して各シートに展開
+Sub BatchQueryToSheets()
+    Dim querySheet As Worksheet
+    Dim ws As Worksheet
+    Dim queriesJson As String
+    Dim result As String
+    Dim jsonObj As Object
+    Dim i As Long
+    Dim lastRow As Long
+    
+    Set querySheet = ThisWorkbook.Worksheets("Queries")
+    lastRow = querySheet.Cells(querySheet.Rows.Count, 1).End(xlUp).row
+    
+    ' リクエストボディ作成
+    queriesJson = "["
+    For i = 2 To lastRow
+        If querySheet.Cells(i, 1).Value <> "" Then
+            If Len(queriesJson) > 1 Then queriesJson = queriesJson & ","
+            queriesJson = queriesJson & "{""name"":""" & querySheet.Cells(i, 1).Value & """," & _
+                          """sql"":""" & Replace(querySheet.Cells(i, 2).Value, """", "\""") & """}"
+        End If
+    Next i
+    queriesJson = queriesJson & "]"
+    
+    ' 一括実行（所要時間は最も遅いクエリ分のみ）
+    result = ExecuteRDSBatch(queriesJson)
+    Set jsonObj = JsonConverter.ParseJson(result)
+    
+    If Not jsonObj.Exists("results") Then
+        MsgBox "エラー: " & jsonObj("error"), vbCritical, "バッチクエリエラー"
+        Exit Sub
+    End If
+    
+    Dim name As Variant
+    Dim summary As String
+    For Each name In jsonObj("results").Keys
+        If jsonObj("results")(name)("success") Then
+            On Error Resume Next
+            Set ws = Nothing
+            Set ws = ThisWorkbook.Worksheets(CStr(name))
+            On Error GoTo 0
+            If ws Is Nothing Then
+                Set ws = ThisWorkbook.Worksheets.Add(After:=ThisWorkbook.Worksheets(ThisWorkbook.Worksheets.Count))
+                ws.name = CStr(name)
+            End If
+            WriteResultToSheet ws, jsonObj("results")(name)
+            summary = summary & name & ": " & jsonObj("results")(name)("row_count") & "行 (" & _
+                      jsonObj("results")(name)("execution_time_ms") & "ms)" & vbCrLf
+        Else
+            summary = summary & name & ": エラー - " & jsonObj("results")(name)("message") & vbCrLf
+        End If
+    Next name
+    
+    MsgBox "バッチ実行完了！" & vbCrLf & summary & _
+           "合計時間: " & jsonObj("total_execution_time_ms") & "ms", _
+           vbInformation, "成功"
+End Sub
+
+' 登録済みクエリの差分取得関数（watermarkは前回のレスポンスの値、初回は空文字）
+Function ExecuteRDSRefresh(queryName As String, watermark As String, maxRows As Long) As String
+    On Error GoTo ErrorHandler
+    
+    Dim http As Object
+    Dim jsonBody As String
+    
+    jsonBody = "{""query_name"":""" & queryName & """,""max_rows"":" & maxRows
+    If watermark <> "" Then jsonBody = jsonBody & ",""watermark"":""" & watermark & """"
+    jsonBody = jsonBody & "}"
+    
+    Set http = CreateObject("MSXML2.XMLHTTP")
+    
+    http.Open "POST", REFRESH_API_URL, False
+    http.setRequestHeader "Content-Type", "application/json"
+    http.setRequestHeader "x-api-key", API_KEY
+    http.Send jsonBody
+    
+    ExecuteRDSRefresh = http.responseText
+    
+    Exit Function
+    
+ErrorHandler:
+    ExecuteRDSRefresh = "Error: " & Err.Description
+End Function
+
+' 差分取得の結果をキーで既存の行に上書き（ない行は末尾に追加）し、書き込んだ行数を返す
+' resetの場合はシートを消去して書き直す
+Function UpsertResultToSheet(ws As Worksheet, resultObj As Object, reset As Boolean) As Long
+    Dim keyIndex As Object
+    Dim headerIndex As Object
+    Dim lastRow As Long, lastCol As Long
+    Dim row As Long, col As Long
+    Dim keyValue As String
+    Dim colName As Variant
+    Dim keyName As Variant
+    Dim recordItem As Variant
+    
+    If reset Or ws.Cells(1, 1).Value = "" Then
+        ws.Cells.Clear
+        col = 1
+        For Each colName In resultObj("columns")
+            ws.Cells(1, col).Value = colName
+            ws.Cells(1, col).Font.Bold = True
+            col = col + 1
+        Next colName
+    End If
+    
+    ' 見出し -> 列番号
+    Set headerIndex = CreateObject("Scripting.Dictionary")
+    lastCol = ws.Cells(1, ws.Columns.Count).End(xlToLeft).Column
+    For col = 1 To lastCol
+        headerIndex(CStr(ws.Cells(1, col).Value)) = col
+    Next col
+    For Each colName In resultObj("columns")
+        If Not headerIndex.Exists(CStr(colName)) Then
+            lastCol = lastCol + 1
+            ws.Cells(1, lastCol).Value = colName
+            ws.Cells(1, lastCol).Font.Bold = True
+            headerIndex(CStr(colName)) = lastCol
+        End If
+    Next colName
+    
+    ' キー -> 行番号（既存の行）
+    Set keyIndex = CreateObject("Scripting.Dictionary")
+    lastRow = ws.Cells(ws.Rows.Count, headerIndex(CStr(resultObj("key_columns")(1)))).End(xlUp).row
+    For row = 2 To lastRow
+        keyValue = ""
+        For Each keyName In resultObj("key_columns")
+            keyValue = keyValue & vbTab & CStr(ws.Cells(row, headerIndex(CStr(keyName))).Value)
+        Next keyName
+        keyIndex(keyValue) = row
+    Next row
+    
+    For Each recordItem In resultObj("rows")
+        keyValue = ""
+        For Each keyName In resultObj("key_columns")
+            keyValue = keyValue & vbTab & CStr(recordItem(keyName))
+        Next keyName
+        
+        If keyIndex.Exists(keyValue) Then
+            row = keyIndex(keyValue)
+        Else
+            lastRow = lastRow + 1
+            row = lastRow
+            keyIndex(keyValue) = row
+        End If
+        
+        For Each colName In resultObj("columns")
+            ws.Cells(row, headerIndex(CStr(colName))).Value = recordItem(colName)
+        Next colName
+        UpsertResultToSheet = UpsertResultToSheet + 1
+    Next recordItem
+End Function
+
+' 「RefreshQueries」シート（A列: 出力シート名, B列: 登録済みクエリ名, C列: watermark（自動更新）, D列: 結果）の
+' クエリを差分で更新する（C列が空の行は全件を取得）。1回の取得行数は応答時間に合わせて増減する
+Sub RefreshRegisteredQueries()
+    Dim querySheet As Worksheet
+    Dim ws As Worksheet
+    Dim result As String
+    Dim jsonObj As Object
+    Dim i As Long
+    Dim lastRow As Long
+    Dim pageRows As Long
+    Dim pages As Long
+    Dim changedRows As Long
+    Dim elapsedMs As Long
+    Dim summary As String
+    Dim hasMore As Boolean
+    
+    Set querySheet = ThisWorkbook.Worksheets("RefreshQueries")
+    lastRow = querySheet.Cells(querySheet.Rows.Count, 1).End(xlUp).row
+    
+    Application.ScreenUpdating = False
+    For i = 2 To lastRow
+        If querySheet.Cells(i, 1).Value <> "" Then
+            On Error Resume Next
+            Set ws = Nothing
+            Set ws = ThisWorkbook.Worksheets(CStr(querySheet.Cells(i, 1).Value))
+            On Error GoTo 0
+            If ws Is Nothing Then
+                Set ws = ThisWorkbook.Worksheets.Add(After:=ThisWorkbook.Worksheets(ThisWorkbook.Worksheets.Count))
+                ws.name = CStr(querySheet.Cells(i, 1).Value)
+            End If
+            
+            pageRows = REFRESH_INITIAL_ROWS
+            pages = 0
+            changedRows = 0
+            elapsedMs = 0
+            Do
+                result = ExecuteRDSRefresh(CStr(querySheet.Cells(i, 2).Value), CStr(querySheet.Cells(i, 3).Value), pageRows)
+                Set jsonObj = JsonConverter.ParseJson(result)
+                If Not jsonObj("success") Then
+                    querySheet.Cells(i, 4).Value = "エラー: " & jsonObj("error")
+                    Exit Do
+                End If
+                
+                changedRows = changedRows + UpsertResultToSheet(ws, jsonObj, jsonObj("reset"))
+                querySheet.Cells(i, 3).Value = jsonObj("watermark")
+                pages = pages + 1
+                elapsedMs = elapsedMs + jsonObj("execution_time_ms")
+                hasMore = jsonObj("has_more")
+                
+                ' 応答が速ければ1回の行数を増やし、目標時間を超えたら減らす
+                If jsonObj("execution_time_ms") < REFRESH_TARGET_MS / 2 Then
+                    pageRows = Application.WorksheetFunction.Min(pageRows * 2, REFRESH_MAX_ROWS)
+                ElseIf jsonObj("execution_time_ms") > REFRESH_TARGET_MS Then
+                    pageRows = Application.WorksheetFunction.Max(pageRows \ 2, REFRESH_MIN_ROWS)
+                End If
+            Loop While hasMore
+            
+            If jsonObj("success") Then
+                querySheet.Cells(i, 4).Value = Format(Now, "yyyy/mm/dd hh:nn:ss") & " " & changedRows & "行 (" & pages & "回, " & elapsedMs & "ms)"
+            End If
+            summary = summary & querySheet.Cells(i, 1).Value & ": " & querySheet.Cells(i, 4).Value & vbCrLf
+        End If
+    Next i
+    Application.ScreenUpdating = True
+    
+    MsgBox "差分更新完了！" & vbCrLf & summary, vbInformation, "成功"
+End Sub
+
 ' 結果をワークシートに展開
 Sub QueryToSheet()
     Dim sql As String
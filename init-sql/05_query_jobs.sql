@@ -0,0 +1,25 @@
+-- init-sql/05_query_jobs.sql
+
+-- 非同期クエリジョブ管理テーブル（query_executorのsubmit/status/cancelで使用）
+CREATE TABLE IF NOT EXISTS query_jobs (
+    job_id VARCHAR(36) PRIMARY KEY,
+    status VARCHAR(20) NOT NULL DEFAULT 'QUEUED', -- QUEUED / RUNNING / CANCELLING / SUCCEEDED / FAILED / CANCELLED
+    sql_query TEXT NOT NULL,
+    output_format VARCHAR(10) NOT NULL DEFAULT 'csv',
+    output_name VARCHAR(255),
+    output_location TEXT,
+    rows_written BIGINT NOT NULL DEFAULT 0,
+    bytes_written BIGINT NOT NULL DEFAULT 0,
+    backend_pid INTEGER,
+    backend_endpoint VARCHAR(255), -- レプリカで実行中の場合の接続先（キャンセル用）
+    error_message TEXT,
+    submitted_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- レプリカへの振り分け前に作成したテーブル用
+ALTER TABLE query_jobs ADD COLUMN IF NOT EXISTS backend_endpoint VARCHAR(255);
+
+CREATE INDEX IF NOT EXISTS idx_query_jobs_status ON query_jobs (status, submitted_at);
@@ -0,0 +1,15 @@
+-- init-sql/06_query_stats.sql
+
+-- クエリ形状ごとの実行統計（api_query_executor / query_executor が記録し、index_advisor が分析）
+CREATE TABLE IF NOT EXISTS query_stats (
+    query_hash VARCHAR(32) NOT NULL,
+    source VARCHAR(20) NOT NULL, -- api / export
+    query_shape TEXT NOT NULL,
+    calls BIGINT NOT NULL DEFAULT 0,
+    total_time_ms BIGINT NOT NULL DEFAULT 0,
+    max_time_ms BIGINT NOT NULL DEFAULT 0,
+    total_rows BIGINT NOT NULL DEFAULT 0,
+    first_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (query_hash, source)
+);
@@ -0,0 +1,11 @@
+-- init-sql/07_csv_load_index_backup.sql
+
+-- 初回ロードモードで一時削除したインデックス定義の退避先（ロード失敗時の復元用）
+CREATE TABLE IF NOT EXISTS csv_load_index_backup (
+    table_name VARCHAR(63) NOT NULL,
+    index_name VARCHAR(63) NOT NULL,
+    index_def TEXT NOT NULL,
+    source_file TEXT,
+    dropped_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (table_name, index_name)
+);
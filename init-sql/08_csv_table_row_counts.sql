@@ -0,0 +1,9 @@
+-- init-sql/08_csv_table_row_counts.sql
+
+-- CSVロードで挿入した行数の記録（最終行数をCOUNT(*)せずに返すため、バッチのコミットと同じトランザクションで加算）
+CREATE TABLE IF NOT EXISTS csv_table_row_counts (
+    table_name VARCHAR(63) PRIMARY KEY,
+    row_count BIGINT NOT NULL DEFAULT 0,
+    last_source_file TEXT,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
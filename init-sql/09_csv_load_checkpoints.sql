@@ -0,0 +1,16 @@
+-- init-sql/09_csv_load_checkpoints.sql
+
+-- CSVロードのチェックポイント（バッチのコミットと同じトランザクションで処理済みの行番号とバイト位置を更新し、
+-- 続きの起動やタイムアウトした起動の再実行時は、同じファイル（ETag）であればその位置からS3を範囲指定で読み込む）
+CREATE TABLE IF NOT EXISTS csv_load_checkpoints (
+    source_file TEXT PRIMARY KEY,
+    etag VARCHAR(100) NOT NULL,
+    table_name VARCHAR(63) NOT NULL,
+    last_row_number BIGINT NOT NULL DEFAULT 0,
+    byte_offset BIGINT,
+    inserted_rows BIGINT NOT NULL DEFAULT 0,
+    failed_rows BIGINT NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'IN_PROGRESS' CHECK (status IN ('IN_PROGRESS', 'COMPLETED')),
+    started_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,25 @@
+-- init-sql/10_summary_tables.sql
+
+-- 集計テーブルの定義（table_creatorが集計テーブルを作成して初期集計し、csv_processorがロードした行の差分を加算する）
+-- 集計テーブルは (グループ化カラム..., row_count, sum_<カラム>..., updated_at) の形で作成される
+-- グループ化カラムを変更した場合は、集計テーブルを削除してからtable_creatorを再実行すること
+CREATE TABLE IF NOT EXISTS summary_table_definitions (
+    summary_table VARCHAR(63) PRIMARY KEY,
+    source_table VARCHAR(63) NOT NULL,
+    group_columns TEXT[] NOT NULL,
+    sum_columns TEXT[] NOT NULL DEFAULT '{}',
+    description TEXT,
+    last_refreshed_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_summary_table_definitions_source ON summary_table_definitions (source_table);
+
+INSERT INTO summary_table_definitions (summary_table, source_table, group_columns, sum_columns, description) VALUES
+    ('sfc_accounts_by_type', 'sfc_accounts', ARRAY['type', 'is_deleted'], ARRAY['annual_revenue', 'number_of_employees'], '取引先の種別ごとの件数・年間売上・従業員数'),
+    ('sfc_accounts_by_industry', 'sfc_accounts', ARRAY['industry', 'is_deleted'], ARRAY['annual_revenue', 'number_of_employees'], '取引先の業種ごとの件数・年間売上・従業員数'),
+    ('sfc_assets_by_status', 'sfc_assets', ARRAY['status'], ARRAY['price', 'quantity'], '資産のステータスごとの件数・価格・数量')
+ON CONFLICT (summary_table) DO UPDATE
+SET source_table = EXCLUDED.source_table,
+    group_columns = EXCLUDED.group_columns,
+    sum_columns = EXCLUDED.sum_columns,
+    description = EXCLUDED.description;
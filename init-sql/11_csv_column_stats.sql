@@ -0,0 +1,53 @@
+-- init-sql/11_csv_column_stats.sql
+
+-- CSVロード時に集計したカラムの品質統計（ファイル・カラムごとに1行、同じファイルを読み込み直すと上書き）
+-- hll（種類数のHyperLogLogレジスタ）と sketch（t-digestのセントロイドなど）はファイル間でマージできる
+-- 統計はsample_every行ごとに1行を抽出して集計したもの（row_countなどの行数も抽出した行の数）
+CREATE TABLE IF NOT EXISTS csv_column_stats (
+    source_file TEXT NOT NULL,
+    column_name VARCHAR(63) NOT NULL,
+    table_name VARCHAR(63) NOT NULL,
+    etag VARCHAR(100) NOT NULL,
+    data_type VARCHAR(100) NOT NULL,
+    last_row_number BIGINT NOT NULL DEFAULT 0,
+    sample_every INTEGER NOT NULL DEFAULT 1,
+    row_count BIGINT NOT NULL DEFAULT 0,
+    null_count BIGINT NOT NULL DEFAULT 0,
+    invalid_count BIGINT NOT NULL DEFAULT 0,
+    distinct_estimate BIGINT,
+    min_value TEXT,
+    max_value TEXT,
+    min_length INTEGER,
+    max_length INTEGER,
+    length_histogram JSONB,
+    quantiles JSONB,
+    hll BYTEA,
+    sketch JSONB,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (source_file, column_name)
+);
+
+-- 抽出して集計するようになる前に作成したテーブル用
+ALTER TABLE csv_column_stats ADD COLUMN IF NOT EXISTS sample_every INTEGER NOT NULL DEFAULT 1;
+
+CREATE INDEX IF NOT EXISTS idx_csv_column_stats_table ON csv_column_stats (table_name, column_name, updated_at);
+
+-- ファイルごとの空欄率・不正値の割合（Excelやダッシュボードからの参照用）
+CREATE OR REPLACE VIEW csv_column_quality AS
+SELECT
+    table_name,
+    source_file,
+    column_name,
+    data_type,
+    row_count,
+    round(null_count::numeric / NULLIF(row_count, 0), 4) AS null_rate,
+    round(invalid_count::numeric / NULLIF(row_count - null_count, 0), 4) AS invalid_rate,
+    distinct_estimate,
+    min_value,
+    max_value,
+    min_length,
+    max_length,
+    quantiles ->> 'p50' AS median,
+    updated_at,
+    sample_every
+FROM csv_column_stats;
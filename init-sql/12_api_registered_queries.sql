@@ -0,0 +1,31 @@
+-- init-sql/12_api_registered_queries.sql
+
+-- 差分取得（api_query_executorの /refresh）で使う登録済みクエリ
+-- change_columnは行の追加・更新時に進む日時のカラム（NULLの行は返さない）、key_columnsはExcel側で行を置き換えるためのキー
+-- lookback_secondsはchange_columnがCSVの値（Salesforceのlast_modified_dateなど）で、古い日時の行が後から読み込まれる場合に
+-- 前回の位置より前から読み直す秒数（ロード時に設定されるprocessed_atなどでは0でよい）
+CREATE TABLE IF NOT EXISTS api_registered_queries (
+    query_name VARCHAR(100) PRIMARY KEY,
+    sql_query TEXT NOT NULL,
+    change_column VARCHAR(63) NOT NULL,
+    key_columns TEXT[] NOT NULL CHECK (cardinality(key_columns) > 0),
+    lookback_seconds INTEGER NOT NULL DEFAULT 0 CHECK (lookback_seconds >= 0),
+    description TEXT,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 例: sfc_assets の稼働中の装置
+INSERT INTO api_registered_queries (query_name, sql_query, change_column, key_columns, lookback_seconds, description)
+VALUES (
+    'active_assets',
+    'SELECT id, account_id, name, product_code, status, install_date, last_modified_date FROM sfc_assets WHERE NOT is_deleted',
+    'last_modified_date',
+    ARRAY['id'],
+    86400,
+    '稼働中の装置一覧（Excelの差分更新用）'
+)
+ON CONFLICT (query_name) DO NOTHING;
+
+-- 差分の取得を索引の範囲検索にする場合:
+-- CREATE INDEX IF NOT EXISTS idx_sfc_assets_last_modified ON sfc_assets (last_modified_date, id);
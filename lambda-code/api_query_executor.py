@@ -1,17 +1,779 @@
+import base64
+import hashlib
 import json
 import boto3
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 import os
-from datetime import datetime
+import random
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import decimal
+from db_connection import (
+    DB_REPLICA_HOSTS, check_replica, get_connection_params, get_replica_params,
+    is_primary_required, is_proxy_mode, is_replica_available, mark_replica
+)
+from query_stats import normalize_sql, parameterize_sql, record_read_query_stats
+
+# バッチ実行の設定
+BATCH_MAX_QUERIES = int(os.environ.get('BATCH_MAX_QUERIES', '10'))
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', '5'))
+BATCH_QUERY_TIMEOUT_MS = int(os.environ.get('BATCH_QUERY_TIMEOUT_MS', '25000'))
+
+# コストガードの設定
+STATEMENT_TIMEOUT_MS = int(os.environ.get('STATEMENT_TIMEOUT_MS', '25000'))
+MAX_QUERY_COST = float(os.environ.get('MAX_QUERY_COST', '1000000'))
+MAX_ESTIMATED_ROWS = int(os.environ.get('MAX_ESTIMATED_ROWS', '100000'))
+QUERY_GUARD_MODE = os.environ.get('QUERY_GUARD_MODE', 'downgrade')  # reject または downgrade
+DOWNGRADE_ROW_LIMIT = int(os.environ.get('DOWNGRADE_ROW_LIMIT', '10000'))
+PLAN_CACHE_SIZE = int(os.environ.get('PLAN_CACHE_SIZE', '256'))
+PLAN_CACHE_TTL_SEC = int(os.environ.get('PLAN_CACHE_TTL_SEC', '300'))
+
+# 自動パラメータ化したクエリを接続ごとにPREPAREして再利用する設定（プロキシ経由では使わない）
+AUTO_PREPARE = os.environ.get('AUTO_PREPARE', 'true').lower() == 'true'
+PREPARED_CACHE_SIZE = int(os.environ.get('PREPARED_CACHE_SIZE', '64'))
+
+# 登録済みクエリの差分取得（/refresh）: 1回に返す行数と、書き込み中のトランザクションの開始時刻から引く余裕
+REFRESH_PAGE_ROWS = int(os.environ.get('REFRESH_PAGE_ROWS', '5000'))
+REFRESH_MAX_PAGE_ROWS = int(os.environ.get('REFRESH_MAX_PAGE_ROWS', '20000'))
+REFRESH_SAFETY_LAG_SEC = float(os.environ.get('REFRESH_SAFETY_LAG_SEC', '5'))
+
+# ウォームスタート間で再利用するコネクションプール（接続先ごと: "primary" またはレプリカ）
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+# 正規化SQL -> 実行計画の推定値（LRU）
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+
+# 接続 -> パラメータ化したSQL -> PREPARE済みのステートメント（LRU、接続が破棄されると消える）
+_prepared_statements = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+_prepared_totals = {'hits': 0, 'misses': 0, 'planning_ms_saved': 0.0}
 
 class DecimalEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, decimal.Decimal):
             return float(obj)
+        if hasattr(obj, 'isoformat'):
+            return obj.isoformat()
         return super(DecimalEncoder, self).default(obj)
 
+def is_select_query(sql_query):
+    """SELECTクエリかどうかを判定"""
+    return sql_query.upper().strip().startswith('SELECT')
+
+def explain_query(cursor, normalized_sql):
+    """EXPLAIN (FORMAT JSON) で推定コスト・推定行数を取得（正規化SQL単位でキャッシュ）"""
+    now = time.monotonic()
+    
+    with _plan_cache_lock:
+        cached = _plan_cache.get(normalized_sql)
+        if cached and now - cached['cached_at'] < PLAN_CACHE_TTL_SEC:
+            _plan_cache.move_to_end(normalized_sql)
+            return dict(cached['plan_info'], plan_cached=True)
+    
+    cursor.execute(f"EXPLAIN (SUMMARY, FORMAT JSON) {normalized_sql}")
+    row = cursor.fetchone()
+    plan_json = row['QUERY PLAN'] if isinstance(row, dict) else row[0]
+    if isinstance(plan_json, str):
+        plan_json = json.loads(plan_json)
+    root_plan = plan_json[0]['Plan']
+    
+    plan_info = {
+        'estimated_cost': root_plan['Total Cost'],
+        'estimated_rows': root_plan['Plan Rows'],
+        'plan_node': root_plan['Node Type'],
+        'planning_time_ms': plan_json[0].get('Planning Time', 0),
+        'explain_time_ms': int((time.monotonic() - now) * 1000)
+    }
+    
+    with _plan_cache_lock:
+        _plan_cache[normalized_sql] = {'plan_info': plan_info, 'cached_at': now}
+        _plan_cache.move_to_end(normalized_sql)
+        while len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    
+    return dict(plan_info, plan_cached=False)
+
+def guard_query(cursor, sql_query):
+    """実行前に実行計画を確認し、上限超過なら拒否または行数制限付きに格下げする
+    
+    戻り値: (実行するSQL, 実行計画情報, 拒否理由)
+    """
+    normalized_sql = normalize_sql(sql_query)
+    plan_info = explain_query(cursor, normalized_sql)
+    plan_info['downgraded'] = False
+    
+    over_cost = plan_info['estimated_cost'] > MAX_QUERY_COST
+    over_rows = plan_info['estimated_rows'] > MAX_ESTIMATED_ROWS
+    
+    if not over_cost and not over_rows:
+        return normalized_sql, plan_info, None
+    
+    reason = (
+        f"推定コスト {plan_info['estimated_cost']:.0f}（上限 {MAX_QUERY_COST:.0f}）"
+        if over_cost else
+        f"推定行数 {plan_info['estimated_rows']}（上限 {MAX_ESTIMATED_ROWS}）"
+    )
+    
+    if QUERY_GUARD_MODE != 'downgrade':
+        return None, plan_info, f"{reason} を超えるため実行を拒否しました"
+    
+    # LIMIT付きで再見積もりし、上限内に収まれば格下げして実行
+    limited_sql = f"SELECT * FROM ({normalized_sql}) AS guarded_query LIMIT {DOWNGRADE_ROW_LIMIT}"
+    limited_plan = explain_query(cursor, limited_sql)
+    
+    if limited_plan['estimated_cost'] > MAX_QUERY_COST:
+        return None, plan_info, f"{reason} を超え、行数制限を付けても上限内に収まらないため実行を拒否しました"
+    
+    print(f"Query downgraded: {reason} -> LIMIT {DOWNGRADE_ROW_LIMIT}")
+    limited_plan.update({
+        'downgraded': True,
+        'downgrade_reason': reason,
+        'row_limit': DOWNGRADE_ROW_LIMIT,
+        'original_estimated_cost': plan_info['estimated_cost'],
+        'original_estimated_rows': plan_info['estimated_rows']
+    })
+    return limited_sql, limited_plan, None
+
+def get_statement_cache(conn):
+    """接続ごとのPREPARE済みステートメントのLRUを取得"""
+    with _prepared_lock:
+        cache = _prepared_statements.get(conn)
+        if cache is None:
+            cache = _prepared_statements[conn] = OrderedDict()
+        return cache
+
+def prepare_statement(cursor, cache, shape, entry):
+    """パラメータ化したSQLをPREPAREしてLRUに登録する
+    
+    PREPAREできないSQLはセーブポイントまで戻し、名前なしで登録して以降はそのまま実行する。
+    LRUから追い出したステートメントはDEALLOCATEする。
+    """
+    name = entry['name'] if entry and entry['name'] else f"api_{hashlib.md5(shape.encode('utf-8')).hexdigest()[:16]}"
+    
+    cursor.execute("SAVEPOINT auto_prepare")
+    try:
+        if entry and entry['name']:
+            cursor.execute(f"DEALLOCATE {name}")
+        cursor.execute(f"PREPARE {name} AS {shape}")
+        cursor.execute("RELEASE SAVEPOINT auto_prepare")
+    except psycopg2.Error as e:
+        print(f"PREPAREできないため通常の実行に切り替えます: {str(e).strip()}")
+        cursor.execute("ROLLBACK TO SAVEPOINT auto_prepare")
+        name = None
+    
+    cache[shape] = {'name': name, 'executions': 0}
+    cache.move_to_end(shape)
+    while len(cache) > PREPARED_CACHE_SIZE:
+        _, evicted = cache.popitem(last=False)
+        if evicted['name']:
+            cursor.execute(f"DEALLOCATE {evicted['name']}")
+    return cache[shape]
+
+def execute_prepared(cursor, name, params):
+    """PREPARE済みのステートメントをEXECUTEする
+    
+    結果の形が変わってPREPAREし直す場合に戻れるよう、同じ往復でセーブポイントを作る
+    （結果を読むカーソルで続けてRELEASEできないため、セーブポイントはトランザクションの終わりまで残す）。
+    """
+    if params:
+        cursor.execute(f"SAVEPOINT auto_execute; EXECUTE {name}({', '.join(['%s'] * len(params))})", params)
+    else:
+        cursor.execute(f"SAVEPOINT auto_execute; EXECUTE {name}")
+
+def execute_query(cursor, sql_query, planning_time_ms):
+    """SELECTを実行する（リテラルをパラメータにしたSQLを接続ごとにPREPAREし、同じ形のクエリはEXECUTEで再利用）
+    
+    戻り値はプリペアドステートメントの利用状況（使わなかった場合はNone）。
+    再利用時は解析・書き換えと（汎用プランが選ばれていれば）計画作成が省かれるため、
+    EXPLAINで測った計画作成時間を削減できた時間の推定値とする。
+    """
+    if not AUTO_PREPARE or is_proxy_mode():
+        cursor.execute(sql_query)
+        return None
+    
+    shape, params = parameterize_sql(sql_query)
+    cache = get_statement_cache(cursor.connection)
+    entry = cache.get(shape)
+    hit = entry is not None
+    if hit:
+        cache.move_to_end(shape)
+    else:
+        entry = prepare_statement(cursor, cache, shape, entry)
+    
+    if entry['name'] is None:
+        cursor.execute(sql_query)
+        return {'hit': False, 'statement': None, 'parameters': len(params)}
+    
+    try:
+        execute_prepared(cursor, entry['name'], params)
+    except psycopg2.Error as e:
+        if getattr(e, 'pgcode', None) != '0A000':
+            raise
+        # 結果の列が変わった（SELECT * の対象にカラムを追加した等）場合は、PREPAREし直して1回だけ再実行する
+        print(f"プリペアドステートメントの結果の形が変わったためPREPAREし直します: {entry['name']}")
+        cursor.execute("ROLLBACK TO SAVEPOINT auto_execute")
+        hit = False
+        entry = prepare_statement(cursor, cache, shape, entry)
+        if entry['name'] is None:
+            cursor.execute(sql_query)
+            return {'hit': False, 'statement': None, 'parameters': len(params)}
+        execute_prepared(cursor, entry['name'], params)
+    entry['executions'] += 1
+    
+    planning_ms_saved = planning_time_ms if hit else 0
+    with _prepared_lock:
+        _prepared_totals['hits' if hit else 'misses'] += 1
+        _prepared_totals['planning_ms_saved'] += planning_ms_saved
+        calls = _prepared_totals['hits'] + _prepared_totals['misses']
+        return {
+            'hit': hit,
+            'statement': entry['name'],
+            'parameters': len(params),
+            'executions': entry['executions'],
+            'planning_ms_saved': round(planning_ms_saved, 3),
+            'hit_rate': round(_prepared_totals['hits'] / calls, 3),
+            'total_planning_ms_saved': round(_prepared_totals['planning_ms_saved'], 3)
+        }
+
+def get_connection_pool(endpoint=None):
+    """バッチ実行用のコネクションプールを取得（未作成なら作成、endpoint指定時はそのレプリカのプール）"""
+    key = endpoint or 'primary'
+    
+    with _connection_pools_lock:
+        pool = _connection_pools.get(key)
+        if pool is None or pool.closed:
+            print(f"Creating connection pool: {key}, maxconn={BATCH_MAX_WORKERS}")
+            params = get_replica_params(endpoint) if endpoint else get_connection_params()
+            pool = _connection_pools[key] = psycopg2.pool.ThreadedConnectionPool(
+                minconn=1,
+                maxconn=BATCH_MAX_WORKERS,
+                **params
+            )
+    
+    return pool
+
+def select_read_endpoint(require_primary):
+    """読み取りの接続先レプリカを選び、プールを用意する（使えるレプリカがなければNone = プライマリ）"""
+    if require_primary:
+        return None
+    
+    candidates = [endpoint for endpoint in DB_REPLICA_HOSTS if is_replica_available(endpoint)]
+    random.shuffle(candidates)
+    for endpoint in candidates:
+        try:
+            get_connection_pool(endpoint)
+            return endpoint
+        except psycopg2.Error as e:
+            mark_replica(endpoint, False, error=str(e).strip())
+    return None
+
+def borrow_connection(endpoint):
+    """プールから接続を借りる（レプリカの遅延が上限を超えていればプライマリのプールから借りる）
+    
+    戻り値は(プール, 接続, 接続先の情報)。
+    """
+    if endpoint and is_replica_available(endpoint):
+        try:
+            pool = get_connection_pool(endpoint)
+            conn = pool.getconn()
+        except psycopg2.Error as e:
+            mark_replica(endpoint, False, error=str(e).strip())
+        else:
+            if check_replica(conn, endpoint):
+                return pool, conn, {'role': 'replica', 'endpoint': endpoint}
+            pool.putconn(conn, close=True)
+    
+    pool = get_connection_pool()
+    return pool, pool.getconn(), {'role': 'primary'}
+
+def execute_named_query(endpoint, name, sql_query, timeout_ms):
+    """プールから接続を借りて1クエリを実行し、結果を辞書で返す"""
+    result = {
+        'name': name,
+        'query': sql_query[:100] + '...' if len(sql_query) > 100 else sql_query
+    }
+    
+    pool = None
+    conn = None
+    broken = False
+    start_time = datetime.now()
+    
+    try:
+        pool, conn, read_target = borrow_connection(endpoint)
+        result['read_target'] = read_target['role']
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        
+        # 読み取り専用トランザクション内でタイムアウトを設定して実行
+        cursor.execute("SET TRANSACTION READ ONLY; SET LOCAL statement_timeout = %s", (timeout_ms,))
+        guarded_sql, plan_info, rejection = guard_query(cursor, sql_query)
+        
+        if rejection:
+            cursor.close()
+            conn.rollback()
+            result.update({
+                'success': False,
+                'error': rejection,
+                'message': rejection,
+                'type': 'QueryRejected',
+                'plan': plan_info
+            })
+        else:
+            query_start = time.monotonic()
+            plan_info['prepared'] = execute_query(cursor, guarded_sql, plan_info['planning_time_ms'])
+            rows = cursor.fetchall()
+            column_names = [desc[0] for desc in cursor.description] if cursor.description else []
+            cursor.close()
+            conn.rollback()
+            
+            plan_info['actual_rows'] = len(rows)
+            plan_info['query_time_ms'] = int((time.monotonic() - query_start) * 1000)
+            record_read_query_stats(conn, read_target, 'api', sql_query, plan_info['query_time_ms'], len(rows))
+            result.update({
+                'success': True,
+                'columns': column_names,
+                'rows': rows,
+                'row_count': len(rows),
+                'truncated': plan_info['downgraded'] and len(rows) >= DOWNGRADE_ROW_LIMIT,
+                'plan': plan_info
+            })
+        
+    except psycopg2.Error as e:
+        print(f"Database error in batch query '{name}': {e}")
+        # query_canceled（57014）はstatement_timeoutによる打ち切り
+        is_timeout = getattr(e, 'pgcode', None) == '57014'
+        result.update({
+            'success': False,
+            'error': 'クエリがタイムアウトしました' if is_timeout else 'データベースエラー',
+            'message': str(e),
+            'type': 'QueryTimeout' if is_timeout else 'DatabaseError'
+        })
+        if conn is not None:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        
+    except Exception as e:
+        print(f"Unexpected error in batch query '{name}': {e}")
+        result.update({
+            'success': False,
+            'error': '予期しないエラー',
+            'message': str(e),
+            'type': type(e).__name__
+        })
+        broken = True
+        
+    finally:
+        if conn is not None:
+            pool.putconn(conn, close=broken or bool(conn.closed))
+    
+    result['execution_time_ms'] = int((datetime.now() - start_time).total_seconds() * 1000)
+    return result
+
+def handle_batch_request(body, headers):
+    """複数の名前付きクエリを並列実行して1つのレスポンスにまとめる"""
+    queries = body.get('queries')
+    
+    if not isinstance(queries, list) or not queries:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({
+                'error': 'クエリ一覧が指定されていません',
+                'usage': {
+                    'description': 'POSTボディにJSONで"queries"キーに名前付きクエリの配列を指定してください',
+                    'example': {
+                        'queries': [
+                            {'name': 'accounts', 'sql': 'SELECT * FROM accounts LIMIT 10;'},
+                            {'name': 'products', 'sql': 'SELECT * FROM products LIMIT 10;'}
+                        ],
+                        'timeout_ms': 10000
+                    }
+                }
+            }, ensure_ascii=False)
+        }
+    
+    if len(queries) > BATCH_MAX_QUERIES:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({
+                'error': f'1回のバッチで実行できるクエリは{BATCH_MAX_QUERIES}件までです',
+                'query_count': len(queries)
+            }, ensure_ascii=False)
+        }
+    
+    # 入力チェック（名前の重複・SELECT以外を事前に弾く）
+    named_queries = []
+    for index, query in enumerate(queries):
+        name = str(query.get('name') or f'query{index + 1}') if isinstance(query, dict) else f'query{index + 1}'
+        sql_query = query.get('sql', '').strip() if isinstance(query, dict) else ''
+        
+        if not sql_query:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({
+                    'error': f"クエリ '{name}' にSQLが指定されていません"
+                }, ensure_ascii=False)
+            }
+        
+        if not is_select_query(sql_query):
+            return {
+                'statusCode': 403,
+                'headers': headers,
+                'body': json.dumps({
+                    'error': 'SELECTクエリのみ実行可能です',
+                    'name': name,
+                    'query': sql_query[:50] + '...' if len(sql_query) > 50 else sql_query
+                }, ensure_ascii=False)
+            }
+        
+        if any(name == existing[0] for existing in named_queries):
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({
+                    'error': f"クエリ名 '{name}' が重複しています"
+                }, ensure_ascii=False)
+            }
+        
+        timeout_ms = min(int(query.get('timeout_ms', body.get('timeout_ms', BATCH_QUERY_TIMEOUT_MS))), BATCH_QUERY_TIMEOUT_MS)
+        named_queries.append((name, sql_query, timeout_ms))
+    
+    print(f"Batch request: {len(named_queries)} queries, workers={min(len(named_queries), BATCH_MAX_WORKERS)}")
+    
+    # 読み取り専用のクエリはレプリカで実行（"consistency": "primary" の場合はプライマリに固定）
+    endpoint = select_read_endpoint(is_primary_required(body))
+    print(f"Batch read target: {endpoint or 'primary'}")
+    
+    # 並列実行（所要時間は最も遅いクエリに律速される）
+    start_time = datetime.now()
+    with ThreadPoolExecutor(max_workers=min(len(named_queries), BATCH_MAX_WORKERS)) as executor:
+        futures = [
+            executor.submit(execute_named_query, endpoint, name, sql_query, timeout_ms)
+            for name, sql_query, timeout_ms in named_queries
+        ]
+        results = [future.result() for future in futures]
+    total_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
+    
+    failed_count = sum(1 for result in results if not result['success'])
+    
+    for result in results:
+        print(f"  - {result['name']}: success={result['success']}, {result['execution_time_ms']}ms")
+    
+    response_body = {
+        'success': failed_count == 0,
+        'results': {result['name']: result for result in results},
+        'query_count': len(results),
+        'failed_count': failed_count,
+        'total_execution_time_ms': total_time_ms,
+        'timestamp': datetime.now().isoformat()
+    }
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps(response_body, ensure_ascii=False, cls=DecimalEncoder)
+    }
+
+def quote_column(name):
+    """カラム名を二重引用符で囲む"""
+    return '"' + name.replace('"', '""') + '"'
+
+def encode_watermark(state):
+    """差分取得の位置をクライアントに渡す文字列にする（クライアントは中身を解釈せずに次の要求で返す）"""
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+def decode_watermark(token):
+    """クライアントから受け取った位置を復元（解釈できなければNone）"""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except (ValueError, UnicodeError):
+        return None
+    return state if isinstance(state, dict) else None
+
+def get_registered_query(cursor, query_name):
+    """登録済みクエリを取得し、定義のハッシュ（定義が変わったら差分でなく全件を返すため）を付けて返す"""
+    cursor.execute("""
+        SELECT query_name, sql_query, change_column, key_columns, lookback_seconds
+        FROM api_registered_queries
+        WHERE query_name = %s
+    """, (query_name,))
+    registered = cursor.fetchone()
+    if registered is None:
+        return None
+    
+    registered = dict(registered)
+    definition = json.dumps([
+        registered['sql_query'], registered['change_column'], registered['key_columns'], registered['lookback_seconds']
+    ])
+    registered['definition_hash'] = hashlib.md5(definition.encode('utf-8')).hexdigest()[:12]
+    return registered
+
+def get_refresh_upper_bound(cursor):
+    """今回の差分取得で返す範囲の上限（これ以下の日時の行は全てコミット済みとみなせる位置）
+    
+    書き込み中のトランザクションの行は開始時刻（CURRENT_TIMESTAMP）で記録され、コミット後に古い日時で現れるため、
+    実行中で書き込みを行っている最も古いトランザクションの開始時刻より前までに限り、さらに余裕を引く。
+    """
+    cursor.execute("""
+        SELECT least(statement_timestamp(), min(xact_start)) - make_interval(secs => %s) AS upper_bound
+        FROM pg_stat_activity
+        WHERE backend_xid IS NOT NULL AND pid <> pg_backend_pid()
+    """, (REFRESH_SAFETY_LAG_SEC,))
+    return cursor.fetchone()['upper_bound']
+
+def build_refresh_sql(cursor, registered, state, page_rows):
+    """登録済みクエリを差分取得用に包む（変更日時・キーの順に並べ、位置より後ろをpage_rows + 1行まで）"""
+    change_column = quote_column(registered['change_column'])
+    order_columns = [change_column] + [quote_column(col) for col in registered['key_columns']]
+    
+    conditions = [cursor.mogrify(f"{change_column} <= %s::timestamptz", (state['upper'],)).decode('utf-8')]
+    if state.get('after'):
+        # ページの途中: 前のページの最後の行より（変更日時, キー）の順で後ろ
+        # 値が全てパラメータになるよう行の比較を展開し、変更日時の範囲条件を先頭に置く（索引の範囲検索用）
+        # キーのNULL（位置ではnull）はORDER BYの既定どおり最後に並ぶものとして比較する
+        after_time = cursor.mogrify('%s::timestamptz', (state['after'][0],)).decode('utf-8')
+        comparisons = [(f"{change_column} > {after_time}", f"{change_column} = {after_time}")]
+        for column, value in zip(order_columns[1:], state['after'][1:]):
+            if value is None:
+                comparisons.append(('FALSE', f"{column} IS NULL"))
+            else:
+                literal = cursor.mogrify('%s', (value,)).decode('utf-8')
+                comparisons.append((f"({column} > {literal} OR {column} IS NULL)", f"{column} = {literal}"))
+        expression = comparisons[-1][0]
+        for greater, equal in reversed(comparisons[:-1]):
+            expression = f"({greater} OR ({equal} AND {expression}))"
+        conditions.append(f"{change_column} >= {after_time} AND {expression}")
+    elif state.get('since'):
+        since = datetime.fromisoformat(state['since']) - timedelta(seconds=registered['lookback_seconds'])
+        conditions.append(cursor.mogrify(f"{change_column} > %s::timestamptz", (since.isoformat(),)).decode('utf-8'))
+    
+    return (
+        f"SELECT * FROM ({normalize_sql(registered['sql_query'])}) AS refresh_query "
+        f"WHERE {' AND '.join(conditions)} "
+        f"ORDER BY {', '.join(order_columns)} "
+        f"LIMIT {page_rows + 1}"
+    )
+
+def handle_refresh_request(body, headers):
+    """登録済みクエリの差分取得（前回の位置より後に追加・更新された行と、次回の位置を返す）
+    
+    位置を指定しない場合・登録内容が変わった場合は全件を返し、reset: true でクライアントに置き換えを指示する。
+    1回に返す行数はmax_rowsまでで、残りがあればhas_more: true と途中の位置を返す（同じ上限のまま続きを取得）。
+    """
+    query_name = str(body.get('query_name') or '').strip()
+    if not query_name:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({
+                'error': '登録済みクエリ名が指定されていません',
+                'usage': {
+                    'description': 'POSTボディにJSONで"query_name"と前回の"watermark"（初回は省略）を指定してください',
+                    'example': {'query_name': 'active_assets', 'watermark': '<前回のレスポンスのwatermark>', 'max_rows': 5000}
+                }
+            }, ensure_ascii=False)
+        }
+    
+    page_rows = max(1, min(int(body.get('max_rows', REFRESH_PAGE_ROWS)), REFRESH_MAX_PAGE_ROWS))
+    timeout_ms = min(int(body.get('timeout_ms', STATEMENT_TIMEOUT_MS)), STATEMENT_TIMEOUT_MS)
+    
+    pool = None
+    conn = None
+    broken = False
+    start_time = datetime.now()
+    
+    try:
+        # 上限の判定に書き込み中のトランザクションを参照するため、常にプライマリで実行する
+        pool, conn, read_target = borrow_connection(None)
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute("SET TRANSACTION READ ONLY; SET LOCAL statement_timeout = %s", (timeout_ms,))
+        
+        registered = get_registered_query(cursor, query_name)
+        if registered is None:
+            cursor.close()
+            conn.rollback()
+            return {
+                'statusCode': 404,
+                'headers': headers,
+                'body': json.dumps({'success': False, 'error': f"登録済みクエリ '{query_name}' がありません"}, ensure_ascii=False)
+            }
+        
+        # 前回の位置（別のクエリ・登録内容の変更前の位置は使わず全件を返す）
+        state = decode_watermark(body['watermark']) if body.get('watermark') else None
+        if state and (state.get('query') != query_name or state.get('definition') != registered['definition_hash']):
+            print(f"Refresh watermark does not match the registered query: {query_name}")
+            state = None
+        reset = state is None or (not state.get('since') and not state.get('after'))
+        if state is None:
+            state = {'query': query_name, 'definition': registered['definition_hash']}
+        if not state.get('upper'):
+            state['upper'] = get_refresh_upper_bound(cursor).isoformat()
+        
+        refresh_sql = build_refresh_sql(cursor, registered, state, page_rows)
+        guarded_sql, plan_info, rejection = guard_query(cursor, refresh_sql)
+        if not rejection and plan_info['downgraded']:
+            # 行数制限付きで実行すると page_rows + 1 行に届かず、残りの行を返さないまま位置が上限へ進むため格下げしない
+            rejection = f"{plan_info['downgrade_reason']} を超えるため実行を拒否しました（差分取得は行数制限付きで実行できません）"
+        if rejection:
+            cursor.close()
+            conn.rollback()
+            return {
+                'statusCode': 422,
+                'headers': headers,
+                'body': json.dumps({'success': False, 'error': rejection, 'query_name': query_name, 'plan': plan_info}, ensure_ascii=False)
+            }
+        
+        query_start = time.monotonic()
+        plan_info['prepared'] = execute_query(cursor, guarded_sql, plan_info['planning_time_ms'])
+        rows = cursor.fetchall()
+        column_names = [desc[0] for desc in cursor.description] if cursor.description else []
+        cursor.close()
+        conn.rollback()
+        plan_info['query_time_ms'] = int((time.monotonic() - query_start) * 1000)
+        plan_info['actual_rows'] = len(rows)
+        record_read_query_stats(conn, read_target, 'api', refresh_sql, plan_info['query_time_ms'], len(rows))
+        
+        # 次の位置: 残りがあれば最後の行（同じ上限で続きを取得）、なければ今回の上限（次回はそれより後を取得）
+        has_more = len(rows) > page_rows
+        rows = rows[:page_rows]
+        next_state = {'query': query_name, 'definition': registered['definition_hash']}
+        if has_more:
+            last_row = rows[-1]
+            next_state['upper'] = state['upper']
+            next_state['after'] = [
+                value.isoformat() if hasattr(value, 'isoformat') else None if value is None else str(value)
+                for value in [last_row[registered['change_column']]] + [last_row[col] for col in registered['key_columns']]
+            ]
+        else:
+            next_state['since'] = state['upper']
+        
+        response_body = {
+            'success': True,
+            'query_name': query_name,
+            'columns': column_names,
+            'rows': rows,
+            'row_count': len(rows),
+            'key_columns': registered['key_columns'],
+            'change_column': registered['change_column'],
+            'reset': reset,
+            'has_more': has_more,
+            'watermark': encode_watermark(next_state),
+            'upper_bound': state['upper'],
+            'execution_time_ms': int((datetime.now() - start_time).total_seconds() * 1000),
+            'plan': plan_info,
+            'timestamp': datetime.now().isoformat()
+        }
+        print(f"Refresh {query_name}: {len(rows)} rows, reset={reset}, has_more={has_more}")
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps(response_body, ensure_ascii=False, cls=DecimalEncoder)
+        }
+    
+    except psycopg2.Error as e:
+        print(f"Database error in refresh '{query_name}': {e}")
+        # query_canceled（57014）はstatement_timeoutによる打ち切り
+        is_timeout = getattr(e, 'pgcode', None) == '57014'
+        if conn is not None:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({
+                'error': 'クエリがタイムアウトしました' if is_timeout else 'データベースエラー',
+                'message': str(e),
+                'type': 'QueryTimeout' if is_timeout else 'DatabaseError'
+            }, ensure_ascii=False)
+        }
+    
+    except Exception as e:
+        print(f"Unexpected error in refresh '{query_name}': {e}")
+        broken = True
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({
+                'error': '予期しないエラー',
+                'message': str(e),
+                'type': type(e).__name__
+            }, ensure_ascii=False)
+        }
+    
+    finally:
+        if conn is not None:
+            pool.putconn(conn, close=broken or bool(conn.closed))
+
+def handle_job_request(body, headers):
+    """長時間クエリのジョブ操作をquery_executorに委譲する（submit / status / cancel）"""
+    action = body.get('action', 'submit')
+    
+    if action not in ('submit', 'status', 'cancel'):
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({
+                'error': f'サポートされていないジョブ操作: {action}',
+                'supported_actions': ['submit', 'status', 'cancel']
+            }, ensure_ascii=False)
+        }
+    
+    if action == 'submit':
+        sql_query = body.get('sql', '').strip()
+        if not is_select_query(sql_query):
+            return {
+                'statusCode': 403,
+                'headers': headers,
+                'body': json.dumps({
+                    'error': 'SELECTクエリのみ実行可能です',
+                    'query': sql_query[:50] + '...' if len(sql_query) > 50 else sql_query
+                }, ensure_ascii=False)
+            }
+        payload = {
+            'action': 'submit',
+            'sql': sql_query,
+            'output_format': body.get('output_format', 'csv'),
+            'consistency': body.get('consistency', 'replica')
+        }
+        if body.get('output_name'):
+            payload['output_name'] = body['output_name']
+    else:
+        if not body.get('job_id'):
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'job_idが指定されていません'}, ensure_ascii=False)
+            }
+        payload = {'action': action, 'job_id': body['job_id']}
+    
+    lambda_client = boto3.client('lambda')
+    response = lambda_client.invoke(
+        FunctionName=os.environ['QUERY_EXECUTOR_FUNCTION_NAME'],
+        InvocationType='RequestResponse',
+        Payload=json.dumps(payload).encode('utf-8')
+    )
+    result = json.loads(response['Payload'].read())
+    
+    return {
+        'statusCode': result.get('statusCode', 500),
+        'headers': headers,
+        'body': result.get('body', json.dumps({'error': 'ジョブ操作に失敗しました'}, ensure_ascii=False))
+    }
+
 def lambda_handler(event, context):
     print("=== API Query Executor Lambda ===")
     print(f"Event: {json.dumps(event, ensure_ascii=False)}")
@@ -24,6 +786,10 @@ def lambda_handler(event, context):
         'Access-Control-Allow-Methods': 'POST,OPTIONS'
     }
     
+    pool = None
+    conn = None
+    broken = False
+    
     try:
         # リクエストボディからSQLを取得
         if event.get('httpMethod') == 'OPTIONS':
@@ -33,7 +799,20 @@ def lambda_handler(event, context):
                 'body': json.dumps({'message': 'CORS preflight OK'})
             }
         
-        body = json.loads(event.get('body', '{}'))
+        body = json.loads(event.get('body') or '{}')
+        
+        # 長時間クエリのジョブ操作（/jobs）
+        if event.get('resource') == '/jobs':
+            return handle_job_request(body, headers)
+        
+        # 登録済みクエリの差分取得（/refresh または "query_name" 指定）
+        if event.get('resource') == '/refresh' or 'query_name' in body:
+            return handle_refresh_request(body, headers)
+        
+        # 複数クエリの一括実行（/batch または "queries" 指定）
+        if event.get('resource') == '/batch' or 'queries' in body:
+            return handle_batch_request(body, headers)
+        
         sql_query = body.get('sql', '').strip()
         
         if not sql_query:
@@ -52,7 +831,7 @@ def lambda_handler(event, context):
             }
         
         # SELECTのみ許可（セキュリティ対策）
-        if not sql_query.upper().strip().startswith('SELECT'):
+        if not is_select_query(sql_query):
             return {
                 'statusCode': 403,
                 'headers': headers,
@@ -62,46 +841,66 @@ def lambda_handler(event, context):
                 }, ensure_ascii=False)
             }
         
-        # 環境変数
-        db_host = os.environ['DB_HOST']
-        db_port = os.environ['DB_PORT']
-        db_name = os.environ['DB_NAME']
-        db_user = os.environ['DB_USER']
-        db_password = os.environ['DB_PASSWORD']
-        
-        # データベース接続
-        print(f"Connecting to database: {db_host}:{db_port}")
-        conn = psycopg2.connect(
-            host=db_host,
-            port=int(db_port),
-            database=db_name,
-            user=db_user,
-            password=db_password,
-            connect_timeout=30
-        )
+        # データベース接続（レプリカがあればレプリカ、"consistency": "primary" の場合はプライマリ）
+        # PREPAREしたステートメントをウォームスタート間で再利用するため、プールから借りる
+        pool, conn, read_target = borrow_connection(select_read_endpoint(is_primary_required(body)))
+        print(f"Connecting to database: {read_target.get('endpoint', 'primary')} ({read_target['role']})")
         
         cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         
-        # クエリ実行
+        # リクエスト単位のタイムアウト（上限はSTATEMENT_TIMEOUT_MS）
+        timeout_ms = min(int(body.get('timeout_ms', STATEMENT_TIMEOUT_MS)), STATEMENT_TIMEOUT_MS)
+        cursor.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+        
+        # 実行計画の事前確認（コストガード）
         start_time = datetime.now()
-        cursor.execute(sql_query)
+        guarded_sql, plan_info, rejection = guard_query(cursor, sql_query)
+        plan_info['statement_timeout_ms'] = timeout_ms
+        
+        if rejection:
+            print(f"Query rejected: {rejection}")
+            cursor.close()
+            conn.rollback()
+            return {
+                'statusCode': 422,
+                'headers': headers,
+                'body': json.dumps({
+                    'error': rejection,
+                    'query': sql_query[:100] + '...' if len(sql_query) > 100 else sql_query,
+                    'plan': plan_info,
+                    'limits': {
+                        'max_query_cost': MAX_QUERY_COST,
+                        'max_estimated_rows': MAX_ESTIMATED_ROWS
+                    }
+                }, ensure_ascii=False)
+            }
+        
+        # クエリ実行
+        query_start = time.monotonic()
+        plan_info['prepared'] = execute_query(cursor, guarded_sql, plan_info['planning_time_ms'])
         results = cursor.fetchall()
+        plan_info['query_time_ms'] = int((time.monotonic() - query_start) * 1000)
+        plan_info['actual_rows'] = len(results)
         execution_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
         
         # カラム名取得
         column_names = [desc[0] for desc in cursor.description] if cursor.description else []
         
         cursor.close()
-        conn.close()
+        conn.rollback()
+        record_read_query_stats(conn, read_target, 'api', sql_query, plan_info['query_time_ms'], len(results))
         
-        # 結果を返す
+        # 結果を返す（推定値と実績値を並べてチューニングに使えるようにする）
         response_body = {
             'success': True,
             'query': sql_query[:100] + '...' if len(sql_query) > 100 else sql_query,
             'columns': column_names,
             'rows': results,
             'row_count': len(results),
+            'truncated': plan_info['downgraded'] and len(results) >= DOWNGRADE_ROW_LIMIT,
             'execution_time_ms': execution_time_ms,
+            'plan': plan_info,
+            'read_target': read_target,
             'timestamp': datetime.now().isoformat()
         }
         
@@ -113,18 +912,26 @@ def lambda_handler(event, context):
         
     except psycopg2.Error as e:
         print(f"Database error: {e}")
+        # query_canceled（57014）はstatement_timeoutによる打ち切り
+        is_timeout = getattr(e, 'pgcode', None) == '57014'
+        if conn is not None:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
         return {
             'statusCode': 500,
             'headers': headers,
             'body': json.dumps({
-                'error': 'データベースエラー',
+                'error': 'クエリがタイムアウトしました' if is_timeout else 'データベースエラー',
                 'message': str(e),
-                'type': 'DatabaseError'
+                'type': 'QueryTimeout' if is_timeout else 'DatabaseError'
             }, ensure_ascii=False)
         }
         
     except Exception as e:
         print(f"Unexpected error: {e}")
+        broken = True
         return {
             'statusCode': 500,
             'headers': headers,
@@ -134,3 +941,7 @@ def lambda_handler(event, context):
                 'type': type(e).__name__
             }, ensure_ascii=False)
         }
+        
+    finally:
+        if conn is not None:
+            pool.putconn(conn, close=broken or bool(conn.closed))
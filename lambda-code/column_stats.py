@@ -0,0 +1,433 @@
+import json
+import math
+import os
+import time
+import zlib
+from collections import Counter
+
+import psycopg2
+
+# ロード中にカラムごとの品質統計（空欄率・種類数・最小/最大・長さの分布・分位点）を集計する
+# ロードの負荷を抑えるため、全行ではなくCOLUMN_STATS_SAMPLE_EVERY行ごとに1行を抽出して集計する（1で全行）。
+# バッチ単位にカラムごとの値の並びへ変換してから集計し（集合・長さの計数はC実装の組み込み関数に任せる）、
+# 種類数はHyperLogLog、分位点はt-digestで保持する。どちらもファイル間・起動間でマージできる。
+
+COLUMN_STATS_SAMPLE_EVERY = max(1, int(os.environ.get('COLUMN_STATS_SAMPLE_EVERY', '50')))
+HLL_PRECISION = 12  # レジスタ数 2^12（標準誤差 約1.6%）
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+HASH_BITS = 32
+EXACT_DISTINCT_LIMIT = 1024  # 種類数がこれ以下の間は値の集合をそのまま保持する（ハッシュ計算を省く）
+TDIGEST_COMPRESSION = 100
+TDIGEST_BUFFER_SIZE = 5000
+QUANTILES = (0.01, 0.25, 0.5, 0.75, 0.99)
+NUMERIC_TYPES = ('smallint', 'integer', 'bigint', 'numeric', 'real', 'double precision')
+VALUE_PREVIEW_LENGTH = 200  # 記録する最小値・最大値の文字数
+
+class HyperLogLog:
+    """種類数の推定（レジスタごとの最大値でマージ）
+    
+    ハッシュは起動をまたいで同じ値になる必要があるため、組み込みのhash()ではなくcrc32を使う
+    （crc32の先頭の0の数をランク、crc32に定数を掛けて攪拌した値の上位ビットをレジスタの位置に使う）。
+    最小のレジスタ以下のランクの値はどのレジスタも更新しないため、crc32の大きさでまとめて除いてから1件ずつ処理する。
+    """
+    
+    def __init__(self, registers=None, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(registers) if registers else bytearray(1 << precision)
+        self.floor = 0  # 最小のレジスタの値（以下。レジスタは増えるだけのため、古い値でも除外が減るだけで結果は同じ）
+    
+    def add(self, values):
+        """値（文字列）の集合を追加"""
+        registers = self.registers
+        shift = 64 - self.precision
+        # min(registers)は1件ずつ比較するため、floorの値がレジスタにあるか（memchr）で最小値を進める
+        floor = self.floor
+        while floor <= HASH_BITS and bytes((floor,)) not in registers:
+            floor += 1
+        self.floor = floor
+        hashes = map(zlib.crc32, map(str.encode, values))
+        if floor:
+            # ランクがfloorより大きい（crc32の先頭の0がfloor個以上ある）値だけを残す
+            hashes = filter((1 << (HASH_BITS - floor)).__gt__, hashes)
+        for h in hashes:
+            rank = HASH_BITS + 1 - h.bit_length()
+            index = (h * HASH_MULTIPLIER & 0xFFFFFFFFFFFFFFFF) >> shift
+            if rank > registers[index]:
+                registers[index] = rank
+    
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+    
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+class TDigest:
+    """分位点の推定（マージ型t-digest、スケール関数 k1）"""
+    
+    def __init__(self, centroids=None, compression=TDIGEST_COMPRESSION):
+        self.compression = compression
+        self.centroids = [tuple(c) for c in centroids] if centroids else []
+        self.buffer = []
+    
+    def add(self, values):
+        self.buffer.extend(values)
+        if len(self.buffer) >= TDIGEST_BUFFER_SIZE:
+            self.compress()
+    
+    def merge(self, other):
+        other.compress()
+        self.centroids.extend(other.centroids)
+        self.compress(force=True)
+    
+    def q_limit(self, q):
+        """累積の割合qから、スケール関数 k(q) = δ/(2π)·asin(2q−1) が1増える位置"""
+        k = self.compression / (2 * math.pi) * math.asin(2 * q - 1) + 1
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+    
+    def compress(self, force=False):
+        """バッファと既存のセントロイドを平均値順に並べ、スケール関数の幅ごとにまとめ直す"""
+        if not self.buffer and not force:
+            return
+        points = self.centroids
+        if self.buffer:
+            # バッファはソートして幅ごとの区間の平均にまとめてから既存のセントロイドとマージする
+            values = sorted(self.buffer)
+            self.buffer = []
+            count = len(values)
+            start = 0
+            while start < count:
+                end = min(count, max(start + 1, int(self.q_limit(start / count) * count)))
+                points.append((sum(values[start:end]) / (end - start), end - start))
+                start = end
+        points.sort()
+        if not points:
+            return
+        total = sum(weight for _, weight in points)
+        
+        merged = []
+        mean, weight = points[0]
+        cumulative = 0
+        limit = self.q_limit(0)
+        for point_mean, point_weight in points[1:]:
+            if (cumulative + weight + point_weight) / total <= limit:
+                weight += point_weight
+                mean += (point_mean - mean) * point_weight / weight
+            else:
+                merged.append((mean, weight))
+                cumulative += weight
+                limit = self.q_limit(cumulative / total)
+                mean, weight = point_mean, point_weight
+        merged.append((mean, weight))
+        self.centroids = merged
+    
+    def quantile(self, q):
+        self.compress()
+        if not self.centroids:
+            return None
+        total = sum(weight for _, weight in self.centroids)
+        target = q * total
+        cumulative = 0
+        previous_center = None
+        previous_mean = None
+        for mean, weight in self.centroids:
+            center = cumulative + weight / 2
+            if target <= center:
+                if previous_center is None:
+                    return mean
+                return previous_mean + (mean - previous_mean) * (target - previous_center) / (center - previous_center)
+            previous_center, previous_mean = center, mean
+            cumulative += weight
+        return self.centroids[-1][0]
+
+def length_bucket(length):
+    """長さの分布の区分（0, 1, 2-3, 4-7, 8-15, ...）"""
+    if length < 2:
+        return str(length)
+    low = 1 << (length.bit_length() - 1)
+    return f"{low}-{low * 2 - 1}"
+
+class ColumnStats:
+    """1カラムの統計"""
+    
+    def __init__(self, name, data_type):
+        self.name = name
+        self.data_type = data_type
+        self.numeric = data_type in NUMERIC_TYPES
+        self.row_count = 0
+        self.null_count = 0
+        self.invalid_count = 0
+        self.exact = set()
+        self.hll = None
+        self.lengths = Counter()
+        self.min_value = None
+        self.max_value = None
+        self.tdigest = TDigest() if self.numeric else None
+    
+    def add(self, values):
+        """バッチ内のこのカラムの値（空欄は '' または None）を追加"""
+        self.row_count += len(values)
+        present = list(filter(None, values))
+        self.null_count += len(values) - len(present)
+        if not present:
+            return
+        
+        self.lengths.update(map(len, present))
+        if self.numeric:
+            self.add_numbers(present)
+        
+        distinct = set(present)
+        if self.hll is None:
+            # 文字列の最小値・最大値は、値の集合を保持している間は集合から求める（start_hllまたは出力時）
+            self.exact |= distinct
+            if len(self.exact) > EXACT_DISTINCT_LIMIT:
+                self.start_hll()
+        else:
+            self.hll.add(distinct)
+            if not self.numeric:
+                self.update_range(min(distinct), max(distinct))
+    
+    def update_range(self, low, high):
+        self.min_value = low if self.min_value is None or low < self.min_value else self.min_value
+        self.max_value = high if self.max_value is None or high > self.max_value else self.max_value
+    
+    def update_range_from_exact(self):
+        """保持している値の集合を文字列の最小値・最大値に反映"""
+        if not self.numeric and self.exact:
+            self.update_range(min(self.exact), max(self.exact))
+    
+    def start_hll(self):
+        """値の集合をHyperLogLogに移し、以降は種類数を推定する"""
+        self.update_range_from_exact()
+        self.hll = HyperLogLog()
+        self.hll.add(self.exact)
+        self.exact = set()
+    
+    def add_numbers(self, present):
+        """数値型のカラムは数値として最小・最大と分位点を集計（数値でない値は invalid_count）"""
+        try:
+            numbers = list(map(float, present))
+        except ValueError:
+            numbers = []
+            for value in present:
+                try:
+                    numbers.append(float(value))
+                except ValueError:
+                    self.invalid_count += 1
+        if not all(map(math.isfinite, numbers)):
+            numbers = [number for number in numbers if math.isfinite(number)]
+        if not numbers:
+            return
+        
+        self.update_range(min(numbers), max(numbers))
+        self.tdigest.add(numbers)
+    
+    def merge(self, other):
+        """別のファイル・起動の統計をマージ"""
+        self.row_count += other.row_count
+        self.null_count += other.null_count
+        self.invalid_count += other.invalid_count
+        self.lengths.update(other.lengths)
+        other.update_range_from_exact()
+        if self.hll is None and other.hll is None:
+            self.exact |= other.exact
+            if len(self.exact) > EXACT_DISTINCT_LIMIT:
+                self.start_hll()
+        else:
+            if self.hll is None:
+                self.start_hll()
+            if other.hll is None:
+                self.hll.add(other.exact)
+            else:
+                self.hll.merge(other.hll)
+        for value in (other.min_value, other.max_value):
+            if value is not None:
+                self.update_range(value, value)
+        if self.tdigest is not None and other.tdigest is not None:
+            self.tdigest.merge(other.tdigest)
+    
+    def distinct_estimate(self):
+        return len(self.exact) if self.hll is None else self.hll.estimate()
+    
+    def length_histogram(self):
+        histogram = Counter()
+        for length, count in self.lengths.items():
+            histogram[length_bucket(length)] += count
+        return dict(sorted(histogram.items(), key=lambda item: int(item[0].split('-')[0])))
+    
+    def quantiles(self):
+        if self.tdigest is None:
+            return None
+        values = {f"p{int(q * 100):02d}": self.tdigest.quantile(q) for q in QUANTILES}
+        return values if values['p50'] is not None else None
+    
+    def summary(self):
+        """結果に出力する統計"""
+        self.update_range_from_exact()
+        return {
+            'rows': self.row_count,
+            'null_rate': round(self.null_count / self.row_count, 4) if self.row_count else None,
+            'distinct': self.distinct_estimate(),
+            'distinct_exact': self.hll is None,
+            'invalid': self.invalid_count,
+            'min': self.min_value if self.numeric else preview(self.min_value),
+            'max': self.max_value if self.numeric else preview(self.max_value),
+            'min_length': min(self.lengths) if self.lengths else None,
+            'max_length': max(self.lengths) if self.lengths else None,
+            'length_histogram': self.length_histogram(),
+            'quantiles': self.quantiles()
+        }
+    
+    def sketch(self):
+        """マージ用の状態（exactは値の集合、hllはレジスタ、tdigestはセントロイド）"""
+        state = {'lengths': {str(length): count for length, count in self.lengths.items()}}
+        if self.hll is None:
+            state['exact'] = sorted(self.exact)
+        if self.tdigest is not None:
+            self.tdigest.compress()
+            state['tdigest'] = self.tdigest.centroids
+        if not self.numeric:
+            # マージでは元の値で比較するため、切り詰めずに残す
+            self.update_range_from_exact()
+            state['min'] = self.min_value
+            state['max'] = self.max_value
+        return state
+    
+    @classmethod
+    def from_record(cls, record):
+        """csv_column_statsの行から復元"""
+        stats = cls(record['column_name'], record['data_type'])
+        sketch = record['sketch']
+        if isinstance(sketch, str):
+            sketch = json.loads(sketch)
+        stats.row_count = record['row_count']
+        stats.null_count = record['null_count']
+        stats.invalid_count = record['invalid_count']
+        stats.lengths = Counter({int(length): count for length, count in sketch.get('lengths', {}).items()})
+        if record['hll'] is not None:
+            stats.hll = HyperLogLog(bytes(record['hll']))
+        else:
+            stats.exact = set(sketch.get('exact', []))
+        if stats.numeric:
+            stats.min_value = float(record['min_value']) if record['min_value'] is not None else None
+            stats.max_value = float(record['max_value']) if record['max_value'] is not None else None
+            stats.tdigest = TDigest(sketch.get('tdigest'))
+        else:
+            stats.min_value = sketch.get('min')
+            stats.max_value = sketch.get('max')
+        return stats
+
+def preview(value):
+    """長い文字列は先頭だけにする"""
+    if value is None or len(value) <= VALUE_PREVIEW_LENGTH:
+        return value
+    return value[:VALUE_PREVIEW_LENGTH] + '...'
+
+class ColumnStatsCollector:
+    """ファイル（複数の起動にまたがる場合も含む）のカラムごとの統計"""
+    
+    def __init__(self, columns, sample_every=COLUMN_STATS_SAMPLE_EVERY):
+        # columnsは(カラム名, データ型)のリスト。add_rowsに渡す値のタプルと同じ順にする
+        self.columns = [ColumnStats(name, data_type) for name, data_type in columns]
+        self.sample_every = sample_every
+        self.seen_rows = 0  # add_rows・add_batchに渡された行数（この起動の分、抽出前）
+        self.elapsed = 0.0  # 集計にかかった時間（秒、この起動の分）
+    
+    def add_rows(self, rows):
+        """値のタプルのリストから、バッチをまたいでsample_every行ごとに1行を抽出して追加"""
+        start = time.perf_counter()
+        self.add_sample(self.take_sample(rows))
+        self.elapsed += time.perf_counter() - start
+    
+    def add_batch(self, batch):
+        """挿入するバッチ（(行番号, CSVの行, 値のタプル)のリスト）から抽出して追加"""
+        start = time.perf_counter()
+        self.add_sample([values for _, _, values in self.take_sample(batch)])
+        self.elapsed += time.perf_counter() - start
+    
+    def take_sample(self, rows):
+        """前のバッチからの続きでsample_every行ごとに1行を取り出す"""
+        sample = rows[(-self.seen_rows) % self.sample_every::self.sample_every]
+        self.seen_rows += len(rows)
+        return sample
+    
+    def add_sample(self, sample):
+        """抽出した値のタプルを、カラムごとの並びに入れ替えてから集計"""
+        if sample:
+            for stats, values in zip(self.columns, zip(*sample)):
+                stats.add(values)
+    
+    def merge_records(self, records):
+        """保存済みの統計（前の起動の分）をマージ"""
+        by_name = {stats.name: stats for stats in self.columns}
+        for record in records:
+            if record['column_name'] in by_name:
+                by_name[record['column_name']].merge(ColumnStats.from_record(record))
+    
+    def summary(self):
+        return {stats.name: stats.summary() for stats in self.columns}
+
+def load_column_stats(conn, cursor, source_file, etag, last_row_number):
+    """同じファイル（ETagが一致）の、指定した行番号までの保存済みの統計を取得（取得できなければ空）"""
+    try:
+        cursor.execute("""
+            SELECT column_name, data_type, row_count, null_count, invalid_count, min_value, max_value, hll, sketch
+            FROM csv_column_stats
+            WHERE source_file = %s AND etag = %s AND last_row_number <= %s
+        """, (source_file, etag, last_row_number))
+        records = cursor.fetchall()
+        conn.commit()
+        return records
+    except psycopg2.Error as e:
+        print(f"カラム統計の取得に失敗（この起動の分のみ集計）: {e}")
+        conn.rollback()
+        return []
+
+def save_column_stats(conn, cursor, collector, source_file, etag, table_name, last_row_number):
+    """ファイルの統計を保存する（ファイル・カラムごとに1行、再実行時は上書き）。失敗してもロードは継続
+    
+    row_count・null_count・invalid_countなどは抽出した行の数で、sample_everyに抽出の間隔を記録する。
+    """
+    try:
+        for stats in collector.columns:
+            summary = stats.summary()
+            cursor.execute("""
+                INSERT INTO csv_column_stats (
+                    source_file, column_name, table_name, etag, data_type, last_row_number, sample_every,
+                    row_count, null_count, invalid_count, distinct_estimate, min_value, max_value,
+                    min_length, max_length, length_histogram, quantiles, hll, sketch
+                )
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (source_file, column_name) DO UPDATE SET
+                    table_name = EXCLUDED.table_name, etag = EXCLUDED.etag, data_type = EXCLUDED.data_type,
+                    last_row_number = EXCLUDED.last_row_number, sample_every = EXCLUDED.sample_every,
+                    row_count = EXCLUDED.row_count,
+                    null_count = EXCLUDED.null_count, invalid_count = EXCLUDED.invalid_count,
+                    distinct_estimate = EXCLUDED.distinct_estimate, min_value = EXCLUDED.min_value,
+                    max_value = EXCLUDED.max_value, min_length = EXCLUDED.min_length, max_length = EXCLUDED.max_length,
+                    length_histogram = EXCLUDED.length_histogram, quantiles = EXCLUDED.quantiles,
+                    hll = EXCLUDED.hll, sketch = EXCLUDED.sketch, updated_at = CURRENT_TIMESTAMP
+            """, (
+                source_file, stats.name, table_name, etag, stats.data_type, last_row_number, collector.sample_every,
+                stats.row_count, stats.null_count, stats.invalid_count, summary['distinct'],
+                None if summary['min'] is None else str(summary['min']),
+                None if summary['max'] is None else str(summary['max']),
+                summary['min_length'], summary['max_length'],
+                json.dumps(summary['length_histogram']),
+                json.dumps(summary['quantiles']) if summary['quantiles'] else None,
+                psycopg2.Binary(bytes(stats.hll.registers)) if stats.hll is not None else None,
+                json.dumps(stats.sketch(), ensure_ascii=False)
+            ))
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        print(f"カラム統計の保存に失敗（続行）: {e}")
+        conn.rollback()
+        return False
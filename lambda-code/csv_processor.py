@@ -4,96 +4,625 @@ import psycopg2
 import psycopg2.extras
 import csv
 import io
+import heapq
+import itertools
 import os
+import pickle
 import re
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 from urllib.parse import unquote_plus
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from column_stats import ColumnStatsCollector, load_column_stats, save_column_stats
+from db_connection import describe_target, get_db_connection
+from load_trace import TRACE_SAMPLE_ROWS, build_trace_manifest, sample_csv_records, snapshot_table_schema, write_trace_bundle
+from pg_binary_copy import BinaryCopyStream, get_session_timezone, make_row_encoder, unsupported_columns
+from schema_profiler import PROFILE_SAMPLE_ROWS, profile_csv, render_ddl
+from summary_tables import SummaryDelta, load_summary_definitions, rebuild_summary
 
-def parse_postgres_error(error, row_data, column_info):
-    """PostgreSQLのエラーメッセージを解析して構造化された情報を返す"""
-    error_info = {
-        'error_type': 'UNKNOWN',
-        'error_code': getattr(error, 'pgcode', 'UNKNOWN'),
-        'error_message': str(error),
-        'affected_columns': [],
-        'details': []
+# テーブル/プレフィックス別のロード設定（JSON）
+# 例: {"defaults": {}, "prefixes": {"csv/backfill/": {...}}, "tables": {"sfc_assets": {"initial_load": true}}}
+LOAD_CONFIG = json.loads(os.environ.get('LOAD_CONFIG') or '{}')
+
+# ロードオプションのfilterで真偽値（true/false）を指定した場合に一致するCSVの表記
+FILTER_BOOLEAN_SPELLINGS = {
+    True: ('true', 'TRUE', 'True', 't', 'T', '1'),
+    False: ('false', 'FALSE', 'False', 'f', 'F', '0')
+}
+FILTER_UNSAFE_CHARS = frozenset('"\r\n')
+FILTER_PREFILTER_MIN_LENGTH = 3  # 分割前の判定に使う値の最小の長さ
+
+# 初回ロードモードでインデックスを再作成する並列数
+INDEX_REBUILD_WORKERS = int(os.environ.get('INDEX_REBUILD_WORKERS', '4'))
+INDEX_REBUILD_MAINTENANCE_WORK_MEM = os.environ.get('INDEX_REBUILD_MAINTENANCE_WORK_MEM', '256MB')
+
+# まとめてコミットする行数の初期値（行数の記録もこの単位で同じトランザクション内で更新）
+COMMIT_BATCH_SIZE = int(os.environ.get('COMMIT_BATCH_SIZE', '1000'))
+
+# バッチ行数の自動調整: 1バッチの目標処理時間と行数の範囲、メモリと残り時間の余裕
+BATCH_SIZE_MIN = int(os.environ.get('BATCH_SIZE_MIN', '100'))
+BATCH_SIZE_MAX = int(os.environ.get('BATCH_SIZE_MAX', '20000'))
+BATCH_TARGET_MS = int(os.environ.get('BATCH_TARGET_MS', '2000'))
+BATCH_MEMORY_FRACTION = 0.25
+ROW_MEMORY_FACTOR = 4  # CSVの文字列に対するPythonオブジェクトのオーバーヘッドの見込み
+LOAD_TIME_RESERVE_MS = int(os.environ.get('LOAD_TIME_RESERVE_MS', '30000'))
+
+# 残り時間がこれを下回ったらコミット済みの位置で区切り、続きを自分自身の非同期起動に引き継ぐ
+CONTINUATION_THRESHOLD_MS = int(os.environ.get('CONTINUATION_THRESHOLD_MS', '120000'))
+CONTINUATION_MAX = int(os.environ.get('CONTINUATION_MAX', '50'))
+S3_READ_CHUNK_SIZE = 1024 * 1024
+
+# テーブルのカラム情報をウォームスタート間で保持する秒数（カラムを追加した場合はこの時間内は反映されない）
+TABLE_SCHEMA_CACHE_TTL_SEC = float(os.environ.get('TABLE_SCHEMA_CACHE_TTL_SEC', '300'))
+_table_schema_cache = {}
+
+# 対象テーブルがない場合に、CSVから推定したテーブル定義（CREATE TABLE）を出力するプレフィックス（空欄で無効）
+SCHEMA_PROPOSAL_PREFIX = os.environ.get('SCHEMA_PROPOSAL_PREFIX', 'schema-proposals/')
+SCHEMA_SAMPLE_ROWS = int(os.environ.get('SCHEMA_SAMPLE_ROWS', str(PROFILE_SAMPLE_ROWS)))
+
+# パーティションの作成単位とパーティション名の日付書式
+PARTITION_INTERVALS = {'day': '%Y%m%d', 'month': '%Y%m'}
+PARTITION_KEY_PATTERN = re.compile(r'^RANGE \("?(\w+)"?\)$')
+
+# 重複除去: この行数まではメモリ上で処理し、超えたらキーのハッシュで分割して/tmpに退避する
+DEDUP_MEMORY_ROWS = int(os.environ.get('DEDUP_MEMORY_ROWS', '100000'))
+DEDUP_SPILL_PARTITIONS = int(os.environ.get('DEDUP_SPILL_PARTITIONS', '64'))
+DEDUP_SPILL_DIR = os.environ.get('DEDUP_SPILL_DIR', '/tmp')
+
+# 失敗行のうち、行データ付きで結果に残す件数（以降は件数とエラーサマリーのみ）
+FAILED_DETAILS_LIMIT = 10
+
+# エラーメッセージの解析用（error.diagに値がない場合のみ使う）
+NOT_NULL_PATTERN = re.compile(r'null value in column "([^"]+)"')
+CONSTRAINT_PATTERN = re.compile(r'constraint "([^"]+)"')
+KEY_DETAIL_PATTERN = re.compile(r'Key \((.+?)\)=\((.*)\)', re.S)
+INPUT_SYNTAX_PATTERN = re.compile(r'invalid input syntax for type ([\w ]+): "(.*)"', re.S)
+QUOTED_VALUE_PATTERN = re.compile(r': "(.*)"', re.S)
+VARCHAR_LENGTH_PATTERN = re.compile(r'value too long for type character(?: varying)?\((\d+)\)')
+
+# 協調ロードモード: 対象テーブルへ同時にマージする起動数の上限と、アドバイザリロックの名前空間
+LOAD_MAX_WRITERS = int(os.environ.get('LOAD_MAX_WRITERS', '4'))
+WRITER_LOCK_NAMESPACE = 7370001
+WRITER_WAIT_MIN_REMAINING_MS = 60000
+STAGE_TABLE_PREFIX = 'csv_stage_'
+STAGE_TABLE_MAX_AGE_SEC = 3600
+COPY_BUFFER_SIZE = 256 * 1024  # バイナリ形式のCOPYで1回に送るバイト数
+
+class ByteCountingLineReader:
+    """ボディを行単位で読み、読み終えた位置（ファイル先頭からのバイト数）を記録する
+    
+    csv.readerは1レコード分の行しか読まないため、行を返した直後のoffsetがそのレコードの終わりの位置になる。
+    """
+    
+    def __init__(self, body, start_offset=0):
+        self.body = body
+        self.offset = start_offset
+        self.lines = self.iter_lines(body)
+    
+    def close(self):
+        """ボディを閉じる"""
+        self.body.close()
+    
+    def iter_lines(self, body):
+        """改行を含めたバイト列の行を返す（UTF-8では改行がマルチバイト文字の途中に現れないため行単位で復号できる）"""
+        remainder = b''
+        while True:
+            chunk = body.read(S3_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            lines = (remainder + chunk).split(b'\n')
+            remainder = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+        if remainder:
+            yield remainder
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        line = next(self.lines)
+        self.offset += len(line)
+        return line.decode('utf-8')
+
+class S3CsvSource:
+    """S3のオブジェクトを読み込み元とする（S3イベントで起動された場合）"""
+    
+    def __init__(self, s3_client, bucket_name, object_key):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = object_key
+        self.uri = f"s3://{bucket_name}/{object_key}"
+        self.etag = None
+        self.metadata = None
+    
+    def open(self):
+        """先頭から読むボディを返す（読み直すときに同じ内容か確認するためETagを記録）"""
+        s3_response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.key)
+        self.etag = s3_response.get('ETag', '').strip('"')
+        self.metadata = {
+            'size': s3_response.get('ContentLength'),
+            'content_type': s3_response.get('ContentType'),
+            'last_modified': str(s3_response.get('LastModified')),
+            'user_metadata': s3_response.get('Metadata', {})
+        }
+        return s3_response['Body']
+    
+    def open_from(self, byte_offset):
+        """指定したバイト位置から範囲指定で読むボディを返す（残りの行がなければNone）"""
+        try:
+            s3_response = self.s3_client.get_object(
+                Bucket=self.bucket_name, Key=self.key, IfMatch=self.etag, Range=f"bytes={byte_offset}-"
+            )
+        except self.s3_client.exceptions.ClientError as e:
+            # 読み込み済みの位置がファイルの終わりの場合
+            if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                return None
+            raise
+        return s3_response['Body']
+    
+    def put_text(self, key, text, content_type='application/sql'):
+        """同じバケットにテキストを出力し、出力先を返す"""
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=key, Body=text.encode('utf-8'), ContentType=content_type)
+        return f"s3://{self.bucket_name}/{key}"
+
+class LocalCsvSource:
+    """ローカルのファイルを読み込み元とする（scripts/load-csv-local.py からのバックフィル）
+    
+    keyはLOAD_CONFIGのプレフィックス判定とテーブル名の決定に使うS3キー相当のパス。
+    ETagの代わりに更新日時とサイズを記録し、読み直すときに変更されていればエラーにする。
+    """
+    
+    def __init__(self, path, key=None, uri=None):
+        self.path = path
+        self.key = key or os.path.basename(path)
+        self.uri = uri or f"file://{os.path.abspath(path)}"
+        self.etag = None
+        self.metadata = None
+    
+    def stat_etag(self):
+        """更新日時とサイズからETag相当の値を作る"""
+        stat = os.stat(self.path)
+        return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    
+    def open(self):
+        """先頭から読むボディを返す"""
+        self.etag = self.stat_etag()
+        stat = os.stat(self.path)
+        self.metadata = {'size': stat.st_size, 'last_modified': datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat()}
+        return open(self.path, 'rb')
+    
+    def open_from(self, byte_offset):
+        """指定したバイト位置から読むボディを返す"""
+        if self.stat_etag() != self.etag:
+            raise ValueError(f"読み込み中にファイルが変更されました: {self.path}")
+        body = open(self.path, 'rb')
+        body.seek(byte_offset)
+        return body
+    
+    def put_text(self, key, text, content_type=None):
+        """カレントディレクトリからの相対パスにテキストを出力し、出力先を返す（content_typeは使わない）"""
+        directory = os.path.dirname(key)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(key, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return f"file://{os.path.abspath(key)}"
+
+def propose_table_schema(source, table_name, csv_columns, rows):
+    """残りの行をサンプリングしてテーブル定義を推定し、table_creatorで適用できるSQLファイルを出力する"""
+    start = time.monotonic()
+    profile = profile_csv(csv_columns, rows, SCHEMA_SAMPLE_ROWS)
+    ddl = render_ddl(table_name, profile, source.uri)
+    location = source.put_text(f"{SCHEMA_PROPOSAL_PREFIX}{table_name}_table.sql", ddl)
+    print(f"テーブル定義の案を出力: {location}（{profile['total_rows']}行から{profile['sampled_rows']}行を抽出, {time.monotonic() - start:.1f}秒）")
+    print(ddl)
+    return {
+        'location': location,
+        'total_rows': profile['total_rows'],
+        'sampled_rows': profile['sampled_rows'],
+        'primary_key': profile['primary_key'],
+        'candidate_keys': profile['candidate_keys'],
+        'columns': {col['name']: col['type'] for col in profile['columns']}
     }
+
+def capture_load_trace(source, event, table_name, load_options, schema, status_code, response_body, total_rows, load_start):
+    """ロードを再現するためのトレースを出力し、出力先を返す（入力は読み直して抽出する。失敗してもロードは失敗にしない）"""
+    line_reader = None
+    try:
+        elapsed_ms = round((time.monotonic() - load_start) * 1000)
+        line_reader = ByteCountingLineReader(source.open_from(0))
+        sample_text, sample = sample_csv_records(line_reader, total_rows, TRACE_SAMPLE_ROWS)
+        manifest = build_trace_manifest(
+            event, source, table_name, load_options, schema, status_code, response_body, elapsed_ms, sample
+        )
+        location = write_trace_bundle(source, table_name, manifest, sample_text)
+        print(f"トレースを出力: {location}（{sample['rows']}行を抽出, {sample['stride']}行ごと）")
+        return location
+    except Exception as e:
+        print(f"警告: トレースの出力に失敗: {e}")
+        return None
+    finally:
+        if line_reader:
+            line_reader.close()
+
+def open_csv_from_offset(source, checkpoint, projection, line_filter=None):
+    """チェックポイントのバイト位置から読み直し、(行リーダー, (行番号, 行)の並び)を返す"""
+    byte_offset = checkpoint['byte_offset']
+    print(f"{source.uri} を {byte_offset}バイト目から読み直します（{checkpoint['last_row_number'] + 1}行目から）")
     
-    error_msg = str(error)
+    body = source.open_from(byte_offset)
+    if body is None:
+        return ByteCountingLineReader(io.BytesIO(b''), byte_offset), iter(())
     
-    # NOT NULL制約違反
-    null_matches = re.findall(r'null value in column "([^"]+)" violates not-null constraint', error_msg)
-    if null_matches:
-        error_info['error_type'] = 'NOT_NULL_VIOLATION'
-        for col in null_matches:
-            error_info['affected_columns'].append(col)
-            error_info['details'].append(f"カラム '{col}' にNULL値は許可されていません")
-    
-    # 主キー・一意制約重複
-    pk_match = re.search(r'duplicate key value violates unique constraint "([^"]+)".*Key \(([^)]+)\)=\(([^)]+)\)', error_msg)
-    if pk_match:
-        constraint_name = pk_match.group(1)
-        key_columns = pk_match.group(2)
-        key_values = pk_match.group(3)
-        
-        # 制約名から種類を判定
-        if 'pk' in constraint_name.lower() or 'pkey' in constraint_name.lower():
-            error_info['error_type'] = 'PRIMARY_KEY_VIOLATION'
-        else:
-            error_info['error_type'] = 'UNIQUE_CONSTRAINT_VIOLATION'
+    line_reader = ByteCountingLineReader(body, byte_offset)
+    csv_rows = iter_projected_rows(line_reader, projection, line_filter)
+    return line_reader, enumerate(csv_rows, checkpoint['last_row_number'] + 1)
+
+def invoke_continuation(context, event, checkpoint):
+    """コミット済みの位置から続きを読み込むよう、自分自身を非同期で起動する"""
+    continuation = event.get('continuation', 0) + 1
+    payload = dict(event, continuation=continuation)
+    
+    lambda_client = boto3.client('lambda')
+    lambda_client.invoke(
+        FunctionName=context.function_name,
+        InvocationType='Event',
+        Payload=json.dumps(payload).encode('utf-8')
+    )
+    print(f"続きの処理を起動: {continuation}回目（{checkpoint['last_row_number']}行目まで処理済み）")
+    return continuation
+
+def get_memory_headroom_bytes():
+    """Lambdaのメモリ上限と現在の使用量（RSS）の差を返す"""
+    limit = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '1024')) * 1024 * 1024
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return limit // 2
+    return max(limit - rss, 0)
+
+class BatchSizeController:
+    """実測した往復時間・1行あたりのバイト数・残り時間・メモリの空きから、次のバッチの行数を決める"""
+    
+    def __init__(self, initial_size, context=None):
+        self.batch_size = max(BATCH_SIZE_MIN, min(BATCH_SIZE_MAX, initial_size))
+        self.context = context
+        self.ms_per_row = None
+        self.bytes_per_row = None
+        self.batches = 0
+        self.min_size = self.batch_size
+        self.max_size = self.batch_size
+    
+    def smooth(self, previous, value):
+        """指数移動平均（直近の計測を重視しつつ揺れを抑える）"""
+        return value if previous is None else previous * 0.7 + value * 0.3
+    
+    def observe(self, rows, elapsed_ms, batch_bytes):
+        """コミットしたバッチの計測値から次のバッチの行数を更新する"""
+        if not rows:
+            return
         
-        error_info['affected_columns'].append(key_columns)
-        error_info['details'].append(f"制約 '{constraint_name}' 違反: キー({key_columns})=({key_values}) は既に存在します")
+        self.batches += 1
+        self.ms_per_row = self.smooth(self.ms_per_row, max(elapsed_ms, 1) / rows)
+        self.bytes_per_row = self.smooth(self.bytes_per_row, max(batch_bytes, 1) / rows)
+        
+        # 目標時間に収まる行数（増やすのは1回につき2倍まで、減らすのはすぐに）
+        size = min(BATCH_TARGET_MS / self.ms_per_row, self.batch_size * 2)
+        
+        # 保留中の行が使うメモリがメモリの空きの一定割合に収まる行数
+        memory_budget = get_memory_headroom_bytes() * BATCH_MEMORY_FRACTION
+        size = min(size, memory_budget / (self.bytes_per_row * ROW_MEMORY_FACTOR))
+        
+        # タイムアウト前に次のバッチのコミットが終わる行数
+        if self.context:
+            available_ms = self.context.get_remaining_time_in_millis() - LOAD_TIME_RESERVE_MS
+            size = min(size, available_ms / self.ms_per_row)
+        
+        self.batch_size = int(max(BATCH_SIZE_MIN, min(BATCH_SIZE_MAX, size)))
+        self.min_size = min(self.min_size, self.batch_size)
+        self.max_size = max(self.max_size, self.batch_size)
+    
+    def summary(self):
+        """結果に出力する調整の記録"""
+        return {
+            'batches': self.batches,
+            'final_batch_size': self.batch_size,
+            'min_batch_size': self.min_size,
+            'max_batch_size': self.max_size,
+            'ms_per_row': round(self.ms_per_row, 3) if self.ms_per_row else None,
+            'bytes_per_row': round(self.bytes_per_row) if self.bytes_per_row else None
+        }
+
+def get_load_options(table_name, object_key):
+    """デフォルト → プレフィックス → テーブルの順に設定を重ねてロードオプションを返す"""
+    options = dict(LOAD_CONFIG.get('defaults', {}))
+    
+    # 短いプレフィックスから順に適用し、より具体的な設定で上書きする
+    for prefix, prefix_options in sorted(LOAD_CONFIG.get('prefixes', {}).items(), key=lambda item: len(item[0])):
+        if object_key.startswith(prefix):
+            options.update(prefix_options)
+    
+    options.update(LOAD_CONFIG.get('tables', {}).get(table_name, {}))
+    return options
+
+def defer_secondary_indexes(conn, cursor, table_name, source_file):
+    """空テーブルへの初回ロード前に、制約に紐づかないインデックスを退避して削除する"""
+    cursor.execute(f'SELECT NOT EXISTS (SELECT 1 FROM "{table_name}") AS is_empty')
+    if not cursor.fetchone()['is_empty']:
+        print(f"テーブル '{table_name}' は空ではないため、インデックスを維持したままロードします")
+        return []
+    
+    # 主キー・一意インデックス・制約用インデックスは重複検出に必要なため残す
+    cursor.execute("""
+        SELECT i.relname AS index_name, pg_get_indexdef(ix.indexrelid) AS index_def
+        FROM pg_index ix
+        JOIN pg_class t ON t.oid = ix.indrelid
+        JOIN pg_class i ON i.oid = ix.indexrelid
+        JOIN pg_namespace n ON n.oid = t.relnamespace
+        WHERE n.nspname = 'public'
+          AND t.relname = %s
+          AND NOT ix.indisprimary
+          AND NOT ix.indisunique
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = ix.indexrelid)
+        ORDER BY i.relname
+    """, (table_name,))
+    indexes = cursor.fetchall()
+    
+    if not indexes:
+        print("退避対象のセカンダリインデックスはありません")
+        return []
+    
+    # 定義の退避と削除を同一トランザクションで行い、失敗時も定義が失われないようにする
+    for index in indexes:
+        cursor.execute("""
+            INSERT INTO csv_load_index_backup (table_name, index_name, index_def, source_file)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (table_name, index_name) DO NOTHING
+        """, (table_name, index['index_name'], index['index_def'], source_file))
+        cursor.execute(f'DROP INDEX IF EXISTS "{index["index_name"]}"')
+        print(f"インデックス退避・削除: {index['index_name']}")
+    conn.commit()
+    
+    return [index['index_name'] for index in indexes]
+
+def rebuild_index(index_def):
+    """退避したインデックス定義を専用接続で再作成"""
+    conn = get_db_connection()
+    try:
+        # プロキシ経由でも他の接続に設定が残らないよう、トランザクション内のSET LOCALで指定
+        cursor = conn.cursor()
+        cursor.execute("SELECT set_config('maintenance_work_mem', %s, true)", (INDEX_REBUILD_MAINTENANCE_WORK_MEM,))
+        cursor.execute(re.sub(r'^CREATE (UNIQUE )?INDEX ', r'CREATE \1INDEX IF NOT EXISTS ', index_def))
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+
+def restore_deferred_indexes(table_name):
+    """退避テーブルに残っているインデックスを並列に再作成し、ANALYZEする"""
+    conn = get_db_connection()
+    conn.autocommit = True
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    
+    try:
+        cursor.execute("""
+            SELECT index_name, index_def
+            FROM csv_load_index_backup
+            WHERE table_name = %s
+            ORDER BY index_name
+        """, (table_name,))
+        backups = cursor.fetchall()
+        
+        if not backups:
+            return {'restored_indexes': [], 'restore_errors': [], 'rebuild_ms': 0}
+        
+        print(f"=== インデックス再作成: {len(backups)}個（並列数 {INDEX_REBUILD_WORKERS}） ===")
+        start_time = datetime.now()
+        restored = []
+        errors = []
+        
+        with ThreadPoolExecutor(max_workers=min(len(backups), INDEX_REBUILD_WORKERS)) as executor:
+            futures = {executor.submit(rebuild_index, backup['index_def']): backup for backup in backups}
+            for future, backup in futures.items():
+                try:
+                    future.result()
+                    cursor.execute(
+                        "DELETE FROM csv_load_index_backup WHERE table_name = %s AND index_name = %s",
+                        (table_name, backup['index_name'])
+                    )
+                    restored.append(backup['index_name'])
+                    print(f"インデックス再作成成功: {backup['index_name']}")
+                except Exception as e:
+                    # 定義は退避テーブルに残し、次回ロード時に再試行する
+                    errors.append({'index_name': backup['index_name'], 'error': str(e)})
+                    print(f"インデックス再作成エラー: {backup['index_name']}: {e}")
+        
+        cursor.execute(f'ANALYZE "{table_name}"')
+        rebuild_ms = int((datetime.now() - start_time).total_seconds() * 1000)
+        print(f"インデックス再作成・ANALYZE完了: {rebuild_ms}ms")
+        
+        return {'restored_indexes': restored, 'restore_errors': errors, 'rebuild_ms': rebuild_ms}
+    
+    finally:
+        cursor.close()
+        conn.close()
+
+def find_value_columns(row_data, column_info, value, data_type=None):
+    """エラーメッセージの値を持つカラムを返す（型が分かる場合はその型のカラムに絞る）"""
+    columns = [col for col, col_value in row_data.items() if col_value == value and col in column_info]
+    if data_type and len(columns) > 1:
+        typed_columns = [col for col in columns if column_info[col]['data_type'].startswith(data_type)]
+        columns = typed_columns or columns
+    return columns
+
+def classify_not_null(error_info, diag, message, row_data, column_info):
+    """23502: NOT NULL制約違反"""
+    error_info['error_type'] = 'NOT_NULL_VIOLATION'
+    column = diag.column_name if diag else None
+    if not column:
+        match = NOT_NULL_PATTERN.search(message)
+        column = match.group(1) if match else None
+    if column:
+        error_info['affected_columns'].append(column)
+        error_info['details'].append(f"カラム '{column}' にNULL値は許可されていません")
+
+def classify_unique(error_info, diag, message, row_data, column_info):
+    """23505: 主キー・一意制約の重複"""
+    constraint_name, key_match = get_constraint_and_key(diag, message)
+    
+    # 制約名から種類を判定
+    if constraint_name and ('pk' in constraint_name.lower() or 'pkey' in constraint_name.lower()):
+        error_info['error_type'] = 'PRIMARY_KEY_VIOLATION'
+    else:
+        error_info['error_type'] = 'UNIQUE_CONSTRAINT_VIOLATION'
     
-    # 外部キー制約違反
-    fk_match = re.search(r'violates foreign key constraint "([^"]+)".*Key \(([^)]+)\)=\(([^)]+)\) is not present', error_msg)
-    if fk_match:
-        error_info['error_type'] = 'FOREIGN_KEY_VIOLATION'
-        constraint_name = fk_match.group(1)
-        key_columns = fk_match.group(2)
-        key_values = fk_match.group(3)
-        error_info['affected_columns'].append(key_columns)
+    if key_match:
+        key_columns, key_values = key_match.groups()
+        error_info['affected_columns'].extend(col.strip().strip('"') for col in key_columns.split(','))
+        error_info['details'].append(f"制約 '{constraint_name}' 違反: キー({key_columns})=({key_values}) は既に存在します")
+
+def classify_foreign_key(error_info, diag, message, row_data, column_info):
+    """23503: 外部キー制約違反"""
+    error_info['error_type'] = 'FOREIGN_KEY_VIOLATION'
+    constraint_name, key_match = get_constraint_and_key(diag, message)
+    if key_match:
+        key_columns, key_values = key_match.groups()
+        error_info['affected_columns'].extend(col.strip().strip('"') for col in key_columns.split(','))
         error_info['details'].append(f"外部キー制約 '{constraint_name}' 違反: 参照先に値({key_values})が存在しません")
+
+def classify_check(error_info, diag, message, row_data, column_info):
+    """23514: CHECK制約違反"""
+    error_info['error_type'] = 'CHECK_CONSTRAINT_VIOLATION'
+    constraint_name, _ = get_constraint_and_key(diag, message)
+    error_info['details'].append(f"CHECK制約 '{constraint_name}' 違反")
+
+def classify_data_type(error_info, diag, message, row_data, column_info):
+    """22P02 / 22007 / 22008: 型に合わない値"""
+    error_info['error_type'] = 'DATA_TYPE_MISMATCH'
+    match = INPUT_SYNTAX_PATTERN.search(message)
+    if match:
+        data_type, value = match.groups()
+    else:
+        match = QUOTED_VALUE_PATTERN.search(message)
+        data_type, value = None, match.group(1) if match else None
+    if value is None:
+        return
     
-    # データ型不一致
-    type_matches = re.findall(r'invalid input syntax for type (\w+): "([^"]+)"', error_msg)
-    if type_matches:
-        error_info['error_type'] = 'DATA_TYPE_MISMATCH'
-        for data_type, value in type_matches:
-            # どのカラムでエラーが発生したか推測
-            for col, col_info in column_info.items():
-                if col in row_data and str(row_data[col]) == value:
-                    error_info['affected_columns'].append(col)
-                    error_info['details'].append(f"カラム '{col}' (型: {data_type}): 値 '{value}' は無効な形式です")
-                    break
+    columns = [diag.column_name] if diag and diag.column_name else find_value_columns(row_data, column_info, value, data_type)
+    if columns:
+        col = columns[0]
+        error_info['affected_columns'].append(col)
+        error_info['details'].append(f"カラム '{col}' (型: {data_type or column_info.get(col, {}).get('data_type')}): 値 '{value}' は無効な形式です")
+
+def classify_string_length(error_info, diag, message, row_data, column_info):
+    """22001: 文字列長超過"""
+    error_info['error_type'] = 'STRING_LENGTH_EXCEEDED'
+    match = VARCHAR_LENGTH_PATTERN.search(message)
+    if not match:
+        return
+    
+    # 最大長が一致し、かつ値が長すぎるカラムを特定
+    max_length = int(match.group(1))
+    for col, value in row_data.items():
+        if value and len(value) > max_length and column_info.get(col, {}).get('character_maximum_length') in (max_length, None):
+            error_info['affected_columns'].append(col)
+            error_info['details'].append(f"カラム '{col}': 値の長さ {len(value)} が最大長 {max_length} を超過")
+
+def classify_numeric_overflow(error_info, diag, message, row_data, column_info):
+    """22003: 数値の範囲外"""
+    error_info['error_type'] = 'NUMERIC_OVERFLOW'
+    error_info['details'].append("数値が許容範囲を超えています")
+
+def get_constraint_and_key(diag, message):
+    """制約名と「Key (カラム)=(値)」の一致を返す（diagにあればそちらを使う）"""
+    constraint_name = diag.constraint_name if diag else None
+    if not constraint_name:
+        match = CONSTRAINT_PATTERN.search(message)
+        constraint_name = match.group(1) if match else None
+    detail = (diag.message_detail if diag else None) or message
+    return constraint_name, KEY_DETAIL_PATTERN.search(detail)
+
+# SQLSTATEごとの解析処理（https://www.postgresql.org/docs/current/errcodes-appendix.html）
+PG_ERROR_CLASSIFIERS = {
+    '23502': classify_not_null,
+    '23505': classify_unique,
+    '23503': classify_foreign_key,
+    '23514': classify_check,
+    '22P02': classify_data_type,
+    '22007': classify_data_type,
+    '22008': classify_data_type,
+    '22001': classify_string_length,
+    '22003': classify_numeric_overflow
+}
+
+# SQLSTATEが取れない場合にメッセージから判定するためのパターン
+FALLBACK_SQLSTATE_PATTERNS = [
+    (re.compile(r'violates not-null constraint'), '23502'),
+    (re.compile(r'duplicate key value violates unique constraint'), '23505'),
+    (re.compile(r'violates foreign key constraint'), '23503'),
+    (re.compile(r'violates check constraint'), '23514'),
+    (re.compile(r'invalid input syntax for type'), '22P02'),
+    (re.compile(r'value too long for type'), '22001'),
+    (re.compile(r'numeric field overflow|out of range for type'), '22003')
+]
+
+def parse_postgres_error(error, row_data, column_info):
+    """PostgreSQLのエラーをSQLSTATEで振り分け、構造化された情報を返す
     
-    # 文字列長超過
-    length_match = re.search(r'value too long for type character varying\((\d+)\)', error_msg)
-    if length_match:
-        error_info['error_type'] = 'STRING_LENGTH_EXCEEDED'
-        max_length = length_match.group(1)
-        # 長すぎる値を持つカラムを特定
-        for col, value in row_data.items():
-            if value and len(str(value)) > int(max_length):
-                error_info['affected_columns'].append(col)
-                error_info['details'].append(f"カラム '{col}': 値の長さ {len(str(value))} が最大長 {max_length} を超過")
-    
-    # 数値オーバーフロー
-    overflow_match = re.search(r'numeric field overflow', error_msg)
-    if overflow_match:
-        error_info['error_type'] = 'NUMERIC_OVERFLOW'
-        error_info['details'].append("数値が許容範囲を超えています")
-    
-    # CHECK制約違反
-    check_match = re.search(r'new row for relation "([^"]+)" violates check constraint "([^"]+)"', error_msg)
-    if check_match:
-        error_info['error_type'] = 'CHECK_CONSTRAINT_VIOLATION'
-        table_name = check_match.group(1)
-        constraint_name = check_match.group(2)
-        error_info['details'].append(f"CHECK制約 '{constraint_name}' 違反")
+    カラム名・制約名・詳細はerror.diagから取得し、取れない場合のみメッセージを解析する。
+    """
+    error_msg = str(error)
+    error_code = getattr(error, 'pgcode', None)
+    error_info = {
+        'error_type': 'UNKNOWN',
+        'error_code': error_code or 'UNKNOWN',
+        'error_message': error_msg,
+        'affected_columns': [],
+        'details': []
+    }
+    
+    classifier = PG_ERROR_CLASSIFIERS.get(error_code)
+    if classifier is None:
+        for pattern, fallback_code in FALLBACK_SQLSTATE_PATTERNS:
+            if pattern.search(error_msg):
+                classifier = PG_ERROR_CLASSIFIERS[fallback_code]
+                break
+    
+    if classifier:
+        diag = getattr(error, 'diag', None)
+        message = (diag.message_primary if diag else None) or error_msg
+        classifier(error_info, diag, message, row_data, column_info)
     
     return error_info
 
+def summarize_error(error_summary, row_number, error_info):
+    """エラータイプ別の件数・影響カラム別の件数・例（3件まで）を集計する"""
+    summary = error_summary.get(error_info['error_type'])
+    if summary is None:
+        summary = error_summary[error_info['error_type']] = {
+            'count': 0,
+            'column_counts': {},
+            'examples': []
+        }
+    
+    summary['count'] += 1
+    column_counts = summary['column_counts']
+    for col in error_info['affected_columns']:
+        column_counts[col] = column_counts.get(col, 0) + 1
+    if len(summary['examples']) < 3:
+        summary['examples'].append({
+            'row_number': row_number,
+            'affected_columns': error_info['affected_columns'],
+            'details': error_info['details']
+        })
+
 def format_error_details(row_number, row_data, error_info):
     """エラー情報を箇条書き形式でフォーマット"""
     lines = [
@@ -122,6 +651,1014 @@ def format_error_details(row_number, row_data, error_info):
     
     return '\n'.join(lines)
 
+def record_row_error(row_number, row, csv_columns, error, column_info, error_summary, failed_details):
+    """1行分の挿入エラーを解析し、エラーサマリーと失敗詳細に記録する
+    
+    行はCSVの列順のリストで受け取り、カラム名付きの辞書はエラー時のみ作る。
+    失敗詳細はFAILED_DETAILS_LIMIT件までとし、それ以降の行のデータは保持しない。
+    """
+    row_data = dict(zip(csv_columns, row))
+    
+    if not isinstance(error, psycopg2.Error):
+        # PostgreSQL以外のエラー
+        if len(failed_details) < FAILED_DETAILS_LIMIT:
+            failed_details.append({
+                'row_number': row_number,
+                'error': str(error),
+                'row_data': row_data
+            })
+        print(f"行 {row_number} の処理でエラー: {error}")
+        print(f"元のデータ: {row_data}")
+        return
+    
+    # PostgreSQLエラーを詳細に解析
+    error_info = parse_postgres_error(error, row_data, column_info)
+    
+    # エラーの詳細をログ出力（全カラムを並べる詳細は失敗詳細と同じ件数まで）
+    if len(failed_details) < FAILED_DETAILS_LIMIT:
+        print(format_error_details(row_number, row_data, error_info))
+    else:
+        print(f"行 {row_number}: {error_info['error_type']} {', '.join(error_info['affected_columns'])}")
+    
+    # エラータイプ別に集計
+    summarize_error(error_summary, row_number, error_info)
+    
+    # 既存のfailed_detailsにも追加
+    if len(failed_details) < FAILED_DETAILS_LIMIT:
+        failed_details.append({
+            'row_number': row_number,
+            'error': str(error),
+            'error_info': error_info,
+            'row_data': row_data
+        })
+
+def insert_batch(conn, cursor, target_table, column_names, placeholders_str, batch, csv_columns, column_info,
+                 error_summary, failed_details, source_file, count_table, summary_deltas=(),
+                 conflict_clause='', conflict_result=None):
+    """バッチを複数行INSERTで挿入し、同じトランザクション内で行数の記録を更新する（コミットは呼び出し側）
+    
+    batchは(行番号, CSVの行, 挿入値のタプル)のリスト。バッチ内でエラーが出た場合は、
+    セーブポイントまで戻して1行ずつ挿入し直し、エラー行だけを記録する。
+    count_tableがNoneの場合は行数を記録しない。挿入できた行はsummary_deltasに加算する（反映はflush_batches）。
+    conflict_clause（' ON CONFLICT DO NOTHING'）を指定した場合は、重複でスキップした行数をconflict_resultに加算する
+    （協調ロードのマージの1行ずつの挿入で使う。summary_deltasがあり一部の行をスキップした場合は、
+    どの行を挿入したか分かるよう1行ずつ挿入し直す）。
+    戻り値は挿入できた行数。
+    """
+    batch_insert_sql = f'INSERT INTO "{target_table}" ({column_names}) VALUES %s{conflict_clause}'
+    insert_sql = f'INSERT INTO "{target_table}" ({column_names}) VALUES ({placeholders_str}){conflict_clause}'
+    skipped = 0
+    
+    cursor.execute("SAVEPOINT csv_batch")
+    try:
+        psycopg2.extras.execute_values(
+            cursor, batch_insert_sql, [values for _, _, values in batch],
+            template=f'({placeholders_str})', page_size=len(batch)
+        )
+        # 1ページで実行するため、rowcountはバッチ全体の挿入行数
+        inserted = cursor.rowcount if conflict_clause else len(batch)
+    except Exception:
+        inserted = None
+    
+    if inserted is not None and (inserted == len(batch) or not summary_deltas):
+        cursor.execute("RELEASE SAVEPOINT csv_batch")
+        skipped = len(batch) - inserted
+        for summary_delta in summary_deltas:
+            for _, _, values in batch:
+                summary_delta.add(values)
+    else:
+        # 同じトランザクションで先に挿入した他のバッチは残したまま、このバッチだけ戻す
+        cursor.execute("ROLLBACK TO SAVEPOINT csv_batch")
+        inserted = 0
+        for row_number, row, values in batch:
+            cursor.execute("SAVEPOINT csv_row")
+            try:
+                cursor.execute(insert_sql, values)
+                row_inserted = cursor.rowcount
+                cursor.execute("RELEASE SAVEPOINT csv_row")
+                if not row_inserted:
+                    skipped += 1
+                    continue
+                inserted += 1
+                for summary_delta in summary_deltas:
+                    summary_delta.add(values)
+            except Exception as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT csv_row")
+                record_row_error(row_number, row, csv_columns, e, column_info, error_summary, failed_details)
+    
+    if conflict_result is not None:
+        conflict_result['skipped_rows'] += skipped
+    
+    if count_table and inserted:
+        cursor.execute("""
+            UPDATE csv_table_row_counts
+            SET row_count = row_count + %s, last_source_file = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE table_name = %s
+        """, (inserted, source_file, count_table))
+    
+    return inserted
+
+def start_checkpoint(conn, cursor, source_file, etag, table_name):
+    """ファイルのチェックポイントを取得する（同じファイルの中断したロードなら、その続きから再開する）"""
+    cursor.execute("""
+        SELECT etag, status, last_row_number, byte_offset, inserted_rows, failed_rows
+        FROM csv_load_checkpoints
+        WHERE source_file = %s
+    """, (source_file,))
+    checkpoint = cursor.fetchone()
+    
+    if checkpoint and checkpoint['etag'] == etag and checkpoint['status'] == 'IN_PROGRESS':
+        conn.commit()
+        print(f"チェックポイントから再開: {checkpoint['last_row_number']}行目まで処理済み")
+        return {
+            'resumed_from_row': checkpoint['last_row_number'],
+            'last_row_number': checkpoint['last_row_number'],
+            'byte_offset': checkpoint['byte_offset'],
+            'inserted_rows': checkpoint['inserted_rows'],
+            'failed_rows': checkpoint['failed_rows']
+        }
+    
+    cursor.execute("""
+        INSERT INTO csv_load_checkpoints (source_file, etag, table_name)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (source_file) DO UPDATE
+        SET etag = EXCLUDED.etag, table_name = EXCLUDED.table_name, status = 'IN_PROGRESS',
+            last_row_number = 0, byte_offset = NULL, inserted_rows = 0, failed_rows = 0,
+            started_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+    """, (source_file, etag, table_name))
+    conn.commit()
+    return {'resumed_from_row': 0, 'last_row_number': 0, 'byte_offset': None, 'inserted_rows': 0, 'failed_rows': 0}
+
+def update_checkpoint(cursor, source_file, checkpoint):
+    """チェックポイントを更新する（バッチと同じトランザクションで実行し、コミットは呼び出し側）"""
+    cursor.execute("""
+        UPDATE csv_load_checkpoints
+        SET last_row_number = %s, byte_offset = %s, inserted_rows = %s, failed_rows = %s,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE source_file = %s
+    """, (
+        checkpoint['last_row_number'], checkpoint['byte_offset'],
+        checkpoint['inserted_rows'], checkpoint['failed_rows'], source_file
+    ))
+
+def finish_checkpoint(conn, cursor, source_file, checkpoint):
+    """ファイルのロード完了を記録する（以降の同じファイルのイベントは最初から読み込む）"""
+    update_checkpoint(cursor, source_file, checkpoint)
+    cursor.execute(
+        "UPDATE csv_load_checkpoints SET status = 'COMPLETED', updated_at = CURRENT_TIMESTAMP WHERE source_file = %s",
+        (source_file,)
+    )
+    conn.commit()
+
+def add_batch_stats(column_stats, batches):
+    """挿入前のバッチの値をカラムの品質統計に追加"""
+    for batch in batches.values():
+        column_stats.add_batch(batch)
+
+def flush_batches(conn, cursor, batches, column_names, placeholders_str, csv_columns, column_info,
+                  error_summary, failed_details, source_file, count_table, partition_targets,
+                  checkpoint, last_row_number, summary_deltas):
+    """保留中の全バッチを挿入し、集計テーブルへの差分の加算・チェックポイントの更新と同じトランザクションでコミットする
+    
+    途中でタイムアウトしても、コミット済みの行と集計テーブル・チェックポイントの位置は常に一致する。
+    戻り値は(挿入行数, 失敗行数)。
+    """
+    total_inserted = 0
+    total_failed = 0
+    for target_table, batch in batches.items():
+        inserted = insert_batch(
+            conn, cursor, target_table, column_names, placeholders_str, batch, csv_columns, column_info,
+            error_summary, failed_details, source_file, count_table, summary_deltas
+        )
+        total_inserted += inserted
+        total_failed += len(batch) - inserted
+        if target_table in partition_targets:
+            partition_targets[target_table]['inserted_rows'] += inserted
+    
+    for summary_delta in summary_deltas:
+        summary_delta.flush(cursor)
+    
+    if checkpoint:
+        checkpoint['last_row_number'] = last_row_number
+        checkpoint['inserted_rows'] += total_inserted
+        checkpoint['failed_rows'] += total_failed
+        update_checkpoint(cursor, source_file, checkpoint)
+    
+    conn.commit()
+    return total_inserted, total_failed
+
+def get_partition_spec(cursor, table_name, load_options):
+    """対象が範囲パーティションテーブルなら、パーティションキー・作成単位・ロード方式を返す"""
+    cursor.execute("""
+        SELECT pt.partstrat, pg_get_partkeydef(pt.partrelid) AS partkeydef
+        FROM pg_partitioned_table pt
+        WHERE pt.partrelid = %s::regclass
+    """, (f'public."{table_name}"',))
+    result = cursor.fetchone()
+    partition_options = load_options.get('partition', {})
+    
+    if not result:
+        if partition_options:
+            print(f"警告: テーブル '{table_name}' はパーティションテーブルではないため、partition設定を無視します")
+        return None
+    
+    key_match = PARTITION_KEY_PATTERN.match(result['partkeydef'])
+    if result['partstrat'] != 'r' or not key_match:
+        print(f"警告: 単一カラムの範囲パーティションのみ対応しています（{result['partkeydef']}）。親テーブル経由で挿入します")
+        return None
+    
+    interval = partition_options.get('interval', 'month')
+    mode = partition_options.get('mode', 'append')
+    if interval not in PARTITION_INTERVALS:
+        raise ValueError(f"未対応のパーティション単位です: {interval}")
+    if mode not in ('append', 'swap'):
+        raise ValueError(f"未対応のパーティションロード方式です: {mode}")
+    
+    # timestamptzのキーは、タイムゾーンのない値をPostgreSQLと同じくセッションのTimeZoneで解釈して振り分ける
+    column = key_match.group(1)
+    cursor.execute("""
+        SELECT format_type(atttypid, atttypmod) AS key_type
+        FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attname = %s
+    """, (f'public."{table_name}"', column))
+    key_has_timezone = cursor.fetchone()['key_type'] == 'timestamp with time zone'
+    session_tz = get_session_timezone(cursor)
+    if session_tz is None:
+        print("警告: セッションのTimeZoneをPythonで扱えないため、タイムゾーンのない値はUTCとして振り分けます")
+        session_tz = timezone.utc
+    
+    return {
+        'column': column, 'interval': interval, 'mode': mode,
+        'key_has_timezone': key_has_timezone, 'session_tz': session_tz
+    }
+
+def get_partition_range(value, interval, key_has_timezone=False, session_tz=timezone.utc):
+    """パーティションキーの値（日付・日時）から、それを含む範囲の開始日と終了日を返す
+    
+    timestamptzのキーは境界がUTCのため、値をUTCに変換した日付で決める（タイムゾーンのない値はsession_tzの時刻）。
+    date・timestampのキーはPostgreSQLがタイムゾーンを無視して格納するため、値に書かれた日付のまま決める。
+    valueがNone（CSVにキーのカラムがない）の場合は当日分、空欄は解釈できない値としてNoneを返す。
+    """
+    if value is None:
+        # キーのカラムを挿入しない行はカラムのデフォルト（CURRENT_TIMESTAMP）で当日分になる
+        # （CSVにあるカラムの空欄はNULLとして挿入するため、デフォルトは使われない）
+        key_time = datetime.now(timezone.utc)
+        if not key_has_timezone:
+            key_time = key_time.astimezone(session_tz)
+    else:
+        try:
+            key_time = datetime.fromisoformat(value.strip().replace('/', '-'))
+        except ValueError:
+            return None
+        if key_has_timezone:
+            if key_time.tzinfo is None:
+                key_time = key_time.replace(tzinfo=session_tz)
+            key_time = key_time.astimezone(timezone.utc)
+    
+    start = key_time.date()
+    if interval == 'day':
+        return start, start + timedelta(days=1)
+    
+    start = start.replace(day=1)
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+def partition_bound(day):
+    """パーティション境界の値（セッションのタイムゾーン設定に依存しないようUTCを明示）"""
+    return f"{day.isoformat()} 00:00:00+00"
+
+def ensure_partition(conn, cursor, table_name, partition_name, start, end):
+    """範囲パーティションがなければ作成する（同時に実行されるロードとはアドバイザリロックで排他）"""
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL AS exists", (f'public."{partition_name}"',))
+    if cursor.fetchone()['exists']:
+        return False
+    
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (partition_name,))
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS "{partition_name}" PARTITION OF "{table_name}" FOR VALUES FROM (%s) TO (%s)',
+        (partition_bound(start), partition_bound(end))
+    )
+    conn.commit()
+    print(f"パーティション作成: {partition_name} [{start} - {end})")
+    return True
+
+def create_swap_table(conn, cursor, table_name, partition_column, staging_name, start, end):
+    """スナップショット読み込み用に、親テーブルと同じ構造で範囲のCHECK制約付きのテーブルを作成する"""
+    # 前回中断したスワップの残りは作り直す
+    cursor.execute(f'DROP TABLE IF EXISTS "{staging_name}"')
+    cursor.execute(f'CREATE TABLE "{staging_name}" (LIKE "{table_name}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    
+    # ATTACH時に範囲外の行がないことの確認スキャンを省くため、範囲をCHECK制約として持たせる
+    cursor.execute(
+        f'ALTER TABLE "{staging_name}" ADD CONSTRAINT "{staging_name}_bound" '
+        f'CHECK ("{partition_column}" IS NOT NULL AND "{partition_column}" >= %s AND "{partition_column}" < %s)',
+        (partition_bound(start), partition_bound(end))
+    )
+    conn.commit()
+    print(f"スワップ用テーブル作成: {staging_name} [{start} - {end})")
+
+def resolve_partition_target(conn, cursor, table_name, partition_spec, value, partition_targets):
+    """行のパーティションキーから挿入先テーブルを決め、必要ならパーティション（スワップ用テーブル）を作成する"""
+    partition_range = get_partition_range(
+        value, partition_spec['interval'], partition_spec['key_has_timezone'], partition_spec['session_tz']
+    )
+    if partition_range is None:
+        return None
+    
+    start, end = partition_range
+    partition_name = f"{table_name}_p{start.strftime(PARTITION_INTERVALS[partition_spec['interval']])}"
+    target_table = partition_name if partition_spec['mode'] == 'append' else f"{partition_name}_swap"
+    
+    if target_table not in partition_targets:
+        if partition_spec['mode'] == 'swap':
+            create_swap_table(conn, cursor, table_name, partition_spec['column'], target_table, start, end)
+        else:
+            ensure_partition(conn, cursor, table_name, partition_name, start, end)
+        
+        partition_targets[target_table] = {
+            'partition_name': partition_name,
+            'start': start,
+            'end': end,
+            'inserted_rows': 0
+        }
+    
+    return target_table
+
+def swap_partition(conn, cursor, table_name, staging_name, target, source_file, row_count_mode, summary_deltas=()):
+    """読み込み済みのスワップ用テーブルを、既存パーティションと1トランザクションで入れ替える
+    
+    集計テーブルは、外すパーティションの行を減算し、スワップ用テーブルの行を加算する。
+    """
+    partition_name = target['partition_name']
+    replaced_rows = 0
+    
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (partition_name,))
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL AS exists", (f'public."{partition_name}"',))
+    if cursor.fetchone()['exists']:
+        if row_count_mode == 'accounting':
+            # 行数の記録から差し引くため、入れ替えるパーティション分だけ数える
+            cursor.execute(f'SELECT COUNT(*) as count FROM "{partition_name}"')
+            replaced_rows = cursor.fetchone()['count']
+        for summary_delta in summary_deltas:
+            summary_delta.apply_table(cursor, partition_name, -1)
+        cursor.execute(f'ALTER TABLE "{table_name}" DETACH PARTITION "{partition_name}"')
+        cursor.execute(f'DROP TABLE "{partition_name}"')
+    
+    cursor.execute(
+        f'ALTER TABLE "{table_name}" ATTACH PARTITION "{staging_name}" FOR VALUES FROM (%s) TO (%s)',
+        (partition_bound(target['start']), partition_bound(target['end']))
+    )
+    cursor.execute(f'ALTER TABLE "{staging_name}" DROP CONSTRAINT "{staging_name}_bound"')
+    cursor.execute(f'ALTER TABLE "{staging_name}" RENAME TO "{partition_name}"')
+    for summary_delta in summary_deltas:
+        summary_delta.apply_table(cursor, partition_name)
+        summary_delta.applied_rows += target['inserted_rows']
+    
+    if row_count_mode == 'accounting':
+        cursor.execute("""
+            UPDATE csv_table_row_counts
+            SET row_count = row_count - %s + %s, last_source_file = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE table_name = %s
+        """, (replaced_rows, target['inserted_rows'], source_file, table_name))
+    
+    conn.commit()
+    print(f"パーティション入れ替え: {partition_name}（{replaced_rows}行 → {target['inserted_rows']}行）")
+    return replaced_rows
+
+def get_dedup_key_columns(cursor, table_name):
+    """重複除去のキーとして、主キー（なければ最初の一意制約）のカラムをカタログから取得する"""
+    cursor.execute("""
+        SELECT array_agg(att.attname::text ORDER BY key.ord) AS columns
+        FROM pg_constraint con
+        CROSS JOIN LATERAL unnest(con.conkey) WITH ORDINALITY AS key(attnum, ord)
+        JOIN pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = key.attnum
+        WHERE con.conrelid = %s::regclass
+        AND con.contype IN ('p', 'u')
+        GROUP BY con.oid, con.contype, con.conname
+        ORDER BY con.contype = 'p' DESC, con.conname
+        LIMIT 1
+    """, (f'public."{table_name}"',))
+    result = cursor.fetchone()
+    return list(result['columns']) if result else []
+
+def make_row_picker(indexes):
+    """CSVの行（リスト）から指定位置の値をタプルで取り出す関数を返す"""
+    if len(indexes) == 1:
+        index = indexes[0]
+        return lambda row: (row[index],)
+    return itemgetter(*indexes)
+
+def iter_csv_rows(csv_reader, width):
+    """空行を除き、列の足りない行は空欄で補って返す（DictReaderと同じ扱い）"""
+    for row in csv_reader:
+        if not row:
+            continue
+        if len(row) < width:
+            row += [''] * (width - len(row))
+        yield row
+
+def split_simple_line(line, maxsplit):
+    """引用符の解釈が不要な行を分割する（最後に必要なフィールドより後ろは分割しない）
+    
+    引用符を含まない行はカンマで、全てのフィールドが引用符で囲まれ値に引用符を含まない行
+    （Salesforceのエクスポート形式）は '","' で分割する。それ以外はNoneを返す。
+    """
+    if line.endswith('\n'):
+        line = line[:-2] if line.endswith('\r\n') else line[:-1]
+    
+    quotes = line.count('"')
+    if not quotes:
+        return line.split(',', maxsplit) if line else []
+    if line[0] == '"' and line[-1] == '"' and quotes == 2 * (line.count('","') + 1):
+        return line[1:-1].split('","', maxsplit)
+    return None
+
+def iter_projected_rows(lines, projection, line_filter=None):
+    """CSVの行から必要なカラム（位置のリスト）だけを取り出したタプルを返す
+    
+    多くの行は split_simple_line で必要な位置までだけ分割し、残りのフィールドは文字列のまま捨てる。
+    それ以外の行（値にカンマ・引用符・改行を含む）は、引用符の数が偶数になるまで（1レコード分）
+    行をつなげてからcsv.readerで解析する。空行は除き、列の足りない行は空欄で補う。
+    line_filter が偽を返した1行で完結するレコードは分割せずにNoneを返す（行番号を保つため）。
+    """
+    pick = make_row_picker(projection)
+    maxsplit = projection[-1] + 1
+    for line in lines:
+        if line_filter is not None and not line_filter(line) and not line.count('"') % 2:
+            if line.rstrip('\r\n'):
+                yield None
+            continue
+        row = split_simple_line(line, maxsplit)
+        if row is None:
+            record = line
+            while record.count('"') % 2:
+                next_line = next(lines, None)
+                if next_line is None:
+                    break
+                record += next_line
+            row = next(csv.reader([record]), [])
+        
+        if not row:
+            continue
+        if len(row) < maxsplit:
+            row += [''] * (maxsplit - len(row))
+        yield pick(row)
+
+def parse_filter_spec(filter_spec):
+    """ロードオプションのfilterを(カラム, 値の集合, 否定)のリストにする
+    
+    値はCSVの文字列と比較する。{"カラム": 値} は一致、{"カラム": [値, ...]} はいずれかに一致、
+    {"カラム": {"not": 値または[値, ...]}} は一致しない行を残す。nullは空欄、true/falseは真偽値の各表記に一致する。
+    """
+    if not isinstance(filter_spec, dict) or not filter_spec:
+        raise ValueError(f"filterにはカラム名と値の辞書を指定してください: {filter_spec}")
+    
+    conditions = []
+    for column, condition in filter_spec.items():
+        negate = isinstance(condition, dict)
+        if negate:
+            if set(condition) != {'not'}:
+                raise ValueError(f"filterの条件には値・値のリスト・{{\"not\": ...}} のいずれかを指定してください: {column}")
+            condition = condition['not']
+        values = set()
+        for value in condition if isinstance(condition, list) else [condition]:
+            if value is None:
+                values.add('')
+            elif isinstance(value, bool):
+                values.update(FILTER_BOOLEAN_SPELLINGS[value])
+            elif isinstance(value, (str, int, float)):
+                values.add(str(value))
+            else:
+                raise ValueError(f"filterの値には文字列・数値・真偽値・nullを指定してください: {column}={value}")
+        conditions.append((column, frozenset(values), negate))
+    return conditions
+
+def make_row_filter(conditions, row_columns):
+    """取り出したカラムのタプルが全ての条件を満たすかを返す関数"""
+    checks = [(row_columns.index(column), values, negate) for column, values, negate in conditions]
+    if len(checks) == 1:
+        index, values, negate = checks[0]
+        if negate:
+            return lambda row: row[index] not in values
+        return lambda row: row[index] in values
+    return lambda row: all((row[index] in values) != negate for index, values, negate in checks)
+
+def make_line_filter(conditions):
+    """分割前の行の事前判定（一致の条件の値をどれも含まない行は条件を満たさない）
+    
+    否定の条件・空欄との一致・引用符や改行を含む値は判定できないため対象外で、
+    短い値（'1' や 't' など）はほとんどの行に含まれて絞り込めないため対象外にする。対象の条件がなければNoneを返す。
+    引用符で囲まれた値もそのまま部分文字列として含まれるため、Salesforceのエクスポート形式でも使える。
+    """
+    searches = []
+    for _, values, negate in conditions:
+        if negate or any(len(value) < FILTER_PREFILTER_MIN_LENGTH or FILTER_UNSAFE_CHARS.intersection(value) for value in values):
+            continue
+        if len(values) == 1:
+            value = next(iter(values))
+            searches.append(lambda line, value=value: value in line)
+        else:
+            searches.append(re.compile('|'.join(map(re.escape, sorted(values)))).search)
+    if not searches:
+        return None
+    if len(searches) == 1:
+        return searches[0]
+    return lambda line: all(search(line) for search in searches)
+
+def filter_rows(numbered_rows, row_filter, filter_result):
+    """(行番号, 行)の並びから条件を満たす行だけを返す（除いた行数はfilter_resultに記録）"""
+    for row_number, row in numbered_rows:
+        if row is not None and row_filter(row):
+            yield row_number, row
+            continue
+        filter_result['skipped_rows'] += 1
+        if row is None:
+            filter_result['prefiltered_rows'] += 1
+
+def dedup_partition(numbered_rows, key_columns, pick_key, keep, dedup_result):
+    """(行番号, 行)の並びからキーの重複を除き、残った行を行番号順のリストで返す"""
+    kept = {}
+    null_key_rows = []
+    
+    for row_number, row in numbered_rows:
+        key = pick_key(row)
+        
+        # 空欄はNULLとして挿入され、NULLを含むキーは一意制約で重複扱いにならない
+        if '' in key or None in key:
+            null_key_rows.append((row_number, row))
+            continue
+        
+        if key not in kept:
+            kept[key] = (row_number, row)
+            continue
+        
+        if keep == 'last':
+            dropped_number = kept[key][0]
+            kept[key] = (row_number, row)
+        else:
+            dropped_number = row_number
+        
+        dedup_result['dropped_rows'] += 1
+        if len(dedup_result['examples']) < 10:
+            dedup_result['examples'].append({
+                'row_number': dropped_number,
+                'key': dict(zip(key_columns, key))
+            })
+    
+    survivors = list(kept.values()) + null_key_rows
+    survivors.sort(key=itemgetter(0))
+    return survivors
+
+def read_spill_file(path):
+    """退避ファイルから(行番号, 行)を順に読み出す"""
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+def spill_row(partition_files, numbered_row, pick_key):
+    """(行番号, 行)をキーのハッシュで決まる退避ファイルに書き出す"""
+    key = pick_key(numbered_row[1])
+    pickle.dump(numbered_row, partition_files[hash(key) % len(partition_files)], pickle.HIGHEST_PROTOCOL)
+
+def merge_dedup_runs(run_paths, spill_dir):
+    """分割ごとに重複除去した退避ファイルを行番号順にマージし、終了時に退避ディレクトリを削除する"""
+    try:
+        yield from heapq.merge(*[read_spill_file(path) for path in run_paths], key=itemgetter(0))
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+def dedup_rows(numbered_rows, key_columns, key_indexes, keep):
+    """キーが重複する行を除いた(行番号, 行)のイテレータと、除外結果を返す
+    
+    DEDUP_MEMORY_ROWS行まではメモリ上で処理する。超えた場合はキーのハッシュで
+    DEDUP_SPILL_PARTITIONS個のファイルに分割して/tmpに退避し、分割ごとに重複を除いた後、
+    行番号順にマージして元の順序で返す（メモリ使用量は分割1つ分に収まる）。
+    """
+    dedup_result = {
+        'key_columns': key_columns,
+        'keep': keep,
+        'dropped_rows': 0,
+        'spilled': False,
+        'examples': []
+    }
+    
+    pick_key = make_row_picker(key_indexes)
+    buffered = list(itertools.islice(numbered_rows, DEDUP_MEMORY_ROWS + 1))
+    if len(buffered) <= DEDUP_MEMORY_ROWS:
+        return iter(dedup_partition(buffered, key_columns, pick_key, keep, dedup_result)), dedup_result
+    
+    print(f"重複除去: {DEDUP_MEMORY_ROWS}行を超えるため{DEDUP_SPILL_PARTITIONS}分割で{DEDUP_SPILL_DIR}に退避します")
+    dedup_result['spilled'] = True
+    spill_dir = tempfile.mkdtemp(prefix='csv_dedup_', dir=DEDUP_SPILL_DIR)
+    
+    try:
+        partition_paths = [os.path.join(spill_dir, f'partition_{n}.pkl') for n in range(DEDUP_SPILL_PARTITIONS)]
+        partition_files = [open(path, 'wb') for path in partition_paths]
+        try:
+            for numbered_row in buffered:
+                spill_row(partition_files, numbered_row, pick_key)
+            buffered.clear()
+            
+            for numbered_row in numbered_rows:
+                spill_row(partition_files, numbered_row, pick_key)
+        finally:
+            for partition_file in partition_files:
+                partition_file.close()
+        
+        # 同じキーは必ず同じ分割に入るため、分割ごとに重複を除けばよい
+        run_paths = []
+        for path in partition_paths:
+            survivors = dedup_partition(read_spill_file(path), key_columns, pick_key, keep, dedup_result)
+            os.remove(path)
+            
+            run_path = f'{path}.run'
+            with open(run_path, 'wb') as run_file:
+                for numbered_row in survivors:
+                    pickle.dump(numbered_row, run_file, pickle.HIGHEST_PROTOCOL)
+            run_paths.append(run_path)
+    except Exception:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+        raise
+    
+    return merge_dedup_runs(run_paths, spill_dir), dedup_result
+
+def drop_stale_stage_tables(conn, cursor):
+    """中断した起動が残したステージングテーブルを削除する（テーブル名の作成時刻で判定）"""
+    cursor.execute("""
+        SELECT tablename
+        FROM pg_tables
+        WHERE schemaname = 'public'
+        AND tablename LIKE %s
+    """, (STAGE_TABLE_PREFIX.replace('_', '\\_') + '%',))
+    
+    now = int(time.time())
+    for stage_table in [row['tablename'] for row in cursor.fetchall()]:
+        created_at = stage_table[len(STAGE_TABLE_PREFIX):].split('_')[0]
+        if created_at.isdigit() and now - int(created_at) > STAGE_TABLE_MAX_AGE_SEC:
+            cursor.execute(f'DROP TABLE IF EXISTS "{stage_table}"')
+            print(f"残っていたステージングテーブルを削除: {stage_table}")
+    conn.commit()
+
+def create_stage_table(conn, cursor, table_name):
+    """起動ごとのUNLOGGEDステージングテーブルを、対象テーブルのカラム構成（制約・インデックスなし）で作成する"""
+    stage_table = f"{STAGE_TABLE_PREFIX}{int(time.time())}_{uuid.uuid4().hex[:12]}"
+    cursor.execute(f'CREATE UNLOGGED TABLE "{stage_table}" (LIKE "{table_name}" INCLUDING DEFAULTS)')
+    cursor.execute(f'ALTER TABLE "{stage_table}" ADD COLUMN csv_row_number BIGINT')
+    conn.commit()
+    print(f"ステージングテーブル作成: {stage_table}")
+    return stage_table
+
+def get_binary_row_encoder(cursor, insert_columns, column_info):
+    """ステージングテーブルへのバイナリ形式のCOPY用の行エンコーダー（対応しない型のカラムがあればNone）"""
+    session_tz = get_session_timezone(cursor)
+    columns = [{'column_name': 'csv_row_number', 'data_type': 'bigint'}] + [column_info[col] for col in insert_columns]
+    row_encoder = make_row_encoder(columns, session_tz)
+    if row_encoder is None:
+        print(f"バイナリ形式に対応しない型のカラムがあるためCSV形式でCOPYします: {unsupported_columns(columns, session_tz)}")
+    return row_encoder
+
+def stage_row_values(batch):
+    """1行ずつ挿入する場合の値（COPYと同じく空欄はNULL）"""
+    return [
+        (row_number, row, (row_number,) + tuple(None if value == '' else value for value in values))
+        for row_number, row, values in batch
+    ]
+
+def copy_batch_to_stage(conn, cursor, stage_table, stage_column_names, stage_placeholders, batch,
+                        csv_columns, column_info, error_summary, failed_details, row_encoder=None):
+    """バッチをCOPYでステージングテーブルに読み込む（失敗した場合は1行ずつ挿入してエラー行を特定）
+    
+    row_encoderを指定した場合はバイナリ形式でCOPYする。Pythonで解釈できない値を含む行は
+    COPYから除き、同じトランザクションで1行ずつ挿入してPostgreSQLに判定させる。
+    """
+    try:
+        if row_encoder is None:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row_number, _, values in batch:
+                writer.writerow((row_number,) + values)
+            buffer.seek(0)
+            
+            # CSV形式のCOPYでは引用符なしの空欄がNULLになる
+            cursor.copy_expert(f'COPY "{stage_table}" ({stage_column_names}) FROM STDIN WITH (FORMAT csv)', buffer)
+            rejected = []
+        else:
+            # 読まれた分だけエンコードして送る（バッチ全体のバイナリをメモリに展開しない）
+            stream = BinaryCopyStream(
+                (((row_number, row, values), (row_number,) + values) for row_number, row, values in batch),
+                row_encoder
+            )
+            cursor.copy_expert(
+                f'COPY "{stage_table}" ({stage_column_names}) FROM STDIN WITH (FORMAT binary)', stream, size=COPY_BUFFER_SIZE
+            )
+            rejected = [item for item, _ in stream.rejected]
+        
+        staged = len(batch) - len(rejected)
+        if rejected:
+            staged += insert_batch(
+                conn, cursor, stage_table, stage_column_names, stage_placeholders, stage_row_values(rejected),
+                csv_columns, column_info, error_summary, failed_details, None, None
+            )
+        conn.commit()
+        return staged
+    except psycopg2.Error:
+        conn.rollback()
+        inserted = insert_batch(
+            conn, cursor, stage_table, stage_column_names, stage_placeholders, stage_row_values(batch),
+            csv_columns, column_info, error_summary, failed_details, None, None
+        )
+        conn.commit()
+        return inserted
+
+def acquire_merge_locks(conn, cursor, table_name, context):
+    """書き込み枠（LOAD_MAX_WRITERS個）のいずれかと、対象テーブルのロックをトランザクション単位で取得する"""
+    while True:
+        for slot in range(LOAD_MAX_WRITERS):
+            cursor.execute("SELECT pg_try_advisory_xact_lock(%s, %s) AS locked", (WRITER_LOCK_NAMESPACE, slot))
+            if cursor.fetchone()['locked']:
+                # 同じテーブルへのマージは順番に行い、一意インデックスでのロック競合を避ける
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"csv_load:{table_name}",))
+                return slot
+        
+        conn.rollback()
+        if context and context.get_remaining_time_in_millis() < WRITER_WAIT_MIN_REMAINING_MS:
+            raise TimeoutError(f"書き込み枠（{LOAD_MAX_WRITERS}）の空きを待つ間に残り時間がなくなりました")
+        time.sleep(random.uniform(0.5, 2.0))
+
+def merge_stage_table(conn, cursor, table_name, stage_table, insert_columns, file_source_literal,
+                      column_info, error_summary, failed_details, source_file, count_table, on_conflict, context,
+                      summary_deltas=()):
+    """ステージングテーブルの行を対象テーブルへ1つのINSERT ... SELECTでマージする
+    
+    マージが失敗した場合（外部キー違反・重複など）は、ステージングテーブルから
+    行番号順に読み出して1行ずつ挿入し直し、エラー行を特定する。
+    集計テーブルには、マージで実際に挿入した行（RETURNING）を同じ文の中で集計して加算する。
+    戻り値は(挿入行数, 失敗行数, スキップ行数)。
+    """
+    column_list = ', '.join([f'"{col}"' for col in insert_columns])
+    target_columns = column_list + (', "file_source"' if file_source_literal else '')
+    select_list = column_list + (f', {file_source_literal}' if file_source_literal else '')
+    conflict_clause = ' ON CONFLICT DO NOTHING' if on_conflict == 'skip' else ''
+    
+    cursor.execute(f'SELECT COUNT(*) as count FROM "{stage_table}"')
+    staged_rows = cursor.fetchone()['count']
+    conn.commit()
+    
+    slot = acquire_merge_locks(conn, cursor, table_name, context)
+    print(f"マージ開始: 書き込み枠 {slot}、{staged_rows}行")
+    try:
+        merge_sql = (
+            f'INSERT INTO "{table_name}" ({target_columns}) '
+            f'SELECT {select_list} FROM "{stage_table}" ORDER BY csv_row_number{conflict_clause}'
+        )
+        if summary_deltas:
+            returning_list = ', '.join(sorted({
+                f'"{col}"' for delta in summary_deltas
+                for col in delta.definition['group_columns'] + delta.definition['sum_columns']
+            }))
+            summary_ctes = ''.join(
+                f', summary_{n} AS ({delta.aggregate_sql("merged")} RETURNING 1)'
+                for n, delta in enumerate(summary_deltas)
+            )
+            cursor.execute(
+                f'WITH merged AS ({merge_sql} RETURNING {returning_list}){summary_ctes} '
+                f'SELECT COUNT(*) AS count FROM merged'
+            )
+            inserted = cursor.fetchone()['count']
+            for summary_delta in summary_deltas:
+                summary_delta.applied_rows += inserted
+        else:
+            cursor.execute(merge_sql)
+            inserted = cursor.rowcount
+        if count_table and inserted:
+            cursor.execute("""
+                UPDATE csv_table_row_counts
+                SET row_count = row_count + %s, last_source_file = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE table_name = %s
+            """, (inserted, source_file, count_table))
+        conn.commit()
+        return inserted, 0, staged_rows - inserted
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"一括マージに失敗したため1行ずつ挿入します: {e}")
+    
+    # 1行ずつの挿入（行番号でページングし、バッチごとにコミット）
+    # ロールバックで書き込み枠とテーブルのロックも外れるため、バッチごとに取得し直してから書き込む
+    column_names = target_columns
+    placeholders_str = ', '.join(['%s'] * len(insert_columns) + ([file_source_literal.replace('%', '%%')] if file_source_literal else []))
+    inserted = 0
+    failed = 0
+    conflict_result = {'skipped_rows': 0}
+    last_row_number = 0
+    while True:
+        cursor.execute(
+            f'SELECT csv_row_number, {column_list} FROM "{stage_table}" '
+            f'WHERE csv_row_number > %s ORDER BY csv_row_number LIMIT %s',
+            (last_row_number, COMMIT_BATCH_SIZE)
+        )
+        staged = cursor.fetchall()
+        if not staged:
+            break
+        
+        batch = []
+        for staged_row in staged:
+            values = tuple(staged_row[col] for col in insert_columns)
+            batch.append((staged_row['csv_row_number'], values, values))
+        last_row_number = staged[-1]['csv_row_number']
+        
+        acquire_merge_locks(conn, cursor, table_name, context)
+        skipped_before = conflict_result['skipped_rows']
+        batch_inserted = insert_batch(
+            conn, cursor, table_name, column_names, placeholders_str, batch, insert_columns, column_info,
+            error_summary, failed_details, source_file, count_table, summary_deltas,
+            conflict_clause=conflict_clause, conflict_result=conflict_result
+        )
+        for summary_delta in summary_deltas:
+            summary_delta.flush(cursor)
+        conn.commit()
+        inserted += batch_inserted
+        failed += len(batch) - batch_inserted - (conflict_result['skipped_rows'] - skipped_before)
+    
+    return inserted, failed, conflict_result['skipped_rows']
+
+def load_coordinated(conn, cursor, table_name, numbered_rows, pick_values, insert_columns, file_source_literal,
+                     csv_columns, column_info, error_summary, failed_details, source_file, count_table,
+                     load_options, context, column_stats=None, summary_deltas=()):
+    """協調ロードモード: UNLOGGEDステージングテーブルにCOPYで読み込み、対象テーブルへ一括でマージする
+    
+    対象テーブルに書き込むのはマージの1トランザクションだけで、書き込み枠と
+    テーブル単位のアドバイザリロックで同時に書き込む起動数を制限する。
+    """
+    drop_stale_stage_tables(conn, cursor)
+    stage_table = create_stage_table(conn, cursor, table_name)
+    stage_column_names = 'csv_row_number, ' + ', '.join([f'"{col}"' for col in insert_columns])
+    stage_placeholders = ', '.join(['%s'] * (len(insert_columns) + 1))
+    
+    # copy_format: binary の場合は型ごとのバイナリ表現でCOPYする（対応しない型があればCSV形式）
+    row_encoder = None
+    if load_options.get('copy_format', 'csv') == 'binary':
+        row_encoder = get_binary_row_encoder(cursor, insert_columns, column_info)
+        conn.commit()
+    
+    result = {
+        'stage_table': stage_table,
+        'copy_format': 'binary' if row_encoder else 'csv',
+        'total_rows': 0,
+        'staged_rows': 0,
+        'inserted_rows': 0,
+        'failed_rows': 0,
+        'skipped_rows': 0
+    }
+    
+    try:
+        batch = []
+        for row_number, row in numbered_rows:
+            result['total_rows'] += 1
+            batch.append((row_number, row, pick_values(row)))
+            
+            if len(batch) >= COMMIT_BATCH_SIZE:
+                if column_stats:
+                    column_stats.add_batch(batch)
+                result['staged_rows'] += copy_batch_to_stage(
+                    conn, cursor, stage_table, stage_column_names, stage_placeholders, batch,
+                    csv_columns, column_info, error_summary, failed_details, row_encoder
+                )
+                batch = []
+                print(f"ステージング中: {row_number} 行目")
+        
+        if batch:
+            if column_stats:
+                column_stats.add_batch(batch)
+            result['staged_rows'] += copy_batch_to_stage(
+                conn, cursor, stage_table, stage_column_names, stage_placeholders, batch,
+                csv_columns, column_info, error_summary, failed_details, row_encoder
+            )
+        
+        inserted, failed, skipped = merge_stage_table(
+            conn, cursor, table_name, stage_table, insert_columns, file_source_literal,
+            column_info, error_summary, failed_details, source_file, count_table,
+            load_options.get('on_conflict', 'error'), context, summary_deltas
+        )
+        result['inserted_rows'] = inserted
+        result['failed_rows'] = (result['total_rows'] - result['staged_rows']) + failed
+        result['skipped_rows'] = skipped
+        print(f"マージ完了: 挿入 {inserted}行, 失敗 {result['failed_rows']}行, 重複スキップ {skipped}行")
+        return result
+    finally:
+        try:
+            conn.rollback()
+            cursor.execute(f'DROP TABLE IF EXISTS "{stage_table}"')
+            conn.commit()
+        except psycopg2.Error as e:
+            # 残ったテーブルは次回以降の協調ロードで削除される
+            print(f"ステージングテーブル削除エラー: {e}")
+
+def prepare_summary_deltas(conn, cursor, table_name, insert_columns):
+    """このテーブルを元にする集計テーブルを調べ、差分を加算するものとロード後に集計し直すものに分ける
+    
+    差分はCSVにグループ化・合計のカラムが全てある場合に計算する（通常のロードはバッチごと、
+    協調ロードはマージした行、swap方式は入れ替えたパーティションの差し引き）。
+    戻り値は(SummaryDeltaのリスト, 集計し直す定義のリスト)。
+    """
+    cursor.execute("SELECT to_regclass('summary_table_definitions') IS NOT NULL AS defined")
+    if not cursor.fetchone()['defined']:
+        return [], []
+    
+    summary_deltas = []
+    summary_rebuilds = []
+    for definition in load_summary_definitions(cursor, table_name):
+        if not definition['summary_exists']:
+            print(f"警告: 集計テーブル '{definition['summary_table']}' が未作成のため更新しません（table_creatorで作成）")
+            continue
+        columns = definition['group_columns'] + definition['sum_columns']
+        if all(col in insert_columns for col in columns):
+            summary_deltas.append(SummaryDelta(cursor, definition, insert_columns))
+        else:
+            summary_rebuilds.append(definition)
+    conn.commit()
+    return summary_deltas, summary_rebuilds
+
+def refresh_summaries(conn, cursor, summary_deltas, summary_rebuilds):
+    """ロード後の集計テーブルの状態を返す（差分を計算できなかったものはここで集計し直す）"""
+    results = [
+        {'summary_table': delta.summary_table, 'mode': 'incremental', 'applied_rows': delta.applied_rows}
+        for delta in summary_deltas if not delta.invalid
+    ]
+    definitions = summary_rebuilds + [delta.definition for delta in summary_deltas if delta.invalid]
+    for definition in definitions:
+        try:
+            groups = rebuild_summary(cursor, definition)
+            conn.commit()
+            results.append({'summary_table': definition['summary_table'], 'mode': 'rebuilt', 'groups': groups})
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"警告: 集計テーブル '{definition['summary_table']}' の再集計に失敗: {e}")
+            results.append({'summary_table': definition['summary_table'], 'mode': 'failed', 'error': str(e).strip()})
+    return results
+
+def get_table_schema(cursor, table_name):
+    """テーブルのカラム情報とシステムカラム（file_source / processed_at）を返す（TABLE_SCHEMA_CACHE_TTL_SEC秒はキャッシュ）"""
+    cached = _table_schema_cache.get(table_name)
+    if cached and time.monotonic() - cached['fetched_at'] < TABLE_SCHEMA_CACHE_TTL_SEC:
+        print(f"カラム情報はキャッシュを使用（{time.monotonic() - cached['fetched_at']:.0f}秒前に取得）")
+        return cached['columns'], cached['system_columns']
+    
+    cursor.execute("""
+        SELECT column_name, data_type, is_nullable, column_default, character_maximum_length
+        FROM information_schema.columns 
+        WHERE table_schema = 'public' 
+        AND table_name = %s 
+        ORDER BY ordinal_position
+    """, (table_name,))
+    
+    columns = []
+    system_columns = []
+    for row in cursor.fetchall():
+        if row['column_name'] in ('file_source', 'processed_at'):
+            system_columns.append(row['column_name'])
+        else:
+            columns.append(dict(row))
+    
+    _table_schema_cache[table_name] = {'columns': columns, 'system_columns': system_columns, 'fetched_at': time.monotonic()}
+    return columns, system_columns
+
+def seed_table_row_count(conn, cursor, table_name):
+    """行数の記録がまだないテーブルは、初回のみ実際の行数で初期化する"""
+    cursor.execute("SELECT 1 FROM csv_table_row_counts WHERE table_name = %s", (table_name,))
+    if cursor.fetchone():
+        return
+    
+    print(f"テーブル '{table_name}' の行数記録を初期化します（初回のみCOUNT(*)）")
+    cursor.execute(f"""
+        INSERT INTO csv_table_row_counts (table_name, row_count)
+        SELECT %s, COUNT(*) FROM "{table_name}"
+        ON CONFLICT (table_name) DO NOTHING
+    """, (table_name,))
+    conn.commit()
+
+def get_table_row_count(cursor, table_name, row_count_mode):
+    """テーブルの行数を返す（accounting / estimate はO(1)、exact は全件COUNT）"""
+    if row_count_mode == 'accounting':
+        cursor.execute("SELECT row_count FROM csv_table_row_counts WHERE table_name = %s", (table_name,))
+        result = cursor.fetchone()
+        return result['row_count'] if result else 0
+    
+    if row_count_mode == 'estimate':
+        # パーティションテーブルは子テーブルの推定値を合計する
+        cursor.execute("""
+            SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::BIGINT AS count
+            FROM pg_class c
+            WHERE c.oid = %s::regclass
+               OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)
+        """, (f'public."{table_name}"', f'public."{table_name}"'))
+        return cursor.fetchone()['count']
+    
+    cursor.execute(f'SELECT COUNT(*) as count FROM "{table_name}"')
+    result = cursor.fetchone()
+    return result['count'] if result else 0
+
 def send_sns_notification(sns_client, topic_arn, subject, message):
     """SNS通知を送信する関数"""
     try:
@@ -160,106 +1697,94 @@ CSV処理結果通知
     
     return message
 
-def lambda_handler(event, context):
-    print("=== CSV処理Lambda関数開始 ===")
-    print(f"Event: {json.dumps(event, ensure_ascii=False)}")
+def derive_table_name(file_name):
+    """ファイル名からテーブル名を決定（"<接頭辞>_<テーブル名>.csv"、英数字とアンダースコアに正規化）"""
+    print(f"ファイル名: {file_name}")
     
-    # 環境変数のデバッグ
-    print("=== 環境変数 ===")
-    print(f"DB_HOST: {os.environ.get('DB_HOST', 'NOT_SET')}")
-    print(f"DB_PORT: {os.environ.get('DB_PORT', 'NOT_SET')}")
-    print(f"DB_NAME: {os.environ.get('DB_NAME', 'NOT_SET')}")
-    print(f"DB_USER: {os.environ.get('DB_USER', 'NOT_SET')}")
-    print(f"DB_PASSWORD: {'SET' if os.environ.get('DB_PASSWORD') else 'NOT_SET'}")
-    # print(f"SNS_TOPIC_ARN: {os.environ.get('SNS_TOPIC_ARN', 'NOT_SET')}")
-
-    s3_client = boto3.client('s3')
-    # sns_client = boto3.client('sns')
+    file_name_without_ext = file_name.replace('.csv', '')
+    print(f"拡張子除去後: {file_name_without_ext}")
+    
+    # アンダースコアで分割して、接頭辞以降を取得
+    parts = file_name_without_ext.split('_', 1)
+    print(f"分割結果: {parts}")
+    
+    if len(parts) >= 2:
+        table_name = parts[1]  # 接頭辞以降がテーブル名
+        print(f"接頭辞除去後のテーブル名: {table_name}")
+    else:
+        # アンダースコアがない場合はファイル名全体をテーブル名とする
+        table_name = file_name_without_ext
+        print(f"アンダースコアなし、全体をテーブル名に: {table_name}")
+    
+    # テーブル名の正規化（英数字とアンダースコアのみ）
+    original_table_name = table_name
+    table_name = ''.join(c for c in table_name if c.isalnum() or c == '_').lower()
+    print(f"正規化前: {original_table_name}")
+    print(f"正規化後（対象テーブル）: {table_name}")
+    return table_name
 
-    db_host = os.environ['DB_HOST']
-    db_port = os.environ['DB_PORT']
-    db_name = os.environ['DB_NAME']
-    db_user = os.environ['DB_USER']
-    db_password = os.environ['DB_PASSWORD']
-    # sns_topic_arn = os.environ.get('SNS_TOPIC_ARN')
+def build_error_response(e, source_file):
+    """予期しないエラーのレスポンス"""
+    import traceback
+    return {
+        'statusCode': 500,
+        'body': json.dumps({
+            'error': f'CSV処理エラー: {str(e)}',
+            'error_type': type(e).__name__,
+            'error_detail': traceback.format_exc(),
+            'source_file': source_file
+        }, ensure_ascii=False)
+    }
 
+def load_csv(source, context=None, event=None, progress=None):
+    """読み込み元（S3CsvSource / LocalCsvSource）のCSVを対象テーブルにロードし、Lambdaと同じ形式のレスポンスを返す
+    
+    contextはLambdaから呼ばれた場合のみ渡す（残り時間によるバッチ調整と続きの起動に使う）。
+    progressを渡すと、コミットごとに(読み込んだバイト数, 挿入行数, 失敗行数)で呼び出す。
+    """
+    load_start = time.monotonic()
+    line_reader = None
     try:
-        # S3イベントから情報取得
-        print("=== S3イベント解析 ===")
-        bucket_name = event['Records'][0]['s3']['bucket']['name']
-        object_key = unquote_plus(event['Records'][0]['s3']['object']['key'])
-        object_size = event['Records'][0]['s3']['object']['size']
-
-        print(f"バケット名: {bucket_name}")
-        print(f"オブジェクトキー: {object_key}")
-        print(f"ファイルサイズ: {object_size} bytes")
-        print(f"処理対象ファイル: s3://{bucket_name}/{object_key}")
-
         # CSVファイルを取得
-        print("=== S3からCSVファイル取得 ===")
-        s3_response = s3_client.get_object(Bucket=bucket_name, Key=object_key)
-        csv_content = s3_response['Body'].read().decode('utf-8')
-        print(f"CSV内容取得完了: {len(csv_content)} 文字")
-
-        # CSV解析
+        print("=== CSVファイル取得 ===")
+        print(f"読み込み元: {source.uri}")
+        body = source.open()
+        
+        # CSV解析（ファイル全体をメモリに読み込まず、読みながら1行ずつ処理）
         print("=== CSV解析 ===")
-        csv_reader = csv.DictReader(io.StringIO(csv_content))
-        rows = list(csv_reader)
-        print(f"CSV行数: {len(rows)}")
+        # 行は辞書にせず列順のリストのまま扱い、カラムは位置で参照する
+        # 読み込んだバイト位置をチェックポイントに記録するため、行単位でバイト数を数えながら読む
+        line_reader = ByteCountingLineReader(body)
+        csv_reader = csv.reader(line_reader)
+        csv_columns = next(csv_reader, [])
+        csv_rows = iter_csv_rows(csv_reader, len(csv_columns))
+        first_row = next(csv_rows, None)
         
-        if rows:
-            print(f"CSVカラム: {list(rows[0].keys())}")
-            print(f"最初の行データ: {rows[0]}")
-
-        if not rows:
+        if first_row:
+            print(f"CSVカラム: {csv_columns}")
+            print(f"最初の行データ: {dict(zip(csv_columns, first_row))}")
+        
+        if not first_row:
             return {
                 'statusCode': 200,
                 'body': json.dumps({'message': 'CSVファイルにデータがありません'}, ensure_ascii=False)
             }
-
+        
         # ファイル名からテーブル名を決定
         print("=== テーブル名決定 ===")
-        file_name = object_key.split('/')[-1]
-        print(f"ファイル名: {file_name}")
-        
-        file_name_without_ext = file_name.replace('.csv', '')
-        print(f"拡張子除去後: {file_name_without_ext}")
+        file_name = source.key.split('/')[-1]
+        table_name = derive_table_name(file_name)
         
-        # アンダースコアで分割して、接頭辞以降を取得
-        parts = file_name_without_ext.split('_', 1)
-        print(f"分割結果: {parts}")
-        
-        if len(parts) >= 2:
-            table_name = parts[1]  # 接頭辞以降がテーブル名
-            print(f"接頭辞除去後のテーブル名: {table_name}")
-        else:
-            # アンダースコアがない場合はファイル名全体をテーブル名とする
-            table_name = file_name_without_ext
-            print(f"アンダースコアなし、全体をテーブル名に: {table_name}")
-        
-        # テーブル名の正規化（英数字とアンダースコアのみ）
-        original_table_name = table_name
-        table_name = ''.join(c for c in table_name if c.isalnum() or c == '_').lower()
-        print(f"正規化前: {original_table_name}")
-        print(f"正規化後（対象テーブル）: {table_name}")
-
         # データベース接続
         print("=== データベース接続 ===")
-        print(f"接続先: {db_host}:{db_port}/{db_name}")
-        
-        conn = psycopg2.connect(
-            host=db_host,
-            port=int(db_port),
-            database=db_name,
-            user=db_user,
-            password=db_password,
-            connect_timeout=30
-        )
+        print(f"接続先: {describe_target()}")
+        
+        conn = get_db_connection()
         print("データベース接続成功")
-
+        
         conn.autocommit = False
         cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
+        
         # テーブル存在確認
         print("=== テーブル存在確認 ===")
         cursor.execute("""
@@ -290,6 +1815,16 @@ def lambda_handler(event, context):
             cursor.close()
             conn.close()
             
+            # 読み込んだ先頭行と残りの行からテーブル定義の案を作る（DB接続は閉じてから読む）
+            schema_proposal = None
+            if SCHEMA_PROPOSAL_PREFIX:
+                try:
+                    schema_proposal = propose_table_schema(
+                        source, table_name, csv_columns, itertools.chain([first_row], csv_reader)
+                    )
+                except Exception as e:
+                    print(f"警告: テーブル定義の推定に失敗: {e}")
+            
             # エラー時のSNS通知
             # if sns_topic_arn:
             #     error_subject = f"CSV処理エラー: {file_name}"
@@ -308,39 +1843,30 @@ def lambda_handler(event, context):
                     'error': error_msg,
                     'table_name': table_name,
                     'existing_tables': existing_tables,
-                    'source_file': f"s3://{bucket_name}/{object_key}"
+                    'schema_proposal': schema_proposal,
+                    'source_file': source.uri
                 }, ensure_ascii=False)
             }
-
-        # 既存テーブルのカラム情報を取得（PRIMARY KEYも含めて取得）
-        print("=== テーブルカラム情報取得 ===")
-        cursor.execute("""
-            SELECT column_name, data_type, is_nullable, column_default
-            FROM information_schema.columns 
-            WHERE table_schema = 'public' 
-            AND table_name = %s 
-            AND column_name NOT IN ('file_source', 'processed_at')
-            ORDER BY ordinal_position
-        """, (table_name,))
         
-        table_columns_info = cursor.fetchall()
+        # 既存テーブルのカラム情報を取得（ウォームスタートでは直近に取得したものを使う）
+        print("=== テーブルカラム情報取得 ===")
+        table_columns_info, system_columns = get_table_schema(cursor, table_name)
         table_columns = [row['column_name'] for row in table_columns_info]
         
         print(f"既存テーブルのカラム数: {len(table_columns)}")
         print(f"既存テーブルのカラム: {table_columns}")
         for col_info in table_columns_info:
             print(f"  - {col_info['column_name']}: {col_info['data_type']} (nullable: {col_info['is_nullable']}, default: {col_info['column_default']})")
-
-        # CSVのカラムを取得
-        csv_columns = list(rows[0].keys())
+        
+        # CSVのカラム
         print(f"CSVのカラム: {csv_columns}")
-
+        
         # CSVのカラムが全てテーブルに存在するか確認
         missing_columns = set(csv_columns) - set(table_columns)
         if missing_columns:
             print(f"警告: CSVに含まれる以下のカラムはテーブルに存在しません: {missing_columns}")
             print("存在するカラムのみINSERTします")
-
+        
         # テーブルに存在するカラムのみを使用
         insert_columns = [col for col in csv_columns if col in table_columns]
         print(f"INSERT対象カラム: {insert_columns}")
@@ -359,29 +1885,23 @@ def lambda_handler(event, context):
                     'table_columns': table_columns
                 }, ensure_ascii=False)
             }
-
+        
         # データ挿入準備
         print("=== データ挿入準備 ===")
         
         # file_sourceとprocessed_atを追加（これらのカラムが存在する場合）
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_schema = 'public' 
-            AND table_name = %s 
-            AND column_name IN ('file_source', 'processed_at')
-        """, (table_name,))
-        
-        system_columns = [row['column_name'] for row in cursor.fetchall()]
         print(f"システムカラム: {system_columns}")
         
         # INSERT文の構築
         all_columns = insert_columns.copy()
+        file_source_literal = None
         placeholders = ['%s'] * len(insert_columns)
         
         if 'file_source' in system_columns:
+            # 全行で同じ値のため、行ごとの値に加えずSQLに埋め込む
             all_columns.append('file_source')
-            placeholders.append('%s')
+            file_source_literal = cursor.mogrify('%s', (source.uri,)).decode('utf-8')
+            placeholders.append(file_source_literal.replace('%', '%%'))
             print("file_sourceカラムを追加")
         
         column_names = ', '.join([f'"{col}"' for col in all_columns])
@@ -389,7 +1909,40 @@ def lambda_handler(event, context):
         insert_sql = f'INSERT INTO "{table_name}" ({column_names}) VALUES ({placeholders_str})'
         
         print(f"INSERT SQL: {insert_sql}")
-
+        
+        # ロードオプション（LOAD_CONFIG）
+        load_options = get_load_options(table_name, source.key)
+        print(f"ロードオプション: {load_options}")
+        
+        # 行の絞り込み（条件を満たす行だけを解析・挿入する）
+        filter_conditions = []
+        if load_options.get('filter'):
+            filter_conditions = parse_filter_spec(load_options['filter'])
+            missing_filter_columns = [column for column, _, _ in filter_conditions if column not in csv_columns]
+            if missing_filter_columns:
+                raise ValueError(f"filterのカラム {missing_filter_columns} がCSVにありません")
+        
+        # トレース（再現用の一式）はS3イベントで起動された場合のみ出力する（ローカルからのロードと再現では出力しない）
+        trace_schema = None
+        if load_options.get('trace') and event is not None:
+            try:
+                trace_schema = snapshot_table_schema(cursor, table_name)
+            except psycopg2.Error as e:
+                conn.rollback()
+                print(f"警告: トレース用のテーブル定義の取得に失敗: {e}")
+        
+        # 初回ロードモード: 空テーブルならセカンダリインデックスを削除してロード後に再作成
+        deferred_indexes = []
+        if load_options.get('initial_load'):
+            print("=== 初回ロードモード ===")
+            
+            # 前回の初回ロードが中断していた場合は、退避中のインデックスを先に復元
+            index_restore = restore_deferred_indexes(table_name)
+            if index_restore['restored_indexes']:
+                print(f"前回退避されたインデックスを復元: {index_restore['restored_indexes']}")
+            
+            deferred_indexes = defer_secondary_indexes(conn, cursor, table_name, source.uri)
+        
         # データ挿入
         print("=== データ挿入開始 ===")
         total_inserted = 0
@@ -400,84 +1953,227 @@ def lambda_handler(event, context):
         # カラム情報を辞書形式で保持（エラー解析用）
         column_info = {col['column_name']: col for col in table_columns_info}
         
-        for i, row in enumerate(rows):
-            try:
-                values = []
-                for col in insert_columns:
-                    value = row.get(col, '')
-                    if value == '':
-                        values.append(None)
-                    else:
-                        values.append(str(value))
-                
-                # file_source情報を追加（カラムが存在する場合）
-                if 'file_source' in system_columns:
-                    values.append(f"s3://{bucket_name}/{object_key}")
-                
-                print(f"行 {i+1}: 挿入値: {values}")
-                
-                cursor.execute(insert_sql, values)
-                conn.commit()  # 各行ごとにコミット
-                total_inserted += 1
-                print(f"行 {i+1}: 挿入成功")
-                
-                if (i + 1) % 100 == 0:
-                    print(f"処理中: {i + 1}/{len(rows)} 行")
-                    
-            except psycopg2.Error as e:
-                failed_rows += 1
-                
-                # PostgreSQLエラーを詳細に解析
-                error_info = parse_postgres_error(e, row, column_info)
-                
-                # エラーの詳細をログ出力
-                error_log = format_error_details(i + 1, row, error_info)
-                print(error_log)
-                
-                # エラータイプ別に集計
-                error_type = error_info['error_type']
-                if error_type not in error_summary:
-                    error_summary[error_type] = {
-                        'count': 0,
-                        'examples': []
-                    }
-                
-                error_summary[error_type]['count'] += 1
-                if len(error_summary[error_type]['examples']) < 3:
-                    error_summary[error_type]['examples'].append({
-                        'row_number': i + 1,
-                        'affected_columns': error_info['affected_columns'],
-                        'details': error_info['details']
-                    })
+        source_file = source.uri
+        
+        # 行数の記録方法（accounting: メタデータテーブルで加算 / estimate: pg_class.reltuples / exact: COUNT(*)）
+        row_count_mode = load_options.get('row_count_mode', 'accounting')
+        if row_count_mode == 'accounting':
+            seed_table_row_count(conn, cursor, table_name)
+        
+        # パーティションテーブルはパーティションごとにバッチを分けて直接挿入する
+        partition_spec = get_partition_spec(cursor, table_name, load_options)
+        partition_targets = {}
+        if partition_spec:
+            print(f"パーティションロード: キー={partition_spec['column']}, 単位={partition_spec['interval']}, 方式={partition_spec['mode']}")
+        
+        # スワップ方式のテーブルは入れ替え時にまとめて行数を記録する
+        count_table = table_name if row_count_mode == 'accounting' else None
+        if partition_spec and partition_spec['mode'] == 'swap':
+            count_table = None
+        
+        # 集計テーブル（挿入した行の差分を加算。swap方式はバッチごとには加算せず、入れ替え時にパーティション単位で差し引く）
+        summary_deltas, summary_rebuilds = prepare_summary_deltas(conn, cursor, table_name, insert_columns)
+        batch_summary_deltas = () if partition_spec and partition_spec['mode'] == 'swap' else summary_deltas
+        
+        # 重複除去のキー（解析するカラムに含めるため、行を読む前に決める）
+        dedup_keep = load_options.get('dedup')
+        key_columns = []
+        if dedup_keep:
+            dedup_keep = 'last' if dedup_keep is True else dedup_keep
+            if dedup_keep not in ('first', 'last'):
+                raise ValueError(f"dedupには first または last を指定してください: {dedup_keep}")
+            
+            key_columns = get_dedup_key_columns(cursor, table_name)
+            missing_key_columns = [col for col in key_columns if col not in csv_columns]
+            if not key_columns:
+                print(f"警告: テーブル '{table_name}' に主キー・一意制約がないため重複除去を行いません")
+            elif missing_key_columns:
+                print(f"警告: キーカラム {missing_key_columns} がCSVにないため重複除去を行いません")
+                key_columns = []
+        
+        # 挿入・重複除去・パーティションの振り分けに使うカラムだけを取り出す（ヘッダーとの対応は1回だけ求める）
+        # 以降の行はこのカラム順のタプルで扱う
+        needed_columns = set(insert_columns) | set(key_columns)
+        if partition_spec:
+            needed_columns.add(partition_spec['column'])
+        needed_columns.update(column for column, _, _ in filter_conditions)
+        projection = [i for i, col in enumerate(csv_columns) if col in needed_columns]
+        row_columns = [csv_columns[i] for i in projection]
+        if len(projection) < len(csv_columns):
+            print(f"CSVの{len(csv_columns)}カラムのうち{len(projection)}カラムのみ取り出します")
+        
+        # (行番号, 行)の並び。行番号はCSVのデータ行の通し番号
+        first_row = make_row_picker(projection)(first_row)
+        line_filter = make_line_filter(filter_conditions) if filter_conditions else None
+        numbered_rows = enumerate(itertools.chain([first_row], iter_projected_rows(line_reader, projection, line_filter)), 1)
+        
+        # 行の絞り込み: 条件を満たさない行は重複除去・統計・挿入の対象にしない（行番号はファイルの通し番号のまま）
+        filter_result = None
+        if filter_conditions:
+            filter_result = {'conditions': load_options['filter'], 'skipped_rows': 0, 'prefiltered_rows': 0}
+            row_filter = make_row_filter(filter_conditions, row_columns)
+            numbered_rows = filter_rows(numbered_rows, row_filter, filter_result)
+            print(f"行の絞り込み: {load_options['filter']}（分割前の判定: {'あり' if line_filter else 'なし'}）")
+        
+        # 重複除去: テーブルのキーが重複する行を挿入前に除く
+        dedup_result = None
+        if key_columns:
+            print(f"=== 重複除去（キー: {key_columns}, 残す行: {dedup_keep}） ===")
+            key_indexes = [row_columns.index(col) for col in key_columns]
+            numbered_rows, dedup_result = dedup_rows(numbered_rows, key_columns, key_indexes, dedup_keep)
+            print(f"重複除去: {dedup_result['dropped_rows']}行を除外")
+        
+        # 挿入するカラムの位置を事前に求め、各行からはタプルで取り出す
+        pick_values = make_row_picker([row_columns.index(col) for col in insert_columns])
+        partition_index = None
+        if partition_spec and partition_spec['column'] in row_columns:
+            partition_index = row_columns.index(partition_spec['column'])
+        
+        # カラムの品質統計（挿入するカラムの値をバッチごとに抽出して集計、ロードオプション column_stats: false で無効）
+        column_stats = None
+        if load_options.get('column_stats', True):
+            column_stats = ColumnStatsCollector([(col, column_info[col]['data_type']) for col in insert_columns])
+        
+        total_rows = 0
+        coordinated_result = None
+        checkpoint = None
+        controller = None
+        continued = False
+        if load_options.get('coordinated'):
+            # 協調ロード: ステージングテーブル経由で対象テーブルへ一括マージ（パーティションへは親テーブル経由で振り分け）
+            if partition_spec and partition_spec['mode'] == 'swap':
+                raise ValueError("協調ロードモードはパーティションのswap方式と併用できません")
+            
+            print("=== 協調ロードモード ===")
+            coordinated_result = load_coordinated(
+                conn, cursor, table_name, numbered_rows, pick_values, insert_columns, file_source_literal,
+                row_columns, column_info, error_summary, failed_details, source_file, count_table,
+                load_options, context, column_stats, summary_deltas
+            )
+            total_rows = coordinated_result['total_rows']
+            total_inserted = coordinated_result['inserted_rows']
+            failed_rows = coordinated_result['failed_rows']
+        else:
+            # 中断したロードの続きから再開できるよう、コミットごとに処理済みの行番号を記録する
+            # （swap方式はスワップ用テーブルを作り直すため対象外）
+            checkpoint = None
+            if not (partition_spec and partition_spec['mode'] == 'swap'):
+                checkpoint = start_checkpoint(conn, cursor, source_file, source.etag, table_name)
+            resume_row = checkpoint['resumed_from_row'] if checkpoint else 0
+            
+            # 再開時は前の起動までの統計を引き継ぐ（強制終了した起動の分は保存されないため、統計の行数が少なくなる）
+            if column_stats and resume_row:
+                column_stats.merge_records(load_column_stats(conn, cursor, source_file, source.etag, resume_row))
+            
+            # バイト位置はファイルの順に読む場合のみ有効（重複除去時は読み直して行番号で読み飛ばす）
+            track_offset = checkpoint is not None and dedup_result is None
+            if track_offset and checkpoint['byte_offset']:
+                line_reader.close()
+                line_reader, numbered_rows = open_csv_from_offset(source, checkpoint, projection, line_filter)
+                if filter_result:
+                    numbered_rows = filter_rows(numbered_rows, row_filter, filter_result)
+                total_rows = resume_row
+            
+            # 残り時間が少なくなったらコミット済みの位置で区切って続きを引き継ぐ
+            can_continue = checkpoint is not None and context is not None
+            if can_continue and event.get('continuation', 0) >= CONTINUATION_MAX:
+                print(f"警告: 続きの起動が上限（{CONTINUATION_MAX}回）に達したため、この起動で最後まで処理します")
+                can_continue = False
+            
+            controller = BatchSizeController(COMMIT_BATCH_SIZE, context)
+            batches = {}
+            pending_rows = 0
+            pending_bytes = 0
+            row_number = resume_row
+            for row_number, row in numbered_rows:
+                total_rows += 1
                 
-                # 既存のfailed_detailsにも追加
-                error_detail = {
-                    'row_number': i + 1,
-                    'error': str(e),
-                    'error_info': error_info,
-                    'values': values,
-                    'row_data': row
-                }
-                failed_details.append(error_detail)
+                # 前回の起動でコミット済みの行は読み飛ばす
+                if row_number <= resume_row:
+                    continue
                 
-                conn.rollback()  # エラー時はロールバック
+                # 空欄だけNULLに置き換え、それ以外の値はCSVの文字列をそのまま使う
+                values = pick_values(row)
+                if '' in values:
+                    values = tuple(None if value == '' else value for value in values)
                 
-            except Exception as e:
-                # PostgreSQL以外のエラー
-                failed_rows += 1
-                error_detail = {
-                    'row_number': i + 1,
-                    'error': str(e),
-                    'values': values,
-                    'row_data': row
-                }
-                failed_details.append(error_detail)
+                target_table = table_name
+                if partition_spec:
+                    partition_value = row[partition_index] if partition_index is not None else None
+                    target_table = resolve_partition_target(
+                        conn, cursor, table_name, partition_spec, partition_value, partition_targets
+                    )
+                    if target_table is None:
+                        failed_rows += 1
+                        if checkpoint:
+                            checkpoint['failed_rows'] += 1
+                        record_row_error(
+                            row_number, row, row_columns,
+                            ValueError(f"パーティションキー '{partition_spec['column']}' の値を日付として解釈できません: {partition_value}"),
+                            column_info, error_summary, failed_details
+                        )
+                        continue
                 
-                print(f"行 {i+1} の処理でエラー: {e}")
-                print(f"失敗した値: {values}")
-                print(f"元のデータ: {row}")
+                batches.setdefault(target_table, []).append((row_number, row, values))
+                pending_rows += 1
+                pending_bytes += sum(map(len, row))
                 
-                conn.rollback()
+                # 制御器が決めた行数ごとにまとめて挿入し、チェックポイントと一緒にコミット
+                if pending_rows >= controller.batch_size:
+                    if track_offset:
+                        checkpoint['byte_offset'] = line_reader.offset
+                    if column_stats:
+                        add_batch_stats(column_stats, batches)
+                    flush_start = time.monotonic()
+                    inserted, failed = flush_batches(
+                        conn, cursor, batches, column_names, placeholders_str, row_columns, column_info,
+                        error_summary, failed_details, source_file, count_table, partition_targets,
+                        checkpoint, row_number, batch_summary_deltas
+                    )
+                    total_inserted += inserted
+                    failed_rows += failed
+                    controller.observe(pending_rows, (time.monotonic() - flush_start) * 1000, pending_bytes)
+                    batches = {}
+                    pending_rows = 0
+                    pending_bytes = 0
+                    print(f"処理中: {row_number} 行目（次のバッチ: {controller.batch_size}行）")
+                    if progress:
+                        progress(line_reader.offset, total_inserted, failed_rows)
+                    
+                    if can_continue and context.get_remaining_time_in_millis() < CONTINUATION_THRESHOLD_MS:
+                        print(f"残り時間が少ないため {row_number} 行目で区切ります")
+                        continued = True
+                        break
+            
+            if track_offset:
+                checkpoint['byte_offset'] = line_reader.offset
+            if column_stats:
+                add_batch_stats(column_stats, batches)
+            inserted, failed = flush_batches(
+                conn, cursor, batches, column_names, placeholders_str, row_columns, column_info,
+                error_summary, failed_details, source_file, count_table, partition_targets,
+                checkpoint, row_number, batch_summary_deltas
+            )
+            total_inserted += inserted
+            failed_rows += failed
+            
+            if checkpoint and not continued:
+                finish_checkpoint(conn, cursor, source_file, checkpoint)
+        
+        # スナップショットファイルは、読み込んだパーティションを既存のものと入れ替える
+        if partition_spec and partition_spec['mode'] == 'swap':
+            print("=== パーティション入れ替え ===")
+            if failed_rows:
+                # 欠けたスナップショットで既存データを置き換えないよう、既存パーティションを残す
+                print(f"エラー行が{failed_rows}行あるため入れ替えを中止し、既存パーティションを維持します")
+                for staging_name in partition_targets:
+                    cursor.execute(f'DROP TABLE IF EXISTS "{staging_name}"')
+                conn.commit()
+            else:
+                for staging_name, target in partition_targets.items():
+                    target['replaced_rows'] = swap_partition(
+                        conn, cursor, table_name, staging_name, target, source_file, row_count_mode, summary_deltas
+                    )
         
         # エラーサマリーを出力
         if error_summary:
@@ -493,28 +2189,48 @@ def lambda_handler(event, context):
                         print(f"     - {detail}")
             print("="*60 + "\n")
         
+        # 重複除去・絞り込みで除いた行もファイルの総行数に含める
+        if dedup_result:
+            total_rows += dedup_result['dropped_rows']
+        if filter_result:
+            total_rows += filter_result['skipped_rows']
+            print(f"行の絞り込み: {filter_result['skipped_rows']}行を除外（うち分割前に除外: {filter_result['prefiltered_rows']}行）")
+        
+        # カラムの品質統計を保存（続きを引き継ぐ場合も、次の起動がマージできるよう保存する）
+        column_stats_saved = False
+        if column_stats:
+            column_stats_saved = save_column_stats(
+                conn, cursor, column_stats, source_file, source.etag, table_name,
+                checkpoint['last_row_number'] if checkpoint else total_rows
+            )
+        
         print(f"=== データ挿入完了 ===")
+        print(f"CSV行数: {total_rows}")
         print(f"成功: {total_inserted}行")
         print(f"失敗: {failed_rows}行")
         
-        # 処理結果確認
+        # 初回ロードモードで削除したインデックスを再作成
+        if deferred_indexes:
+            index_restore = restore_deferred_indexes(table_name)
+        
+        summary_results = refresh_summaries(conn, cursor, summary_deltas, summary_rebuilds)
+        
+        # 処理結果確認（全件COUNTを避け、記録済みの行数または統計情報の推定値を使う）
         print("=== 最終結果確認 ===")
-        cursor.execute(f'SELECT COUNT(*) as count FROM "{table_name}"')
-        result = cursor.fetchone()
-        final_count = result['count'] if result else 0
-        print(f"テーブル '{table_name}' の最終行数: {final_count}")
+        final_count = get_table_row_count(cursor, table_name, row_count_mode)
+        print(f"テーブル '{table_name}' の最終行数: {final_count}（{row_count_mode}）")
         
         cursor.close()
         conn.close()
-
+        
         success_message = f"CSV処理完了: {total_inserted}行挿入, {failed_rows}行失敗, テーブル '{table_name}' 最終行数: {final_count}"
         print(f"=== 処理結果 ===")
         print(success_message)
-
+        
         # SNS通知の送信
         # if sns_topic_arn:
         #     # 成功率に応じて通知レベルを変更
-        #     success_rate = (total_inserted / len(rows) * 100) if len(rows) > 0 else 0
+        #     success_rate = (total_inserted / total_rows * 100) if total_rows > 0 else 0
         #     
         #     if success_rate == 100:
         #         subject = f"✅ CSV処理成功: {file_name}"
@@ -524,41 +2240,115 @@ def lambda_handler(event, context):
         #         subject = f"❌ CSV処理エラー多数: {file_name} ({success_rate:.1f}%成功)"
         #     
         #     message = create_sns_message(
-        #         file_name, table_name, len(rows), 
+        #         file_name, table_name, total_rows, 
         #         total_inserted, failed_rows, error_summary
         #     )
         #     
         #     send_sns_notification(sns_client, sns_topic_arn, subject, message)
-
+        
         # レスポンスボディに error_summary を追加
         response_body = {
             'message': success_message,
             'table_name': table_name,
-            'source_file': f"s3://{bucket_name}/{object_key}",
-            'total_rows': len(rows),
+            'source_file': source.uri,
+            'total_rows': total_rows,
             'inserted_rows': total_inserted,
             'failed_rows': failed_rows,
             'final_table_count': final_count,
+            'row_count_mode': row_count_mode,
             'matched_columns': insert_columns,
             'missing_columns': list(missing_columns) if missing_columns else [],
-            'failed_details': failed_details[:10]  # 最初の10件のエラー詳細
+            'failed_details': failed_details  # 最初の10件のエラー詳細
         }
         
         # error_summaryがある場合は追加
         if error_summary:
             response_body['error_summary'] = error_summary
-
+        
+        if dedup_result:
+            response_body['dedup'] = dedup_result
+        
+        if filter_result:
+            response_body['filter'] = filter_result
+        
+        if coordinated_result:
+            response_body['coordinated'] = coordinated_result
+        
+        if controller:
+            response_body['batch_sizing'] = controller.summary()
+        
+        if summary_results:
+            response_body['summary_tables'] = summary_results
+        
+        if column_stats:
+            response_body['column_stats'] = {
+                'saved': column_stats_saved,
+                'collect_ms': round(column_stats.elapsed * 1000),
+                'sample_every': column_stats.sample_every,
+                'columns': column_stats.summary()
+            }
+        
+        if checkpoint and checkpoint['resumed_from_row']:
+            response_body['resumed_from_row'] = checkpoint['resumed_from_row']
+        
+        # 途中で区切った場合は続きを起動（件数はこのファイルの累計）
+        if continued:
+            response_body['continuation'] = {
+                'invocation': invoke_continuation(context, event, checkpoint),
+                'last_row_number': checkpoint['last_row_number'],
+                'byte_offset': checkpoint['byte_offset'],
+                'inserted_rows': checkpoint['inserted_rows'],
+                'failed_rows': checkpoint['failed_rows']
+            }
+        
+        if partition_targets:
+            response_body['partitions'] = {
+                'column': partition_spec['column'],
+                'interval': partition_spec['interval'],
+                'mode': partition_spec['mode'],
+                'swap_skipped': partition_spec['mode'] == 'swap' and failed_rows > 0,
+                'targets': [
+                    {
+                        'partition_name': target['partition_name'],
+                        'range': [target['start'].isoformat(), target['end'].isoformat()],
+                        'inserted_rows': target['inserted_rows'],
+                        'replaced_rows': target.get('replaced_rows', 0)
+                    }
+                    for target in partition_targets.values()
+                ]
+            }
+        
+        if deferred_indexes:
+            response_body['initial_load'] = {
+                'deferred_indexes': deferred_indexes,
+                'restored_indexes': index_restore['restored_indexes'],
+                'restore_errors': index_restore['restore_errors'],
+                'index_rebuild_ms': index_restore['rebuild_ms']
+            }
+        
+        if trace_schema is not None:
+            response_body['trace'] = capture_load_trace(
+                source, event, table_name, load_options, trace_schema, 200, dict(response_body), total_rows, load_start
+            )
+        
         return {
             'statusCode': 200,
             'body': json.dumps(response_body, ensure_ascii=False)
         }
-
+    
     except Exception as e:
         print(f"=== 予期しないエラー ===")
         print(f"CSV処理エラー: {str(e)}")
         import traceback
         print(f"詳細エラー: {traceback.format_exc()}")
         
+        # 初回ロードモードで削除したインデックスを復元（失敗しても退避テーブルに定義が残る）
+        if 'deferred_indexes' in locals() and deferred_indexes:
+            try:
+                restore_deferred_indexes(table_name)
+            except Exception as restore_error:
+                print(f"インデックス復元エラー（次回ロード時に再試行）: {restore_error}")
+        
         # 予期しないエラー時のSNS通知
         # if 'sns_topic_arn' in locals() and sns_topic_arn:
         #     critical_subject = f"🚨 CSV処理で重大エラー: {file_name if 'file_name' in locals() else 'unknown'}"
@@ -572,12 +2362,50 @@ def lambda_handler(event, context):
         # """
         #     send_sns_notification(sns_client, sns_topic_arn, critical_subject, critical_message)
         
-        return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'error': f'CSV処理エラー: {str(e)}',
-                'error_type': type(e).__name__,
-                'error_detail': traceback.format_exc(),
-                'source_file': f"s3://{bucket_name}/{object_key}" if 'bucket_name' in locals() else 'unknown'
-            }, ensure_ascii=False)
-        }
\ No newline at end of file
+        error_response = build_error_response(e, source.uri)
+        if 'trace_schema' in locals() and trace_schema is not None:
+            capture_load_trace(
+                source, event, table_name, load_options, trace_schema, 500, json.loads(error_response['body']), None, load_start
+            )
+        return error_response
+    
+    finally:
+        if line_reader:
+            line_reader.close()
+
+def lambda_handler(event, context):
+    print("=== CSV処理Lambda関数開始 ===")
+    print(f"Event: {json.dumps(event, ensure_ascii=False)}")
+    
+    # 環境変数のデバッグ
+    print("=== 環境変数 ===")
+    print(f"DB_HOST: {os.environ.get('DB_HOST', 'NOT_SET')}")
+    print(f"DB_PORT: {os.environ.get('DB_PORT', 'NOT_SET')}")
+    print(f"DB_NAME: {os.environ.get('DB_NAME', 'NOT_SET')}")
+    print(f"DB_USER: {os.environ.get('DB_USER', 'NOT_SET')}")
+    print(f"DB_PASSWORD: {'SET' if os.environ.get('DB_PASSWORD') else 'NOT_SET'}")
+    # print(f"SNS_TOPIC_ARN: {os.environ.get('SNS_TOPIC_ARN', 'NOT_SET')}")
+    
+    s3_client = boto3.client('s3')
+    # sns_client = boto3.client('sns')
+    
+    # sns_topic_arn = os.environ.get('SNS_TOPIC_ARN')
+    
+    try:
+        # S3イベントから情報取得
+        print("=== S3イベント解析 ===")
+        bucket_name = event['Records'][0]['s3']['bucket']['name']
+        object_key = unquote_plus(event['Records'][0]['s3']['object']['key'])
+        object_size = event['Records'][0]['s3']['object']['size']
+        
+        print(f"バケット名: {bucket_name}")
+        print(f"オブジェクトキー: {object_key}")
+        print(f"ファイルサイズ: {object_size} bytes")
+        print(f"処理対象ファイル: s3://{bucket_name}/{object_key}")
+        source = S3CsvSource(s3_client, bucket_name, object_key)
+    except Exception as e:
+        print(f"=== S3イベント解析エラー ===")
+        print(f"CSV処理エラー: {str(e)}")
+        return build_error_response(e, 'unknown')
+    
+    return load_csv(source, context, event)
@@ -0,0 +1,327 @@
+import hashlib
+import json
+import boto3
+import psycopg2
+import psycopg2.extras
+import os
+import re
+import traceback
+from datetime import datetime
+from db_connection import describe_target, get_db_connection
+from query_stats import query_shape
+
+# 分析対象とするクエリ形状の下限（合計実行時間）
+ADVISOR_MIN_TOTAL_TIME_MS = int(os.environ.get('ADVISOR_MIN_TOTAL_TIME_MS', '1000'))
+# インデックスを推奨する最小テーブル行数（小さなテーブルはシーケンシャルスキャンで十分）
+ADVISOR_MIN_TABLE_ROWS = int(os.environ.get('ADVISOR_MIN_TABLE_ROWS', '10000'))
+# 1回の分析で出力する推奨インデックスの上限
+ADVISOR_MAX_RECOMMENDATIONS = int(os.environ.get('ADVISOR_MAX_RECOMMENDATIONS', '10'))
+# 複合インデックスのカラム数上限
+ADVISOR_MAX_INDEX_COLUMNS = 3
+
+SQL_KEYWORDS = {
+    'where', 'join', 'left', 'right', 'inner', 'outer', 'full', 'cross', 'on', 'group',
+    'order', 'limit', 'offset', 'using', 'natural', 'union', 'having', 'window', 'as',
+    'and', 'or', 'not', 'select', 'from', 'is', 'in', 'null', 'true', 'false', 'between'
+}
+
+TABLE_PATTERN = re.compile(r'\b(?:FROM|JOIN)\s+(?:public\.)?"?(\w+)"?(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+WHERE_PATTERN = re.compile(r'\bWHERE\b(.*?)(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|\bHAVING\b|\bOFFSET\b|\)\s*AS\b|$)', re.IGNORECASE | re.DOTALL)
+JOIN_ON_PATTERN = re.compile(r'\bON\b(.*?)(?=\bJOIN\b|\bLEFT\b|\bRIGHT\b|\bINNER\b|\bWHERE\b|\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|$)', re.IGNORECASE | re.DOTALL)
+ORDER_BY_PATTERN = re.compile(r'\bORDER\s+BY\b(.*?)(?=\bLIMIT\b|\bOFFSET\b|$)', re.IGNORECASE | re.DOTALL)
+PREDICATE_PATTERN = re.compile(
+    r'(?:"?(\w+)"?\.)?"?(\w+)"?\s*(=|<>|!=|<=|>=|<|>|\bIN\b|\bIS\b|\bBETWEEN\b)',
+    re.IGNORECASE
+)
+COLUMN_REF_PATTERN = re.compile(r'"?(\w+)"?\."?(\w+)"?')
+ORDER_COLUMN_PATTERN = re.compile(r'^(?:"?(\w+)"?\.)?"?(\w+)"?(?:\s+(?:ASC|DESC))?(?:\s+NULLS\s+(?:FIRST|LAST))?$', re.IGNORECASE)
+
+def load_query_shapes(cursor):
+    """query_statsと（利用可能なら）pg_stat_statementsからクエリ形状と合計実行時間を集める"""
+    shapes = {}
+    
+    cursor.execute("""
+        SELECT query_shape, SUM(calls) AS calls, SUM(total_time_ms) AS total_time_ms
+        FROM query_stats
+        GROUP BY query_shape
+        HAVING SUM(total_time_ms) >= %s
+    """, (ADVISOR_MIN_TOTAL_TIME_MS,))
+    for row in cursor.fetchall():
+        shapes[row['query_shape']] = {
+            'calls': int(row['calls']),
+            'total_time_ms': float(row['total_time_ms']),
+            'sources': ['query_stats']
+        }
+    print(f"query_stats: {len(shapes)}形状")
+    
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements')")
+    if cursor.fetchone()['exists']:
+        cursor.execute("""
+            SELECT query, calls, total_exec_time
+            FROM pg_stat_statements
+            WHERE query ILIKE 'select%%' AND total_exec_time >= %s
+        """, (ADVISOR_MIN_TOTAL_TIME_MS,))
+        statements = cursor.fetchall()
+        for row in statements:
+            shape = query_shape(row['query'])
+            entry = shapes.setdefault(shape, {'calls': 0, 'total_time_ms': 0.0, 'sources': []})
+            # 同じ形状が両方にある場合は大きい方を採用（二重計上を避ける）
+            entry['calls'] = max(entry['calls'], int(row['calls']))
+            entry['total_time_ms'] = max(entry['total_time_ms'], float(row['total_exec_time']))
+            if 'pg_stat_statements' not in entry['sources']:
+                entry['sources'].append('pg_stat_statements')
+        print(f"pg_stat_statements: {len(statements)}件")
+    else:
+        print("pg_stat_statements は無効のためquery_statsのみで分析します")
+    
+    return shapes
+
+def load_table_catalog(cursor):
+    """publicスキーマのテーブルごとのカラム・推定行数・既存インデックスを取得"""
+    cursor.execute("""
+        SELECT c.relname AS table_name, c.reltuples::BIGINT AS estimated_rows
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p')
+    """)
+    tables = {
+        row['table_name']: {'estimated_rows': row['estimated_rows'], 'columns': set(), 'indexes': []}
+        for row in cursor.fetchall()
+    }
+    
+    cursor.execute("""
+        SELECT table_name, column_name
+        FROM information_schema.columns
+        WHERE table_schema = 'public'
+    """)
+    for row in cursor.fetchall():
+        if row['table_name'] in tables:
+            tables[row['table_name']]['columns'].add(row['column_name'])
+    
+    cursor.execute("""
+        SELECT t.relname AS table_name, i.relname AS index_name,
+               ARRAY(
+                   SELECT a.attname
+                   FROM unnest(ix.indkey) WITH ORDINALITY AS k(attnum, ord)
+                   JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+                   ORDER BY k.ord
+               ) AS columns
+        FROM pg_index ix
+        JOIN pg_class t ON t.oid = ix.indrelid
+        JOIN pg_class i ON i.oid = ix.indexrelid
+        JOIN pg_namespace n ON n.oid = t.relnamespace
+        WHERE n.nspname = 'public'
+    """)
+    for row in cursor.fetchall():
+        if row['table_name'] in tables:
+            tables[row['table_name']]['indexes'].append(list(row['columns']))
+    
+    return tables
+
+def resolve_column(qualifier, column, alias_map, tables):
+    """修飾子（テーブル名/別名）とカラム名から対象テーブルを特定"""
+    column = column.lower()
+    
+    if qualifier:
+        table_name = alias_map.get(qualifier.lower())
+        if table_name and column in tables[table_name]['columns']:
+            return table_name, column
+        return None, None
+    
+    # 修飾子なしの場合はクエリ内のテーブルのうち、そのカラムを持つものが1つだけなら確定
+    candidates = {table_name for table_name in alias_map.values() if column in tables[table_name]['columns']}
+    if len(candidates) == 1:
+        return candidates.pop(), column
+    return None, None
+
+def analyze_shape(shape, tables):
+    """クエリ形状から、テーブルごとの等価条件・範囲条件・ソートカラムを抽出"""
+    alias_map = {}
+    for match in TABLE_PATTERN.finditer(shape):
+        table_name = match.group(1).lower()
+        if table_name not in tables:
+            continue
+        alias_map[table_name] = table_name
+        alias = match.group(2)
+        if alias and alias.lower() not in SQL_KEYWORDS:
+            alias_map[alias.lower()] = table_name
+    
+    if not alias_map:
+        return {}
+    
+    usage = {}
+    
+    def add_column(kind, qualifier, column):
+        table_name, column = resolve_column(qualifier, column, alias_map, tables)
+        if table_name:
+            columns = usage.setdefault(table_name, {'equality': [], 'range': [], 'order': []})[kind]
+            if column not in columns:
+                columns.append(column)
+    
+    for match in WHERE_PATTERN.finditer(shape):
+        for qualifier, column, operator in PREDICATE_PATTERN.findall(match.group(1)):
+            if column.lower() in SQL_KEYWORDS:
+                continue
+            kind = 'equality' if operator.upper() in ('=', 'IN', 'IS') else 'range'
+            add_column(kind, qualifier, column)
+    
+    # 結合条件は両辺のカラムを等価条件として扱う
+    for match in JOIN_ON_PATTERN.finditer(shape):
+        for qualifier, column in COLUMN_REF_PATTERN.findall(match.group(1)):
+            add_column('equality', qualifier, column)
+    
+    for match in ORDER_BY_PATTERN.finditer(shape):
+        for item in match.group(1).split(','):
+            order_match = ORDER_COLUMN_PATTERN.match(item.strip())
+            if order_match:
+                add_column('order', order_match.group(1), order_match.group(2))
+    
+    return usage
+
+def is_covered(index_columns, existing_indexes):
+    """既存インデックスの先頭カラムが候補と一致していれば不要と判定"""
+    return any(existing[:len(index_columns)] == index_columns for existing in existing_indexes)
+
+def build_recommendations(shapes, tables):
+    """クエリ形状ごとの条件カラムから候補インデックスを作り、合計実行時間で重み付けする"""
+    candidates = {}
+    
+    for shape, stats in shapes.items():
+        for table_name, columns in analyze_shape(shape, tables).items():
+            if tables[table_name]['estimated_rows'] < ADVISOR_MIN_TABLE_ROWS:
+                continue
+            
+            # 等価条件を先頭に、続けて範囲条件（なければソート）カラムを1つ
+            index_columns = list(columns['equality'])
+            trailing = columns['range'][:1] or columns['order'][:1]
+            index_columns += [column for column in trailing if column not in index_columns]
+            index_columns = index_columns[:ADVISOR_MAX_INDEX_COLUMNS]
+            
+            if not index_columns or is_covered(index_columns, tables[table_name]['indexes']):
+                continue
+            
+            key = (table_name, tuple(index_columns))
+            candidate = candidates.setdefault(key, {
+                'table_name': table_name,
+                'columns': index_columns,
+                'score_ms': 0.0,
+                'calls': 0,
+                'example_shapes': []
+            })
+            candidate['score_ms'] += stats['total_time_ms']
+            candidate['calls'] += stats['calls']
+            if len(candidate['example_shapes']) < 3:
+                candidate['example_shapes'].append(shape[:200])
+    
+    # 他の候補の先頭部分に含まれる候補は除外（複合インデックスで代用できる）
+    recommendations = sorted(candidates.values(), key=lambda c: c['score_ms'], reverse=True)
+    selected = []
+    for candidate in recommendations:
+        if any(
+            other['table_name'] == candidate['table_name']
+            and other['columns'][:len(candidate['columns'])] == candidate['columns']
+            for other in selected
+        ):
+            continue
+        selected.append(candidate)
+        if len(selected) >= ADVISOR_MAX_RECOMMENDATIONS:
+            break
+    
+    return selected
+
+def advisor_index_name(table_name, columns):
+    """推奨インデックスの名前（識別子の上限63バイトに収まるよう読める部分を切り詰め、テーブルとカラムのハッシュを付ける）
+    
+    切り詰めた名前やカラム名の区切りが重なっても、別のインデックスが同じ名前になってIF NOT EXISTSで作られないことがないようにする。
+    """
+    digest = hashlib.md5(json.dumps([table_name, columns]).encode('utf-8')).hexdigest()[:8]
+    readable = f"idx_adv_{table_name}_{'_'.join(columns)}".encode('utf-8')[:63 - len(digest) - 1]
+    return f"{readable.decode('utf-8', 'ignore')}_{digest}"
+
+def render_sql_file(recommendations, generated_at):
+    """table_creatorが読み込める形式（コメント + セミコロン区切り）でSQLファイルを作成"""
+    lines = [
+        f"-- index-advisor: {generated_at.strftime('%Y-%m-%d %H:%M:%S')}",
+        "-- 観測されたクエリ形状から自動生成した推奨インデックス",
+        "-- CONCURRENTLYのためトランザクション外（autocommit）で実行してください",
+        ""
+    ]
+    
+    for rec in recommendations:
+        index_name = advisor_index_name(rec['table_name'], rec['columns'])
+        column_list = ', '.join(f'"{column}"' for column in rec['columns'])
+        lines.append(f"-- スコア: {rec['score_ms']:.0f}ms / 呼び出し回数: {rec['calls']}")
+        for shape in rec['example_shapes']:
+            lines.append(f"-- 例: {' '.join(shape.split())}")
+        lines.append(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{index_name}" ON "{rec["table_name"]}" ({column_list});')
+        lines.append("")
+    
+    return '\n'.join(lines)
+
+def lambda_handler(event, context):
+    print("=== インデックスアドバイザーLambda関数開始 ===")
+    print(f"Event: {json.dumps(event, ensure_ascii=False)}")
+    
+    s3_client = boto3.client('s3')
+    
+    s3_bucket = os.environ['S3_BUCKET']
+    output_prefix = os.environ.get('INDEX_ADVISOR_PREFIX', 'index-recommendations/')
+    
+    try:
+        print(f"データベース接続中: {describe_target()}")
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        
+        print("=== クエリ形状の収集 ===")
+        shapes = load_query_shapes(cursor)
+        
+        print("=== カタログ情報の取得 ===")
+        tables = load_table_catalog(cursor)
+        print(f"対象テーブル: {len(tables)}個")
+        
+        cursor.close()
+        conn.close()
+        
+        print("=== 推奨インデックスの算出 ===")
+        recommendations = build_recommendations(shapes, tables)
+        for rec in recommendations:
+            print(f"  - {rec['table_name']}({', '.join(rec['columns'])}): スコア {rec['score_ms']:.0f}ms")
+        
+        if not recommendations:
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': '推奨インデックスはありません',
+                    'analyzed_shapes': len(shapes)
+                }, ensure_ascii=False)
+            }
+        
+        generated_at = datetime.now()
+        output_key = f"{output_prefix}{generated_at.strftime('%Y%m%d_%H%M%S')}_index_recommendations.sql"
+        s3_client.put_object(
+            Bucket=s3_bucket,
+            Key=output_key,
+            Body=render_sql_file(recommendations, generated_at).encode('utf-8'),
+            ContentType='application/sql'
+        )
+        print(f"推奨インデックスを出力: s3://{s3_bucket}/{output_key}")
+        
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': f'推奨インデックス {len(recommendations)}件を出力しました',
+                'analyzed_shapes': len(shapes),
+                'recommendations': recommendations,
+                'output_location': f"s3://{s3_bucket}/{output_key}"
+            }, ensure_ascii=False)
+        }
+    
+    except Exception as e:
+        print(f"インデックス分析エラー: {str(e)}")
+        print(f"詳細エラー: {traceback.format_exc()}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({
+                'error': f'インデックス分析エラー: {str(e)}'
+            }, ensure_ascii=False)
+        }
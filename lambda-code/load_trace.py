@@ -0,0 +1,162 @@
+import csv
+import json
+import math
+import os
+import uuid
+from datetime import datetime, timezone
+
+# ロードを手元で再現するためのトレース（S3イベント・オブジェクトのメタデータ・テーブル定義・設定値・結果と、入力から抽出した行）
+# csv_processorはロードオプション trace が有効なロードの終了時に出力し、scripts/replay-load-trace.py が
+# ローカルのPostgreSQLで同じ設定のままプロファイラ付きで再実行する。
+
+TRACE_PREFIX = os.environ.get('TRACE_PREFIX', 'load-traces/')
+TRACE_SAMPLE_ROWS = int(os.environ.get('TRACE_SAMPLE_ROWS', '10000'))
+TRACE_VERSION = 1
+TRACE_MANIFEST_FILE = 'manifest.json'
+TRACE_SAMPLE_FILE = 'sample.csv'
+
+# 再現時に同じ値を設定する環境変数（バッチの行数・並列数など、ロードの進め方に影響するもの）
+TRACE_ENV_SETTINGS = (
+    'AWS_LAMBDA_FUNCTION_MEMORY_SIZE', 'COMMIT_BATCH_SIZE', 'BATCH_SIZE_MIN', 'BATCH_SIZE_MAX', 'BATCH_TARGET_MS',
+    'LOAD_TIME_RESERVE_MS', 'DEDUP_MEMORY_ROWS', 'DEDUP_SPILL_PARTITIONS', 'LOAD_MAX_WRITERS',
+    'INDEX_REBUILD_WORKERS', 'INDEX_REBUILD_MAINTENANCE_WORK_MEM', 'COLUMN_STATS_SAMPLE_EVERY'
+)
+
+def snapshot_table_schema(cursor, table_name):
+    """対象テーブルの定義（カラム・制約・インデックス・パーティションキー）と大きさを取得する"""
+    relation = f'public."{table_name}"'
+    cursor.execute("""
+        SELECT a.attname AS name, format_type(a.atttypid, a.atttypmod) AS type, a.attnotnull AS not_null,
+               pg_get_expr(d.adbin, d.adrelid) AS default_expr, a.attidentity AS identity, a.attgenerated AS generated
+        FROM pg_attribute a
+        LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+        WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY a.attnum
+    """, (relation,))
+    columns = [dict(row) for row in cursor.fetchall()]
+    
+    cursor.execute("""
+        SELECT conname AS name, contype AS type, pg_get_constraintdef(oid) AS definition
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass
+        ORDER BY contype, conname
+    """, (relation,))
+    constraints = [dict(row) for row in cursor.fetchall()]
+    
+    # 制約に紐づくインデックスは制約から作られるため除く
+    cursor.execute("""
+        SELECT pg_get_indexdef(i.indexrelid) AS definition
+        FROM pg_index i
+        WHERE i.indrelid = %s::regclass
+        AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+        ORDER BY i.indexrelid
+    """, (relation,))
+    indexes = [row['definition'] for row in cursor.fetchall()]
+    
+    cursor.execute("""
+        SELECT pg_get_partkeydef(c.oid) AS partition_key, c.reltuples::bigint AS estimated_rows,
+               pg_total_relation_size(c.oid) AS total_bytes
+        FROM pg_class c
+        WHERE c.oid = %s::regclass
+    """, (relation,))
+    table = cursor.fetchone()
+    
+    return {
+        'columns': columns,
+        'constraints': constraints,
+        'indexes': indexes,
+        'partition_key': table['partition_key'],
+        'estimated_rows': table['estimated_rows'],
+        'total_bytes': table['total_bytes']
+    }
+
+def render_column(column):
+    """カラム定義の1行（シーケンスのデフォルト値はIDENTITYに置き換え、再現先にシーケンスがなくても作れるようにする）"""
+    parts = [f'"{column["name"]}"', column['type']]
+    default_expr = column['default_expr']
+    if column['generated'] == 's':
+        parts.append(f"GENERATED ALWAYS AS ({default_expr}) STORED")
+    elif column['identity'] == 'a':
+        parts.append("GENERATED ALWAYS AS IDENTITY")
+    elif column['identity'] == 'd' or (default_expr or '').startswith('nextval('):
+        parts.append("GENERATED BY DEFAULT AS IDENTITY")
+    elif default_expr:
+        parts.append(f"DEFAULT {default_expr}")
+    if column['not_null']:
+        parts.append("NOT NULL")
+    return ' '.join(parts)
+
+def render_table_ddl(table_name, schema):
+    """トレースのテーブル定義からCREATE TABLE・CREATE INDEXの文を作り、(文の一覧, 作らない制約の一覧)を返す
+    
+    外部キーは参照先のテーブルが再現先にあるとは限らないため作らない。
+    """
+    definitions = [render_column(column) for column in schema['columns']]
+    skipped = []
+    for constraint in schema['constraints']:
+        if constraint['type'] == 'f':
+            skipped.append(f"{constraint['name']}: {constraint['definition']}")
+        elif constraint['type'] in ('p', 'u', 'c', 'x'):
+            definitions.append(f'CONSTRAINT "{constraint["name"]}" {constraint["definition"]}')
+    
+    body = ',\n    '.join(definitions)
+    statement = f'CREATE TABLE "{table_name}" (\n    {body}\n)'
+    if schema['partition_key']:
+        statement += f" PARTITION BY {schema['partition_key']}"
+    return [statement] + schema['indexes'], skipped
+
+def sample_csv_records(lines, total_rows, sample_rows):
+    """ヘッダーと、データ行からファイル全体に均等な間隔で抽出した最大sample_rows件のレコードを、元のテキストのまま返す
+    
+    値の中の改行を含むレコードも分けないよう、csv.readerが1レコードを返すまでに読んだ行をまとめて1レコードとする。
+    total_rowsが分からない場合は先頭から抽出する。
+    """
+    stride = max(1, math.ceil(total_rows / sample_rows)) if total_rows else 1
+    pending = []
+    
+    def read_lines():
+        for line in lines:
+            pending.append(line)
+            yield line
+    
+    records = []
+    sampled = 0
+    for index, _ in enumerate(csv.reader(read_lines())):
+        record = ''.join(pending)
+        pending.clear()
+        if index == 0 or (index - 1) % stride == 0:
+            records.append(record if record.endswith('\n') else record + '\n')
+            sampled += 0 if index == 0 else 1
+            if sampled >= sample_rows:
+                break
+    
+    return ''.join(records), {'file': TRACE_SAMPLE_FILE, 'rows': sampled, 'stride': stride, 'total_rows': total_rows}
+
+def build_trace_manifest(event, source, table_name, load_options, schema, status_code, response_body, elapsed_ms, sample):
+    """トレースの内容（再現に必要な設定と、本番での結果・所要時間）"""
+    return {
+        'version': TRACE_VERSION,
+        'captured_at': datetime.now(timezone.utc).isoformat(),
+        'event': event,
+        'source': {'uri': source.uri, 'key': source.key, 'etag': source.etag, 'metadata': source.metadata},
+        'table_name': table_name,
+        'load_options': load_options,
+        'load_config': json.loads(os.environ.get('LOAD_CONFIG') or '{}'),
+        'settings': {name: os.environ[name] for name in TRACE_ENV_SETTINGS if name in os.environ},
+        'schema': schema,
+        'result': {'status_code': status_code, 'body': response_body},
+        'elapsed_ms': elapsed_ms,
+        'sample': sample
+    }
+
+def write_trace_bundle(source, table_name, manifest, sample_text):
+    """トレースを <TRACE_PREFIX><テーブル名>/<日時>-<ID>/ に出力し、出力先を返す"""
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    prefix = f"{TRACE_PREFIX}{table_name}/{stamp}-{uuid.uuid4().hex[:8]}/"
+    source.put_text(prefix + TRACE_SAMPLE_FILE, sample_text, 'text/csv')
+    location = source.put_text(
+        prefix + TRACE_MANIFEST_FILE,
+        json.dumps(manifest, ensure_ascii=False, indent=2, default=str),
+        'application/json'
+    )
+    return location[:-len(TRACE_MANIFEST_FILE)]
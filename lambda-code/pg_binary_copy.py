@@ -0,0 +1,308 @@
+import re
+import struct
+import uuid
+from functools import lru_cache
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python 3.8以前
+    ZoneInfo = None
+
+# COPY ... WITH (FORMAT binary) 用のバイナリ形式のエンコーダー
+# CSVの文字列をPythonで検証して型ごとのバイナリ表現に変換し、サーバー側の文字列の解析を省く。
+# Pythonで確実に解釈できない値（独自の日付書式・範囲外の値など）はValueErrorとし、
+# 呼び出し側でその行だけ文字列のまま挿入してPostgreSQLに判定させる。
+
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+COPY_TRAILER = struct.pack('>h', -1)
+NULL_FIELD = struct.pack('>i', -1)
+
+PG_EPOCH_DATE = date(2000, 1, 1)
+PG_EPOCH_NAIVE = datetime(2000, 1, 1)
+PG_EPOCH_UTC = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+INTEGER_TEXT_PATTERN = re.compile(r'\s*[-+]?[0-9]+\s*')
+NUMERIC_TEXT_PATTERN = re.compile(r'\s*[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?\s*')
+DATE_TEXT_PATTERN = re.compile(r'\s*([0-9]{4})[-/]([0-9]{1,2})[-/]([0-9]{1,2})\s*')
+TIMESTAMP_TEXT_PATTERN = re.compile(
+    r'\s*([0-9]{4})[-/]([0-9]{1,2})[-/]([0-9]{1,2})'
+    r'(?:[T ]([0-9]{1,2}):([0-9]{2})(?::([0-9]{2})(?:\.([0-9]{1,6}))?)?)?'
+    r'\s*(Z|[+-][0-9]{2}(?::?[0-9]{2})?)?\s*'
+)
+
+BOOLEAN_TRUE = ('true', 'yes')
+BOOLEAN_FALSE = ('false', 'no')
+
+INTEGER_FORMATS = {
+    'smallint': struct.Struct('>ih'),
+    'integer': struct.Struct('>ii'),
+    'bigint': struct.Struct('>iq'),
+}
+INTEGER_RANGES = {
+    'smallint': 2 ** 15,
+    'integer': 2 ** 31,
+    'bigint': 2 ** 63,
+}
+FLOAT_FORMATS = {
+    'real': struct.Struct('>if'),
+    'double precision': struct.Struct('>id'),
+}
+DATE_FORMAT = struct.Struct('>ii')
+TIMESTAMP_FORMAT = struct.Struct('>iq')
+NUMERIC_HEADER = struct.Struct('>ihhhh')
+NUMERIC_POSITIVE = 0x0000
+NUMERIC_NEGATIVE = 0x4000
+NUMERIC_NAN = 0xC000
+NUMERIC_MAX_EXPONENT = 1000  # 指数表記の桁数の上限（超える値はサーバーで判定させる）
+VALUE_CACHE_SIZE = 4096  # 日付・数値など同じ値が繰り返し現れる型の変換結果を保持する件数
+LENGTH_PREFIX = struct.Struct('>i')
+
+def make_text_encoder(max_length):
+    """文字列（長さ+UTF-8）。文字数の上限を超える値・NUL文字を含む値はサーバーで判定させる"""
+    max_length = max_length or float('inf')
+    pack_length = LENGTH_PREFIX.pack
+    
+    def encode(value):
+        if len(value) > max_length or '\x00' in value:
+            raise ValueError("文字数の上限を超えているか、NUL文字を含んでいます")
+        data = value.encode('utf-8')
+        return pack_length(len(data)) + data
+    return encode
+
+def make_integer_encoder(data_type):
+    """整数（smallint / integer / bigint）"""
+    packer = INTEGER_FORMATS[data_type]
+    limit = INTEGER_RANGES[data_type]
+    size = packer.size - 4
+    
+    def encode(value):
+        # 行番号などPython側で作った整数はそのまま使う
+        if isinstance(value, int):
+            number = value
+        elif INTEGER_TEXT_PATTERN.fullmatch(value):
+            number = int(value)
+        else:
+            raise ValueError(f"整数として解釈できません: {value}")
+        if not -limit <= number < limit:
+            raise ValueError(f"{data_type}の範囲外です: {value}")
+        return packer.pack(size, number)
+    return encode
+
+def make_float_encoder(data_type):
+    """浮動小数点数（real / double precision）"""
+    packer = FLOAT_FORMATS[data_type]
+    size = packer.size - 4
+    
+    def encode(value):
+        if not NUMERIC_TEXT_PATTERN.fullmatch(value):
+            raise ValueError(f"数値として解釈できません: {value}")
+        return packer.pack(size, float(value))
+    return encode
+
+@lru_cache(maxsize=VALUE_CACHE_SIZE)
+def encode_numeric(value):
+    """NUMERIC（基数10000の桁の並び。精度・位取りの丸めはサーバー側で列の定義に合わせて行われる）"""
+    if value.strip().lower() == 'nan':
+        return NUMERIC_HEADER.pack(8, 0, 0, NUMERIC_NAN, 0)
+    if not NUMERIC_TEXT_PATTERN.fullmatch(value):
+        raise ValueError(f"数値として解釈できません: {value}")
+    
+    sign, digit_tuple, exponent = Decimal(value.strip()).as_tuple()
+    if abs(exponent) > NUMERIC_MAX_EXPONENT:
+        raise ValueError(f"桁数が大きすぎます: {value}")
+    digits = ''.join(map(str, digit_tuple))
+    if exponent > 0:
+        digits += '0' * exponent
+        exponent = 0
+    dscale = -exponent
+    if len(digits) <= dscale:
+        digits = '0' * (dscale - len(digits) + 1) + digits
+    
+    # 整数部は左、小数部は右を0で埋めて4桁ずつに区切る
+    int_part = digits[:len(digits) - dscale]
+    frac_part = digits[len(digits) - dscale:]
+    int_part = '0' * (-len(int_part) % 4) + int_part
+    frac_part = frac_part + '0' * (-len(frac_part) % 4)
+    groups = [int(int_part[i:i + 4]) for i in range(0, len(int_part), 4)]
+    weight = len(groups) - 1
+    groups += [int(frac_part[i:i + 4]) for i in range(0, len(frac_part), 4)]
+    
+    # 先頭と末尾の0の桁は省く（先頭を省いた分だけweightを下げる）
+    start = 0
+    while start < len(groups) and groups[start] == 0:
+        start += 1
+    end = len(groups)
+    while end > start and groups[end - 1] == 0:
+        end -= 1
+    groups = groups[start:end]
+    weight = weight - start if groups else 0
+    
+    return NUMERIC_HEADER.pack(
+        8 + 2 * len(groups), len(groups), weight, NUMERIC_NEGATIVE if sign and groups else NUMERIC_POSITIVE, dscale
+    ) + struct.pack(f'>{len(groups)}h', *groups)
+
+@lru_cache(maxsize=VALUE_CACHE_SIZE)
+def encode_boolean(value):
+    """真偽値（PostgreSQLと同じく true/yes/on/1 と false/no/off/0、前方一致・大文字小文字を区別しない）"""
+    text = value.strip().lower()
+    if text in ('1', 'on') or (text and any(word.startswith(text) for word in BOOLEAN_TRUE)):
+        return b'\x00\x00\x00\x01\x01'
+    if text in ('0', 'off', 'of') or (text and any(word.startswith(text) for word in BOOLEAN_FALSE)):
+        return b'\x00\x00\x00\x01\x00'
+    raise ValueError(f"真偽値として解釈できません: {value}")
+
+def encode_uuid(value):
+    """UUID（16バイト）"""
+    return b'\x00\x00\x00\x10' + uuid.UUID(value.strip()).bytes
+
+@lru_cache(maxsize=VALUE_CACHE_SIZE)
+def encode_date(value):
+    """DATE（2000-01-01からの日数。YYYY-MM-DD / YYYY/MM/DD のみ）"""
+    match = DATE_TEXT_PATTERN.fullmatch(value)
+    if not match:
+        raise ValueError(f"日付として解釈できません: {value}")
+    day = date(*map(int, match.groups()))
+    return DATE_FORMAT.pack(4, (day - PG_EPOCH_DATE).days)
+
+def parse_timestamp(value):
+    """ISO 8601形式の日時を解釈し、(時刻, タイムゾーン)を返す（タイムゾーンの指定がなければNone）"""
+    match = TIMESTAMP_TEXT_PATTERN.fullmatch(value)
+    if not match:
+        raise ValueError(f"日時として解釈できません: {value}")
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    moment = datetime(
+        int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+        int((fraction or '').ljust(6, '0'))
+    )
+    if zone is None:
+        return moment, None
+    if zone == 'Z':
+        return moment, timezone.utc
+    offset = zone[1:].replace(':', '')
+    delta = timedelta(hours=int(offset[:2]), minutes=int(offset[2:] or 0))
+    return moment, timezone(-delta if zone[0] == '-' else delta)
+
+def microseconds(delta):
+    """timedeltaをマイクロ秒の整数に変換"""
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+@lru_cache(maxsize=VALUE_CACHE_SIZE)
+def encode_timestamp(value):
+    """TIMESTAMP（2000-01-01 00:00:00からのマイクロ秒。タイムゾーンの指定はPostgreSQLと同じく無視する）"""
+    moment, _ = parse_timestamp(value)
+    return TIMESTAMP_FORMAT.pack(8, microseconds(moment - PG_EPOCH_NAIVE))
+
+def make_timestamptz_encoder(session_tz):
+    """TIMESTAMP WITH TIME ZONE（UTCの2000-01-01 00:00:00からのマイクロ秒）
+    
+    タイムゾーンの指定がない値はセッションのTimeZoneの時刻として扱う。
+    夏時間の切り替わりで存在しない・重複する時刻はサーバーに判定させる。
+    """
+    @lru_cache(maxsize=VALUE_CACHE_SIZE)
+    def encode(value):
+        moment, zone = parse_timestamp(value)
+        if zone is None:
+            earlier = moment.replace(tzinfo=session_tz, fold=0)
+            later = moment.replace(tzinfo=session_tz, fold=1)
+            if earlier.utcoffset() != later.utcoffset():
+                raise ValueError(f"セッションのタイムゾーンで一意に決まらない時刻です: {value}")
+            moment = earlier
+        else:
+            moment = moment.replace(tzinfo=zone)
+        return TIMESTAMP_FORMAT.pack(8, microseconds(moment - PG_EPOCH_UTC))
+    return encode
+
+def get_session_timezone(cursor):
+    """セッションのTimeZoneをtzinfoで返す（Pythonで扱えない場合はNone）"""
+    cursor.execute("SHOW TimeZone")
+    row = cursor.fetchone()
+    name = row['TimeZone'] if isinstance(row, dict) else row[0]
+    if name.upper() in ('UTC', 'ETC/UTC', 'GMT', 'Z'):
+        return timezone.utc
+    if ZoneInfo is None:
+        return None
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        return None
+
+def make_value_encoder(column, session_tz):
+    """information_schema.columnsの1カラムの値のエンコーダー（バイナリ形式に対応しない型はNone）"""
+    data_type = column['data_type']
+    if data_type in ('text', 'character varying', 'character'):
+        return make_text_encoder(column.get('character_maximum_length'))
+    if data_type in INTEGER_FORMATS:
+        return make_integer_encoder(data_type)
+    if data_type in FLOAT_FORMATS:
+        return make_float_encoder(data_type)
+    if data_type == 'numeric':
+        return encode_numeric
+    if data_type == 'boolean':
+        return encode_boolean
+    if data_type == 'uuid':
+        return encode_uuid
+    if data_type == 'date':
+        return encode_date
+    if data_type == 'timestamp without time zone':
+        return encode_timestamp
+    if data_type == 'timestamp with time zone' and session_tz is not None:
+        return make_timestamptz_encoder(session_tz)
+    return None
+
+def make_row_encoder(columns, session_tz):
+    """行（値のタプル）を1タプル分のバイナリに変換する関数を返す（対応しない型のカラムがあればNone）
+    
+    空欄（''）とNoneはNULLとして書き込む（CSV形式のCOPYで引用符なしの空欄をNULLとするのと同じ）。
+    """
+    encoders = [make_value_encoder(column, session_tz) for column in columns]
+    if any(encoder is None for encoder in encoders):
+        return None
+    field_count = struct.pack('>h', len(encoders))
+    
+    def encode_row(values):
+        return field_count + b''.join([
+            NULL_FIELD if value is None or value == '' else encoder(value)
+            for encoder, value in zip(encoders, values)
+        ])
+    return encode_row
+
+def unsupported_columns(columns, session_tz):
+    """バイナリ形式に対応しない型のカラム名（ログ出力用）"""
+    return [column['column_name'] for column in columns if make_value_encoder(column, session_tz) is None]
+
+class BinaryCopyStream:
+    """copy_expertに渡す読み込み用のストリーム（読まれた分だけ行をエンコードし、全体をメモリに展開しない）
+    
+    rowsは(元の項目, 値のタプル)の並び。エンコードできなかった行の元の項目はrejectedに集める。
+    """
+    
+    def __init__(self, rows, encode_row):
+        self.rows = iter(rows)
+        self.encode_row = encode_row
+        self.buffer = bytearray(COPY_SIGNATURE)
+        self.finished = False
+        self.rejected = []
+        self.encoded_rows = 0
+    
+    def read(self, size=-1):
+        size = size if size and size > 0 else 65536
+        while len(self.buffer) < size and not self.finished:
+            item = next(self.rows, None)
+            if item is None:
+                self.buffer += COPY_TRAILER
+                self.finished = True
+                break
+            
+            source, values = item
+            try:
+                self.buffer += self.encode_row(values)
+            except (ValueError, OverflowError) as e:
+                self.rejected.append((source, str(e)))
+                continue
+            self.encoded_rows += 1
+        
+        chunk = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return chunk
@@ -5,7 +5,461 @@ import psycopg2.extras
 import csv
 import io
 import os
+import time
+import uuid
 from datetime import datetime
+from db_connection import get_db_connection, get_read_connection, get_replica_connection, is_primary_required
+from query_stats import record_read_query_stats
+
+# ストリーミング出力の設定
+EXPORT_FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE', '5000'))
+EXPORT_PART_SIZE = 8 * 1024 * 1024  # S3マルチパートの1パートサイズ（最小5MB）
+JOB_PROGRESS_INTERVAL_SEC = int(os.environ.get('JOB_PROGRESS_INTERVAL_SEC', '5'))
+# 開始からこの秒数を過ぎても終了していないジョブは、Lambdaのタイムアウト（最大900秒）で終了を記録できなかったものとみなす
+JOB_STALE_AFTER_SEC = int(os.environ.get('JOB_STALE_AFTER_SEC', '960'))
+SUPPORTED_FORMATS = ['csv', 'json']
+
+class JobCancelled(Exception):
+    """実行開始前にキャンセルされたジョブ"""
+
+class S3StreamWriter:
+    """S3へのストリーミング書き込み（一定サイズごとにマルチパートアップロード）"""
+    
+    def __init__(self, s3_client, bucket, key, content_type):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.bytes_written = 0
+    
+    def write(self, data):
+        self.buffer.extend(data)
+        self.bytes_written += len(data)
+        if len(self.buffer) >= EXPORT_PART_SIZE:
+            self._upload_part()
+    
+    def _upload_part(self):
+        if self.upload_id is None:
+            response = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                ContentType=self.content_type
+            )
+            self.upload_id = response['UploadId']
+        
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=bytes(self.buffer)
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.buffer = bytearray()
+    
+    def close(self):
+        # 1パートに満たない小さな出力は通常のPUTで済ませる
+        if self.upload_id is None:
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=self.key,
+                Body=bytes(self.buffer),
+                ContentType=self.content_type
+            )
+            return
+        
+        if self.buffer:
+            self._upload_part()
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts}
+        )
+    
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id
+            )
+            self.upload_id = None
+
+def to_json_value(value):
+    """datetime等の特殊型をJSON出力用に変換"""
+    if value is not None and hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+def stream_query_to_s3(conn, s3_client, sql_query, output_format, s3_bucket, output_key, progress_callback=None):
+    """SELECT結果をサーバーサイドカーソルで少しずつ取得し、S3へストリーミング出力する
+    
+    名前付きカーソルはトランザクション内でのみ有効なため、connは自動コミットにしないこと
+    （プロキシ経由でも1トランザクションの間は同じサーバー接続が使われる）。
+    """
+    cursor = conn.cursor(name=f"export_{uuid.uuid4().hex[:12]}")
+    cursor.itersize = EXPORT_FETCH_SIZE
+    content_type = 'text/csv' if output_format == 'csv' else 'application/json'
+    writer = S3StreamWriter(s3_client, s3_bucket, output_key, content_type)
+    rows_count = 0
+    
+    try:
+        cursor.execute(sql_query)
+        rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+        column_names = [desc[0] for desc in cursor.description] if cursor.description else []
+        
+        buffer = io.StringIO()
+        if output_format == 'csv':
+            csv_writer = csv.writer(buffer)
+            csv_writer.writerow(column_names)
+        else:
+            buffer.write('{"query": %s, "execution_time": %s, "columns": %s, "data": [\n' % (
+                json.dumps(sql_query, ensure_ascii=False),
+                json.dumps(datetime.now().isoformat()),
+                json.dumps(column_names, ensure_ascii=False)
+            ))
+        
+        while rows:
+            for row in rows:
+                if output_format == 'csv':
+                    csv_writer.writerow([
+                        str(value) if value is not None else ''
+                        for value in row
+                    ])
+                else:
+                    if rows_count:
+                        buffer.write(',\n')
+                    buffer.write(json.dumps(
+                        dict(zip(column_names, [to_json_value(value) for value in row])),
+                        ensure_ascii=False, default=str
+                    ))
+                rows_count += 1
+            
+            writer.write(buffer.getvalue().encode('utf-8'))
+            buffer.seek(0)
+            buffer.truncate()
+            
+            if progress_callback:
+                progress_callback(rows_count, writer.bytes_written)
+            
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+        
+        if output_format == 'json':
+            buffer.write('\n], "rows_count": %d}' % rows_count)
+            writer.write(buffer.getvalue().encode('utf-8'))
+        
+        # 結果0行の場合はS3出力をスキップ
+        if rows_count == 0:
+            writer.abort()
+        else:
+            writer.close()
+        
+    except Exception:
+        writer.abort()
+        raise
+    
+    finally:
+        cursor.close()
+    
+    return rows_count, column_names, writer.bytes_written
+
+def submit_job(event, context):
+    """クエリをジョブとして登録し、自分自身を非同期起動してバックグラウンド実行する"""
+    sql_query = event.get('sql', '').strip()
+    output_format = event.get('output_format', 'csv').lower()
+    output_name = event.get('output_name', f'job_result_{datetime.now().strftime("%Y%m%d_%H%M%S")}')
+    
+    if not sql_query.upper().startswith('SELECT'):
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': 'ジョブとして実行できるのはSELECTクエリのみです'
+            }, ensure_ascii=False)
+        }
+    
+    if output_format not in SUPPORTED_FORMATS:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': f'サポートされていない出力形式: {output_format}',
+                'supported_formats': SUPPORTED_FORMATS
+            }, ensure_ascii=False)
+        }
+    
+    job_id = str(uuid.uuid4())
+    
+    conn = get_db_connection()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO query_jobs (job_id, status, sql_query, output_format, output_name)
+        VALUES (%s, 'QUEUED', %s, %s, %s)
+    """, (job_id, sql_query, output_format, output_name))
+    cursor.close()
+    conn.close()
+    
+    print(f"ジョブ登録: {job_id}")
+    
+    lambda_client = boto3.client('lambda')
+    lambda_client.invoke(
+        FunctionName=context.function_name,
+        InvocationType='Event',
+        Payload=json.dumps({
+            'action': 'run_job',
+            'job_id': job_id,
+            'consistency': event.get('consistency', 'replica')
+        }).encode('utf-8')
+    )
+    
+    return {
+        'statusCode': 202,
+        'body': json.dumps({
+            'message': 'ジョブを受け付けました',
+            'job_id': job_id,
+            'status': 'QUEUED'
+        }, ensure_ascii=False)
+    }
+
+def run_job(job_id, s3_client, s3_bucket, output_prefix, require_primary=False):
+    """登録済みジョブを実行し、進捗をquery_jobsテーブルに記録する（クエリはレプリカがあればレプリカで実行）"""
+    print(f"=== ジョブ実行開始: {job_id} ===")
+    
+    # 進捗更新用の接続（自動コミットで即時に他セッションから見える）
+    status_conn = get_db_connection()
+    status_conn.autocommit = True
+    status_cursor = status_conn.cursor()
+    
+    status_cursor.execute("""
+        UPDATE query_jobs
+        SET status = 'RUNNING', started_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE job_id = %s AND status = 'QUEUED'
+        RETURNING sql_query, output_format, output_name
+    """, (job_id,))
+    job = status_cursor.fetchone()
+    
+    if not job:
+        print(f"ジョブ {job_id} は実行待ちではないためスキップします")
+        status_cursor.close()
+        status_conn.close()
+        return {
+            'statusCode': 409,
+            'body': json.dumps({'error': 'ジョブが実行待ち状態ではありません', 'job_id': job_id}, ensure_ascii=False)
+        }
+    
+    sql_query, output_format, output_name = job
+    extension = 'csv' if output_format == 'csv' else 'json'
+    output_key = f"{output_prefix}jobs/{output_name}_{job_id}.{extension}"
+    
+    conn, read_target = get_read_connection(require_primary)
+    print(f"実行先: {read_target['endpoint']} ({read_target['role']})")
+    last_progress = [time.monotonic()]
+    
+    def report_progress(rows_written, bytes_written):
+        now = time.monotonic()
+        if now - last_progress[0] >= JOB_PROGRESS_INTERVAL_SEC:
+            last_progress[0] = now
+            status_cursor.execute("""
+                UPDATE query_jobs
+                SET rows_written = %s, bytes_written = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = %s
+                RETURNING status
+            """, (rows_written, bytes_written, job_id))
+            # FETCHの合間はバックエンドが待機中でpg_cancel_backendが効かないため、ここでもキャンセルを確認する
+            if status_cursor.fetchone()[0] == 'CANCELLING':
+                raise JobCancelled('エクスポート中にキャンセルされました')
+    
+    try:
+        # キャンセル用にクエリを実行するバックエンドのPIDと接続先（レプリカの場合）を記録
+        # （エクスポートと同じトランザクション内で取得するため、プロキシ経由でも同じバックエンドを指す）
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_backend_pid()")
+        backend_pid = cursor.fetchone()[0]
+        cursor.close()
+        backend_endpoint = read_target['endpoint'] if read_target['role'] == 'replica' else None
+        status_cursor.execute("""
+            UPDATE query_jobs SET backend_pid = %s, backend_endpoint = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = %s RETURNING status
+        """, (backend_pid, backend_endpoint, job_id))
+        if status_cursor.fetchone()[0] == 'CANCELLING':
+            raise JobCancelled('PID記録前にキャンセルされました')
+        
+        export_start = time.monotonic()
+        rows_count, column_names, bytes_written = stream_query_to_s3(
+            conn, s3_client, sql_query, output_format, s3_bucket, output_key, report_progress
+        )
+        conn.rollback()
+        record_read_query_stats(conn, read_target, 'export', sql_query, int((time.monotonic() - export_start) * 1000), rows_count)
+        
+        output_location = f"s3://{s3_bucket}/{output_key}" if rows_count else None
+        status_cursor.execute("""
+            UPDATE query_jobs
+            SET status = 'SUCCEEDED', rows_written = %s, bytes_written = %s, output_location = %s,
+                backend_pid = NULL, finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = %s AND status = 'RUNNING'
+            RETURNING status
+        """, (rows_count, bytes_written, output_location, job_id))
+        final_status = 'SUCCEEDED' if status_cursor.fetchone() else None
+        
+        # 完了の直前にキャンセルされた場合はキャンセルを優先する（出力したファイルは残る）
+        if final_status is None:
+            status_cursor.execute("""
+                UPDATE query_jobs
+                SET status = CASE WHEN status = 'CANCELLING' THEN 'CANCELLED' ELSE status END,
+                    backend_pid = NULL, finished_at = COALESCE(finished_at, CURRENT_TIMESTAMP), updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = %s
+                RETURNING status
+            """, (job_id,))
+            final_status = status_cursor.fetchone()[0]
+        
+        print(f"ジョブ完了（{final_status}）: {rows_count}行, {bytes_written} bytes -> {output_location}")
+        result = {
+            'job_id': job_id,
+            'status': final_status,
+            'rows_written': rows_count,
+            'output_location': output_location,
+            'read_target': read_target['role']
+        }
+        
+    except Exception as e:
+        # pg_cancel_backendによる中断は query_canceled（57014）として返る
+        status_cursor.execute("SELECT status FROM query_jobs WHERE job_id = %s", (job_id,))
+        cancel_requested = status_cursor.fetchone()[0] == 'CANCELLING'
+        cancelled = cancel_requested and (isinstance(e, JobCancelled) or getattr(e, 'pgcode', None) == '57014')
+        final_status = 'CANCELLED' if cancelled else 'FAILED'
+        
+        status_cursor.execute("""
+            UPDATE query_jobs
+            SET status = %s, error_message = %s, backend_pid = NULL,
+                finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = %s AND status IN ('RUNNING', 'CANCELLING')
+        """, (final_status, None if cancelled else str(e), job_id))
+        
+        print(f"ジョブ終了（{final_status}）: {e}")
+        result = {'job_id': job_id, 'status': final_status, 'error': str(e)}
+        
+    finally:
+        conn.close()
+        status_cursor.close()
+        status_conn.close()
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps(result, ensure_ascii=False)
+    }
+
+def expire_stale_job(cursor, job_id):
+    """Lambdaのタイムアウトなどで終了を記録できなかったジョブを終了扱いにする（キャンセル中ならCANCELLED、それ以外はFAILED）"""
+    cursor.execute("""
+        UPDATE query_jobs
+        SET status = CASE WHEN status = 'CANCELLING' THEN 'CANCELLED' ELSE 'FAILED' END,
+            error_message = CASE WHEN status = 'CANCELLING' THEN NULL ELSE %s END,
+            backend_pid = NULL, finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE job_id = %s AND status IN ('RUNNING', 'CANCELLING')
+        AND started_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+    """, (f'{JOB_STALE_AFTER_SEC}秒以内に終了が記録されませんでした（Lambdaのタイムアウトなど）', job_id, JOB_STALE_AFTER_SEC))
+
+def get_job_status(job_id):
+    """ジョブの状態と進捗（出力行数・バイト数・経過時間）を返す"""
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    expire_stale_job(cursor, job_id)
+    conn.commit()
+    cursor.execute("""
+        SELECT job_id, status, output_format, output_location, rows_written, bytes_written,
+               error_message, submitted_at, started_at, finished_at,
+               CAST(EXTRACT(EPOCH FROM (COALESCE(finished_at, CURRENT_TIMESTAMP) - started_at)) * 1000 AS BIGINT) AS elapsed_ms
+        FROM query_jobs
+        WHERE job_id = %s
+    """, (job_id,))
+    job = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    
+    if not job:
+        return {
+            'statusCode': 404,
+            'body': json.dumps({'error': f'ジョブ {job_id} が見つかりません'}, ensure_ascii=False)
+        }
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps({key: to_json_value(value) for key, value in job.items()}, ensure_ascii=False, default=str)
+    }
+
+def cancel_backend(cursor, backend_pid, backend_endpoint):
+    """実行中のクエリをpg_cancel_backendで中断する（レプリカで実行中ならそのレプリカに接続して中断）"""
+    if not backend_endpoint:
+        cursor.execute("SELECT pg_cancel_backend(%s)", (backend_pid,))
+        print(f"pg_cancel_backend({backend_pid}): {cursor.fetchone()[0]}")
+        return
+    
+    replica_conn = get_replica_connection(backend_endpoint)
+    try:
+        replica_cursor = replica_conn.cursor()
+        replica_cursor.execute("SELECT pg_cancel_backend(%s)", (backend_pid,))
+        print(f"pg_cancel_backend({backend_pid}) on {backend_endpoint}: {replica_cursor.fetchone()[0]}")
+        replica_cursor.close()
+    finally:
+        replica_conn.close()
+
+def cancel_job(job_id):
+    """ジョブをキャンセルする（実行中ならpg_cancel_backendでクエリを中断）"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    expire_stale_job(cursor, job_id)
+    cursor.execute("SELECT status, backend_pid, backend_endpoint FROM query_jobs WHERE job_id = %s FOR UPDATE", (job_id,))
+    job = cursor.fetchone()
+    
+    if not job:
+        conn.rollback()
+        conn.close()
+        return {
+            'statusCode': 404,
+            'body': json.dumps({'error': f'ジョブ {job_id} が見つかりません'}, ensure_ascii=False)
+        }
+    
+    status, backend_pid, backend_endpoint = job
+    
+    if status == 'QUEUED':
+        new_status = 'CANCELLED'
+        cursor.execute("""
+            UPDATE query_jobs
+            SET status = 'CANCELLED', finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = %s
+        """, (job_id,))
+    elif status == 'RUNNING':
+        new_status = 'CANCELLING'
+        cursor.execute(
+            "UPDATE query_jobs SET status = 'CANCELLING', updated_at = CURRENT_TIMESTAMP WHERE job_id = %s",
+            (job_id,)
+        )
+        conn.commit()
+        if backend_pid:
+            cancel_backend(cursor, backend_pid, backend_endpoint)
+    else:
+        conn.rollback()
+        conn.close()
+        return {
+            'statusCode': 409,
+            'body': json.dumps({
+                'error': f'ジョブはすでに終了しています（{status}）',
+                'job_id': job_id
+            }, ensure_ascii=False)
+        }
+    
+    conn.commit()
+    cursor.close()
+    conn.close()
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'job_id': job_id, 'status': new_status}, ensure_ascii=False)
+    }
 
 def lambda_handler(event, context):
     print("=== 運用SQL実行Lambda関数開始 ===")
@@ -13,15 +467,21 @@ def lambda_handler(event, context):
 
     s3_client = boto3.client('s3')
 
-    db_host = os.environ['DB_HOST']
-    db_port = os.environ['DB_PORT']
-    db_name = os.environ['DB_NAME']
-    db_user = os.environ['DB_USER']
-    db_password = os.environ['DB_PASSWORD']
     s3_bucket = os.environ['S3_BUCKET']
     output_prefix = os.environ.get('OUTPUT_PREFIX', 'query-results/')
 
     try:
+        # ジョブ操作（submit / run_job / status / cancel）
+        action = event.get('action')
+        if action == 'submit':
+            return submit_job(event, context)
+        if action == 'run_job':
+            return run_job(event['job_id'], s3_client, s3_bucket, output_prefix, is_primary_required(event))
+        if action == 'status':
+            return get_job_status(event['job_id'])
+        if action == 'cancel':
+            return cancel_job(event['job_id'])
+        
         # イベントからSQLクエリを取得
         if 'sql' not in event:
             return {
@@ -47,121 +507,60 @@ def lambda_handler(event, context):
         print(f"出力形式: {output_format}")
         print(f"出力名: {output_name}")
 
-        # データベース接続
-        print(f"データベース接続中: {db_host}:{db_port}")
-        
-        conn = psycopg2.connect(
-            host=db_host,
-            port=int(db_port),
-            database=db_name,
-            user=db_user,
-            password=db_password,
-            connect_timeout=30
-        )
+        # データベース接続（SELECTはレプリカがあればレプリカ、"consistency": "primary" の場合はプライマリ）
+        is_select = sql_query.upper().startswith('SELECT')
+        if is_select:
+            conn, read_target = get_read_connection(require_primary=is_primary_required(event))
+        else:
+            conn, read_target = get_db_connection(), None
+        print(f"データベース接続中: {read_target['endpoint'] if read_target else 'primary'}")
 
         cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         print("データベース接続成功")
 
-        # SQLクエリ実行
         start_time = datetime.now()
-        cursor.execute(sql_query)
         
-        # SELECT文の場合は結果を取得
-        if sql_query.strip().upper().startswith('SELECT'):
-            results = cursor.fetchall()
-            column_names = [desc[0] for desc in cursor.description] if cursor.description else []
-            rows_count = len(results)
-            
-            print(f"クエリ実行完了: {rows_count}行取得")
-            
-            if rows_count == 0:
-                print("結果が0行のため、S3出力をスキップします")
+        # SELECT文の場合は結果をS3へストリーミング出力
+        if is_select:
+            if output_format not in SUPPORTED_FORMATS:
                 cursor.close()
                 conn.close()
-                
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'body': json.dumps({
-                        'message': 'クエリ実行完了（結果0行）',
-                        'rows_count': 0,
-                        'columns': column_names,
-                        'execution_time_ms': int((datetime.now() - start_time).total_seconds() * 1000)
+                        'error': f'サポートされていない出力形式: {output_format}',
+                        'supported_formats': SUPPORTED_FORMATS
                     }, ensure_ascii=False)
                 }
             
-            # 結果をS3に出力
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            output_key = f"{output_prefix}{output_name}_{timestamp}.{output_format}"
             
-            if output_format == 'csv':
-                # CSV形式で出力
-                output_key = f"{output_prefix}{output_name}_{timestamp}.csv"
-                csv_buffer = io.StringIO()
-                csv_writer = csv.writer(csv_buffer)
-                
-                # ヘッダー書き込み
-                csv_writer.writerow(column_names)
-                
-                # データ書き込み
-                for row in results:
-                    csv_writer.writerow([
-                        str(value) if value is not None else '' 
-                        for value in row
-                    ])
-                
-                csv_content = csv_buffer.getvalue()
-                s3_client.put_object(
-                    Bucket=s3_bucket,
-                    Key=output_key,
-                    Body=csv_content.encode('utf-8'),
-                    ContentType='text/csv'
-                )
-                
-            elif output_format == 'json':
-                # JSON形式で出力
-                output_key = f"{output_prefix}{output_name}_{timestamp}.json"
-                
-                # RealDictCursorの結果をJSONシリアライズ可能な形式に変換
-                json_results = []
-                for row in results:
-                    json_row = {}
-                    for key, value in row.items():
-                        # datetime等の特殊型をstr変換
-                        if value is not None and hasattr(value, 'isoformat'):
-                            json_row[key] = value.isoformat()
-                        else:
-                            json_row[key] = value
-                    json_results.append(json_row)
-                
-                json_content = json.dumps({
-                    'query': sql_query,
-                    'execution_time': datetime.now().isoformat(),
-                    'rows_count': rows_count,
-                    'columns': column_names,
-                    'data': json_results
-                }, ensure_ascii=False, indent=2)
-                
-                s3_client.put_object(
-                    Bucket=s3_bucket,
-                    Key=output_key,
-                    Body=json_content.encode('utf-8'),
-                    ContentType='application/json'
-                )
+            rows_count, column_names, bytes_written = stream_query_to_s3(
+                conn, s3_client, sql_query, output_format, s3_bucket, output_key
+            )
             
-            else:
-                cursor.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'body': json.dumps({
-                        'error': f'サポートされていない出力形式: {output_format}',
-                        'supported_formats': ['csv', 'json']
-                    }, ensure_ascii=False)
-                }
+            print(f"クエリ実行完了: {rows_count}行取得")
+            
+            execution_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
             
             cursor.close()
+            conn.rollback()
+            record_read_query_stats(conn, read_target, 'export', sql_query, execution_time_ms, rows_count)
             conn.close()
             
-            execution_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
+            if rows_count == 0:
+                print("結果が0行のため、S3出力をスキップしました")
+                
+                return {
+                    'statusCode': 200,
+                    'body': json.dumps({
+                        'message': 'クエリ実行完了（結果0行）',
+                        'rows_count': 0,
+                        'columns': column_names,
+                        'execution_time_ms': execution_time_ms
+                    }, ensure_ascii=False)
+                }
             
             return {
                 'statusCode': 200,
@@ -172,12 +571,15 @@ def lambda_handler(event, context):
                     'columns': column_names,
                     'output_location': f"s3://{s3_bucket}/{output_key}",
                     'output_format': output_format,
-                    'execution_time_ms': execution_time_ms
+                    'output_bytes': bytes_written,
+                    'execution_time_ms': execution_time_ms,
+                    'read_target': read_target['role']
                 }, ensure_ascii=False)
             }
         
         else:
             # INSERT/UPDATE/DELETE等の場合
+            cursor.execute(sql_query)
             affected_rows = cursor.rowcount
             conn.commit()
             cursor.close()
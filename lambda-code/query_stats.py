@@ -0,0 +1,154 @@
+import os
+import re
+import threading
+import psycopg2
+from db_connection import get_db_connection
+
+# クエリ統計の記録を有効にするか
+QUERY_STATS_ENABLED = os.environ.get('QUERY_STATS_ENABLED', 'true').lower() == 'true'
+
+# 文字列リテラル・引用識別子・コメントと空白の連続を識別するトークンパターン
+SQL_TOKEN_PATTERN = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|(?:\s+|--[^\n]*|/\*.*?\*/)+""", re.DOTALL)
+
+# クエリ形状の抽出用（文字列・数値リテラルを ? に置換、引用識別子はそのまま）
+LITERAL_PATTERN = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|\b\d+(?:\.\d+)?\b""")
+IN_LIST_PATTERN = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+# 自動パラメータ化用のトークン（文字列・引用識別子・整数・単語・比較演算子・括弧・カンマ、それ以外は1文字ずつ）
+PARAMETER_TOKEN_PATTERN = re.compile(r"""(?P<string>'(?:[^']|'')*')|(?P<ident>"(?:[^"]|"")*")|(?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)|(?P<word>[A-Za-z_][A-Za-z0-9_]*)|(?P<op>[=<>!]+)|(?P<punct>[(),])|(?P<other>\S)""")
+COMPARISON_OPERATORS = {'=', '<>', '!=', '<', '>', '<=', '>='}
+PARAMETER_KEYWORDS = {'LIKE', 'ILIKE', 'BETWEEN', 'LIMIT', 'OFFSET'}
+INTEGER_PARAMETER_MAX_DIGITS = 9  # int4の範囲に収まる桁数（大きな値・小数は型推定が変わるためリテラルのまま）
+
+# レプリカで実行したクエリの統計を書き込むプライマリの接続（ウォームスタート間で再利用）
+_primary_connection = None
+_primary_lock = threading.Lock()
+
+def normalize_sql(sql_query):
+    """SQLを正規化（コメント除去・空白の圧縮・末尾セミコロン除去、リテラルは保持）"""
+    def replace_token(match):
+        token = match.group(0)
+        if token[0] in ('\'', '"'):
+            return token
+        return ' '
+    
+    normalized = SQL_TOKEN_PATTERN.sub(replace_token, sql_query).strip()
+    return normalized.rstrip(';').strip()
+
+def query_shape(sql_query):
+    """リテラルを ? に置き換えたクエリ形状を返す（IN (1, 2, 3) は IN (?) にまとめる）"""
+    def replace_literal(match):
+        token = match.group(0)
+        if token[0] == '"':
+            return token
+        return '?'
+    
+    shape = LITERAL_PATTERN.sub(replace_literal, normalize_sql(sql_query))
+    return IN_LIST_PATTERN.sub('(?)', shape)
+
+def parameterize_sql(sql_query):
+    """正規化したSQLのリテラルを $1, $2... に置き換え、(パラメータ化したSQL, パラメータ値のリスト)を返す
+    
+    パラメータの型は比較相手のカラムから推定させるため、置き換えるのは比較演算子・LIKE・BETWEEN の右辺、
+    IN (...) の要素、LIMIT/OFFSET の値だけとする（SELECT句の定数や ORDER BY 1、date '...' などはそのまま）。
+    ドル記号を含むSQLは置き換えずに返す。
+    """
+    normalized = normalize_sql(sql_query)
+    if '$' in normalized:
+        return normalized, []
+    
+    parts = []
+    params = []
+    position = 0
+    previous = None  # 直前のトークン（種類, 大文字の値, 終了位置）
+    between = 0  # 1: BETWEEN の直後, 2: BETWEEN ... AND の直後
+    in_lists = []  # 括弧ごとに IN (...) の値の並びかどうか
+    
+    for match in PARAMETER_TOKEN_PATTERN.finditer(normalized):
+        kind = match.lastgroup
+        token = match.group(0)
+        upper = token.upper()
+        
+        if kind in ('string', 'number') and previous is not None:
+            in_context = (
+                (previous[0] == 'op' and previous[1] in COMPARISON_OPERATORS) or
+                (previous[0] == 'word' and previous[1] in PARAMETER_KEYWORDS) or
+                (previous[1] == 'AND' and between == 2) or
+                (previous[1] in ('(', ',') and bool(in_lists) and in_lists[-1])
+            )
+            if kind == 'number':
+                in_context = in_context and token.isdigit() and len(token) <= INTEGER_PARAMETER_MAX_DIGITS
+            else:
+                # E'...' のような接頭辞付きの文字列は置き換えない
+                in_context = in_context and not (previous[0] == 'word' and previous[2] == match.start())
+            
+            if in_context:
+                params.append(token[1:-1].replace("''", "'") if kind == 'string' else token)
+                parts.append(normalized[position:match.start()])
+                parts.append(f"${len(params)}")
+                position = match.end()
+        
+        if kind == 'word' and upper == 'BETWEEN':
+            between = 1
+        elif kind == 'word' and upper == 'AND' and between == 1:
+            between = 2
+        elif between == 2:
+            between = 0
+        
+        if kind == 'punct' and token == '(':
+            in_lists.append(previous is not None and previous[1] == 'IN')
+        elif kind == 'punct' and token == ')' and in_lists:
+            in_lists.pop()
+        elif kind == 'word' and in_lists:
+            # 副問い合わせや関数呼び出しを含む括弧は値の並びとして扱わない
+            in_lists[-1] = False
+        
+        previous = (kind, upper, match.end())
+    
+    parts.append(normalized[position:])
+    return ''.join(parts), params
+
+def record_query_stats(conn, source, sql_query, elapsed_ms, row_count):
+    """クエリ形状ごとの実行回数・時間・行数をquery_statsに加算する（失敗しても本処理は継続）"""
+    if not QUERY_STATS_ENABLED:
+        return
+    
+    shape = query_shape(sql_query)
+    
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO query_stats (query_hash, source, query_shape, calls, total_time_ms, max_time_ms, total_rows)
+            VALUES (md5(%s), %s, %s, 1, %s, %s, %s)
+            ON CONFLICT (query_hash, source) DO UPDATE SET
+                calls = query_stats.calls + 1,
+                total_time_ms = query_stats.total_time_ms + EXCLUDED.total_time_ms,
+                max_time_ms = GREATEST(query_stats.max_time_ms, EXCLUDED.max_time_ms),
+                total_rows = query_stats.total_rows + EXCLUDED.total_rows,
+                last_seen = CURRENT_TIMESTAMP
+        """, (shape, source, shape, elapsed_ms, elapsed_ms, row_count))
+        cursor.close()
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f"クエリ統計の記録に失敗（続行）: {e}")
+        conn.rollback()
+
+def record_read_query_stats(conn, read_target, source, sql_query, elapsed_ms, row_count):
+    """読み取り用の接続で実行したクエリの統計を記録する（レプリカは書き込めないためプライマリに記録）"""
+    if read_target['role'] != 'replica':
+        record_query_stats(conn, source, sql_query, elapsed_ms, row_count)
+        return
+    if not QUERY_STATS_ENABLED:
+        return
+    
+    global _primary_connection
+    with _primary_lock:
+        try:
+            if _primary_connection is None or _primary_connection.closed:
+                _primary_connection = get_db_connection()
+            record_query_stats(_primary_connection, source, sql_query, elapsed_ms, row_count)
+        except psycopg2.Error as e:
+            print(f"クエリ統計の記録に失敗（続行）: {e}")
+            if _primary_connection is not None:
+                _primary_connection.close()
+            _primary_connection = None
@@ -0,0 +1,250 @@
+import csv
+import itertools
+import math
+import random
+import re
+from collections import deque
+from datetime import datetime
+
+# CSVからテーブル定義（CREATE TABLE）を推定する
+# 行はリザーバーサンプリングで一定件数だけ保持し（メモリはファイルサイズによらず一定）、
+# カラムごとに値を改行で連結した文字列へ正規表現を1回ずつ当てて型を判定する
+
+PROFILE_SAMPLE_ROWS = 10000
+
+# 判定する型（狭いものから順に、全ての値が一致した最初の型を採用）
+BOOLEAN_VALUE = r'(?:true|false|TRUE|FALSE|True|False)'
+INTEGER_VALUE = r'[-+]?(?:0|[1-9]\d*)'  # 先頭が0のコード値（"00123"）は文字列として扱う
+NUMERIC_VALUE = r'[-+]?(?:0|[1-9]\d*)?\.\d+|[-+]?(?:0|[1-9]\d*)'
+DATE_VALUE = r'\d{4}[-/](?:0?[1-9]|1[0-2])[-/](?:0?[1-9]|[12]\d|3[01])'
+TIMESTAMP_VALUE = DATE_VALUE + r'[T ](?:[01]\d|2[0-3]):[0-5]\d(?::[0-5]\d(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?'
+TIME_ZONE_PATTERN = re.compile(r'(?:Z|[+-]\d{2}:?\d{2})$')
+DECIMAL_PART_PATTERN = re.compile(r'[-+]?(\d*)(?:\.(\d+))?')
+
+def column_pattern(value_pattern):
+    """改行で連結した全ての値が一致するかを1回で判定するパターン"""
+    return re.compile(rf'(?:{value_pattern})(?:\n(?:{value_pattern}))*')
+
+TYPE_PATTERNS = [
+    ('boolean', column_pattern(BOOLEAN_VALUE)),
+    ('integer', column_pattern(INTEGER_VALUE)),
+    ('numeric', column_pattern(NUMERIC_VALUE)),
+    ('date', column_pattern(DATE_VALUE)),
+    ('timestamp', column_pattern(TIMESTAMP_VALUE)),
+]
+
+# 可変長文字列の長さの候補（サンプルの最大長に余裕を持たせて選ぶ。超える場合はTEXT）
+VARCHAR_LENGTHS = [20, 40, 50, 80, 100, 255, 500, 1000]
+VARCHAR_HEADROOM = 1.5
+FIXED_LENGTH_MAX = 40  # 全て同じ長さの値（IDやコード）はその長さにする
+FIXED_LENGTH_MIN_VALUES = 100  # 固定長と判断するのに必要な値の数
+
+INT4_MAX = 2 ** 31 - 1
+INT8_MAX = 2 ** 63 - 1
+NUMERIC_MAX_PRECISION = 38
+
+IDENTIFIER_PATTERN = re.compile(r'[a-z_][a-z0-9_]*')
+KEY_NAME_PATTERN = re.compile(r'(?:^|_)(?:id|code|key|no)$', re.I)
+
+def reservoir_sample(rows, size, seed=None):
+    """行の並びから一様に最大size行を抽出し、(抽出した行, 総行数)を返す
+    
+    読み飛ばす行数をまとめて決める方式（Algorithm L）のため、読み飛ばす行はPythonの処理を通さずに消費する。
+    """
+    rng = random.Random(seed)
+    numbered = enumerate(rows, 1)
+    reservoir = [row for _, row in itertools.islice(numbered, size)]
+    total = len(reservoir)
+    if total < size or size <= 0:
+        return reservoir, total
+    
+    weight = math.exp(math.log(rng.random()) / size)
+    while True:
+        skip = int(math.log(rng.random()) / math.log(1 - weight))
+        # 読み飛ばした最後の行の番号だけを残す
+        skipped = deque(itertools.islice(numbered, skip), maxlen=1)
+        if skipped:
+            total = skipped[0][0]
+        item = next(numbered, None)
+        if item is None:
+            return reservoir, total
+        total, row = item
+        reservoir[rng.randrange(size)] = row
+        weight *= math.exp(math.log(rng.random()) / size)
+
+def choose_varchar_length(lengths):
+    """サンプルの値の長さから VARCHAR の長さを決める（長すぎる場合はNone = TEXT）"""
+    max_length = max(lengths)
+    if max_length <= FIXED_LENGTH_MAX and min(lengths) == max_length and len(lengths) >= FIXED_LENGTH_MIN_VALUES:
+        return max_length
+    
+    needed = max_length * VARCHAR_HEADROOM
+    for length in VARCHAR_LENGTHS:
+        if length >= needed:
+            return length
+    return None
+
+def numeric_type(values):
+    """小数の桁数から NUMERIC(精度, 位取り) を決める"""
+    int_digits = 1
+    scale = 0
+    for value in values:
+        whole, fraction = DECIMAL_PART_PATTERN.fullmatch(value).groups()
+        int_digits = max(int_digits, len(whole.lstrip('0')) or 1)
+        scale = max(scale, len(fraction or ''))
+    
+    precision = max(18, int_digits + scale)
+    if precision > NUMERIC_MAX_PRECISION:
+        return 'NUMERIC'
+    return f'NUMERIC({precision},{scale})'
+
+def infer_column_type(values):
+    """空欄を除いたサンプルの値からカラムの型を推定する"""
+    if not values:
+        return 'TEXT', None
+    
+    joined = '\n'.join(values)
+    lengths = list(map(len, values))
+    
+    # 改行を含む値がある場合は連結した文字列で判定できないため文字列として扱う
+    if joined.count('\n') == len(values) - 1:
+        for type_name, pattern in TYPE_PATTERNS:
+            if not pattern.fullmatch(joined):
+                continue
+            
+            if type_name == 'boolean':
+                return 'BOOLEAN', None
+            if type_name == 'integer':
+                numbers = list(map(int, values))
+                limit = max(max(numbers), -min(numbers) - 1)
+                if limit <= INT4_MAX:
+                    return 'INTEGER', None
+                if limit <= INT8_MAX:
+                    return 'BIGINT', None
+                return 'NUMERIC', None
+            if type_name == 'numeric':
+                return numeric_type(values), None
+            if type_name == 'date':
+                return 'DATE', None
+            if any(TIME_ZONE_PATTERN.search(value) for value in values):
+                return 'TIMESTAMP WITH TIME ZONE', None
+            return 'TIMESTAMP', None
+    
+    length = choose_varchar_length(lengths)
+    if length is None:
+        return 'TEXT', max(lengths)
+    return f'VARCHAR({length})', max(lengths)
+
+def profile_csv(csv_columns, rows, sample_size=PROFILE_SAMPLE_ROWS, seed=None):
+    """CSVの行（csv.readerの出力）をサンプリングし、カラムごとの型・最大長・空欄の有無・一意性を推定する"""
+    sample, total_rows = reservoir_sample(rows, sample_size, seed)
+    return build_profile(csv_columns, sample, total_rows)
+
+def profile_csv_lines(csv_columns, lines, sample_size=PROFILE_SAMPLE_ROWS, seed=None):
+    """CSVの物理行（バイト列）をサンプリングしてから抽出した行だけを解析する（ローカルファイル向けの高速版）
+    
+    読み飛ばす行はCSVとして解析しないため、ファイルの読み込み速度で処理できる。
+    改行を含む値の途中から始まる行は区切れないため、引用符の数が奇数の行と列数が合わない行は推定から除く。
+    """
+    sample, total_lines = reservoir_sample(lines, sample_size, seed)
+    width = len(csv_columns)
+    rows = []
+    for line in sample:
+        text = line.decode('utf-8', errors='replace')
+        if text.count('"') % 2:
+            continue
+        row = next(csv.reader([text]), [])
+        if len(row) == width:
+            rows.append(row)
+    return build_profile(csv_columns, rows, total_lines, len(sample) - len(rows))
+
+def build_profile(csv_columns, sample, total_rows, skipped_rows=0):
+    """抽出した行からカラムごとの推定結果を作る"""
+    width = len(csv_columns)
+    
+    # 列数が揃っていない行はヘッダーに合わせてから、カラムごとのタプルに入れ替える
+    sample = [row if len(row) == width else (row + [''] * width)[:width] for row in sample]
+    column_values = list(zip(*sample)) if sample else [()] * width
+    
+    columns = []
+    for name, values in zip(csv_columns, column_values):
+        present = [value for value in values if value != '']
+        column_type, max_length = infer_column_type(present)
+        null_count = len(values) - len(present)
+        distinct = len(set(present))
+        columns.append({
+            'name': name,
+            'type': column_type,
+            'max_length': max_length,
+            'nullable': null_count > 0 or not present,
+            'null_count': null_count,
+            'distinct': distinct,
+            'unique': bool(present) and null_count == 0 and distinct == len(present) and len(present) > 1
+        })
+    
+    candidate_keys = [col['name'] for col in columns if col['unique'] and col['type'] != 'BOOLEAN']
+    return {
+        'total_rows': total_rows,
+        'sampled_rows': len(sample),
+        'skipped_rows': skipped_rows,
+        'columns': columns,
+        'candidate_keys': candidate_keys,
+        'primary_key': choose_primary_key(columns, candidate_keys)
+    }
+
+def choose_primary_key(columns, candidate_keys):
+    """候補キーから主キーを選ぶ（"id" → 名前がID・コードらしいもの → 値が短いものの順）"""
+    if not candidate_keys:
+        return None
+    by_name = {col['name']: col for col in columns}
+    
+    def rank(name):
+        return (
+            name.lower() != 'id',
+            not KEY_NAME_PATTERN.search(name),
+            by_name[name]['type'] in ('TEXT', 'NUMERIC') or by_name[name]['type'].startswith('TIMESTAMP'),
+            by_name[name]['max_length'] or 0
+        )
+    return min(candidate_keys, key=rank)
+
+def quote_identifier(name):
+    """小文字・数字・アンダースコアのみの名前はそのまま、それ以外は二重引用符で囲む"""
+    if IDENTIFIER_PATTERN.fullmatch(name):
+        return name
+    return '"' + name.replace('"', '""') + '"'
+
+def render_ddl(table_name, profile, source_file):
+    """table_creatorでそのまま適用できる CREATE TABLE 文のSQLファイルを作成"""
+    total = max(profile['sampled_rows'], 1)
+    lines = [
+        f"-- schema-profiler: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"-- 元ファイル: {source_file}",
+        f"-- {profile['total_rows']}行から{profile['sampled_rows']}行を抽出して推定（型・長さ・NOT NULL・キーは抽出した行に基づく）",
+        f"-- 候補キー: {', '.join(profile['candidate_keys']) or 'なし'}",
+        *([f"-- 改行を含む値の途中などで区切れなかった {profile['skipped_rows']}行は推定から除外"] if profile['skipped_rows'] else []),
+        "-- 適用前に内容を確認し、必要に応じて型・長さを修正してください",
+        f"CREATE TABLE IF NOT EXISTS {quote_identifier(table_name)} ("
+    ]
+    
+    definitions = []
+    for col in profile['columns']:
+        definition = f"    {quote_identifier(col['name'])} {col['type']}"
+        if not col['nullable']:
+            definition += " NOT NULL"
+        note = f"空欄 {col['null_count'] / total * 100:.1f}%, 種類 {col['distinct']}"
+        if col['max_length'] is not None:
+            note += f", 最大長 {col['max_length']}"
+        definitions.append((definition, note))
+    
+    # csv_processorがファイル名と取り込み日時を記録するカラム
+    definitions.append(("    file_source VARCHAR(1000)", "読み込み元ファイル"))
+    definitions.append(("    processed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP", "取り込み日時"))
+    if profile['primary_key']:
+        definitions.append((f"    PRIMARY KEY ({quote_identifier(profile['primary_key'])})", "抽出した行で一意"))
+    
+    for n, (definition, note) in enumerate(definitions):
+        separator = ',' if n < len(definitions) - 1 else ''
+        lines.append(f"{definition}{separator}  -- {note}")
+    lines.append(");")
+    lines.append("")
+    return '\n'.join(lines)
@@ -0,0 +1,173 @@
+import decimal
+import psycopg2.extras
+
+# 集計テーブルの定義（init-sql/10_summary_tables.sql のsummary_table_definitionsに登録）
+# 集計テーブルは (グループ化カラム..., row_count, sum_<カラム>..., updated_at) の形で、
+# table_creatorが作成・初期集計し、csv_processorが挿入した行の差分を加算する
+
+def load_summary_definitions(cursor, source_table=None):
+    """集計テーブルの定義を取得（source_table指定時はそのテーブルを元にするもののみ）"""
+    cursor.execute("""
+        SELECT d.summary_table, d.source_table, d.group_columns, d.sum_columns,
+               d.last_refreshed_at, to_regclass(quote_ident(d.summary_table)) IS NOT NULL AS summary_exists
+        FROM summary_table_definitions d
+        WHERE %s IS NULL OR d.source_table = %s
+        ORDER BY d.summary_table
+    """, (source_table, source_table))
+    names = [desc[0] for desc in cursor.description]
+    return [dict(row) if isinstance(row, dict) else dict(zip(names, row)) for row in cursor.fetchall()]
+
+def get_column_types(cursor, table_name, columns):
+    """カラムの型（format_typeの表記）を返す"""
+    cursor.execute("""
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod) AS column_type
+        FROM pg_attribute a
+        WHERE a.attrelid = to_regclass(quote_ident(%s)) AND a.attname = ANY(%s) AND a.attnum > 0 AND NOT a.attisdropped
+    """, (table_name, list(columns)))
+    column_types = {}
+    for row in cursor.fetchall():
+        name, column_type = (row['attname'], row['column_type']) if isinstance(row, dict) else row
+        column_types[name] = column_type
+    missing = [col for col in columns if col not in column_types]
+    if missing:
+        raise ValueError(f"テーブル '{table_name}' にカラム {missing} がありません")
+    return column_types
+
+def create_summary_table(cursor, definition):
+    """集計テーブルを作成（グループ化カラムはNULLも1つのグループとして一意にする）"""
+    group_columns = definition['group_columns']
+    column_types = get_column_types(cursor, definition['source_table'], group_columns)
+    
+    column_defs = [f'"{col}" {column_types[col]}' for col in group_columns]
+    column_defs.append('row_count BIGINT NOT NULL DEFAULT 0')
+    column_defs.extend(f'"sum_{col}" NUMERIC' for col in definition['sum_columns'])
+    column_defs.append('updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP')
+    
+    summary_table = definition['summary_table']
+    group_list = ', '.join(f'"{col}"' for col in group_columns)
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS "{summary_table}" ({", ".join(column_defs)})')
+    cursor.execute(
+        f'CREATE UNIQUE INDEX IF NOT EXISTS "{summary_table}_group_key" '
+        f'ON "{summary_table}" ({group_list}) NULLS NOT DISTINCT'
+    )
+
+def rebuild_summary(cursor, definition):
+    """元テーブルを集計し直して集計テーブルを置き換える（コミットは呼び出し側）
+    
+    差分を加算するロードと同時に実行しても二重に数えないよう、集計テーブルをロックしてから集計する。
+    """
+    summary_table = definition['summary_table']
+    group_list = ', '.join(f'"{col}"' for col in definition['group_columns'])
+    sum_targets = ''.join(f', "sum_{col}"' for col in definition['sum_columns'])
+    sum_exprs = ''.join(f', sum("{col}")' for col in definition['sum_columns'])
+    
+    cursor.execute(f'LOCK TABLE "{summary_table}" IN SHARE ROW EXCLUSIVE MODE')
+    cursor.execute(f'DELETE FROM "{summary_table}"')
+    cursor.execute(f"""
+        INSERT INTO "{summary_table}" ({group_list}, row_count{sum_targets})
+        SELECT {group_list}, count(*){sum_exprs}
+        FROM "{definition['source_table']}"
+        GROUP BY {group_list}
+    """)
+    groups = cursor.rowcount
+    cursor.execute(
+        "UPDATE summary_table_definitions SET last_refreshed_at = CURRENT_TIMESTAMP WHERE summary_table = %s",
+        (summary_table,)
+    )
+    return groups
+
+class SummaryDelta:
+    """挿入した行をグループごとに集計し、集計テーブルへ差分として加算する
+    
+    行は挿入カラム順の値（CSVの文字列、空欄はNone）のタプルで受け取る。
+    数値として解釈できない値があった場合はinvalidとし、ロード後に集計し直す。
+    協調ロード・swap方式は、挿入した行（テーブル）をDB側で集計して加算・減算する（aggregate_sql）。
+    """
+    
+    def __init__(self, cursor, definition, insert_columns):
+        self.definition = definition
+        self.summary_table = definition['summary_table']
+        self.group_indexes = [insert_columns.index(col) for col in definition['group_columns']]
+        self.sum_indexes = [insert_columns.index(col) for col in definition['sum_columns']]
+        self.groups = {}
+        self.invalid = False
+        self.applied_rows = 0
+        
+        # 文字列の値はDB側でカラムの型に変換してからグループ化する（'2024-1-5' と '2024-01-05' を同じグループにするため）
+        column_types = get_column_types(cursor, definition['source_table'], definition['group_columns'])
+        group_list = ', '.join(f'"{col}"' for col in definition['group_columns'])
+        sum_names = [f'"sum_{col}"' for col in definition['sum_columns']]
+        sum_targets = ''.join(f', {name}' for name in sum_names)
+        sum_exprs = ''.join(f', sum({name})' for name in sum_names)
+        sum_updates = ''.join(
+            f', {name} = COALESCE("{self.summary_table}".{name} + EXCLUDED.{name}, "{self.summary_table}".{name}, EXCLUDED.{name})'
+            for name in sum_names
+        )
+        self.insert_columns_sql = f'INSERT INTO "{self.summary_table}" ({group_list}, row_count{sum_targets})'
+        self.conflict_sql = (
+            f'ON CONFLICT ({group_list}) DO UPDATE '
+            f'SET row_count = "{self.summary_table}".row_count + EXCLUDED.row_count{sum_updates}, '
+            f'updated_at = CURRENT_TIMESTAMP'
+        )
+        self.template = '(' + ', '.join(
+            [f'%s::{column_types[col]}' for col in definition['group_columns']] +
+            ['%s::bigint'] + ['%s::numeric'] * len(sum_names)
+        ) + ')'
+        self.upsert_sql = f"""
+            {self.insert_columns_sql}
+            SELECT {group_list}, sum(row_count){sum_exprs}
+            FROM (VALUES %s) AS delta({group_list}, row_count{sum_targets})
+            GROUP BY {group_list}
+            ORDER BY {group_list}
+            {self.conflict_sql}
+        """
+    
+    def aggregate_sql(self, source, sign=1):
+        """source（テーブル名・CTE名）の行をグループごとに集計して加算（sign=-1で減算）するSQL"""
+        group_list = ', '.join(f'"{col}"' for col in self.definition['group_columns'])
+        sum_exprs = ''.join(f', {sign} * sum("{col}")' for col in self.definition['sum_columns'])
+        return f"""
+            {self.insert_columns_sql}
+            SELECT {group_list}, {sign} * count(*){sum_exprs}
+            FROM {source}
+            GROUP BY {group_list}
+            ORDER BY {group_list}
+            {self.conflict_sql}
+        """
+    
+    def apply_table(self, cursor, source_table, sign=1):
+        """テーブルの全行を加算・減算し、行がなくなったグループを削除する（コミットは呼び出し側）"""
+        cursor.execute(self.aggregate_sql(f'"{source_table}"', sign))
+        if sign < 0:
+            cursor.execute(f'DELETE FROM "{self.summary_table}" WHERE row_count = 0')
+    
+    def add(self, values):
+        """挿入できた1行分を加算する"""
+        key = tuple(values[i] for i in self.group_indexes)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = [0] + [None] * len(self.sum_indexes)
+        group[0] += 1
+        
+        if self.invalid:
+            return
+        for n, i in enumerate(self.sum_indexes, 1):
+            if values[i] is None:
+                continue
+            try:
+                value = decimal.Decimal(values[i])
+            except decimal.InvalidOperation:
+                self.invalid = True
+                return
+            group[n] = value if group[n] is None else group[n] + value
+    
+    def flush(self, cursor):
+        """溜めた差分を集計テーブルに加算する（バッチと同じトランザクションで実行し、コミットは呼び出し側）"""
+        if not self.groups or self.invalid:
+            self.groups = {}
+            return
+        
+        rows = [key + tuple(group) for key, group in self.groups.items()]
+        psycopg2.extras.execute_values(cursor, self.upsert_sql, rows, template=self.template, page_size=len(rows))
+        self.applied_rows += sum(group[0] for group in self.groups.values())
+        self.groups = {}
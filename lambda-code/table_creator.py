@@ -1,9 +1,39 @@
 import json
 import boto3
-import psycopg2
 import os
 import re
 import traceback
+from db_connection import describe_target, get_db_connection
+from summary_tables import create_summary_table, load_summary_definitions, rebuild_summary
+
+def prepare_summary_tables(conn, cursor, refresh_all=False):
+    """集計テーブルの定義に従って集計テーブルを作成し、未集計のもの（refresh_all指定時は全て）を集計する"""
+    cursor.execute("SELECT to_regclass('summary_table_definitions') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return [], []
+    
+    prepared = []
+    failed = []
+    for definition in load_summary_definitions(cursor):
+        summary_table = definition['summary_table']
+        try:
+            # 作成と集計を1トランザクションで行う（途中の空の集計テーブルを見せない）
+            conn.autocommit = False
+            create_summary_table(cursor, definition)
+            groups = None
+            if refresh_all or not definition['summary_exists'] or definition['last_refreshed_at'] is None:
+                groups = rebuild_summary(cursor, definition)
+            conn.commit()
+            print(f"集計テーブル '{summary_table}': {'集計 ' + str(groups) + 'グループ' if groups is not None else '作成済み'}")
+            prepared.append({'summary_table': summary_table, 'source_table': definition['source_table'], 'rebuilt_groups': groups})
+        except Exception as e:
+            conn.rollback()
+            print(f"集計テーブル '{summary_table}' の作成エラー（続行）: {e}")
+            failed.append({'summary_table': summary_table, 'error': str(e)})
+        finally:
+            conn.autocommit = True
+    
+    return prepared, failed
 
 def lambda_handler(event, context):
     print("=== テーブル作成Lambda関数開始 ===")
@@ -11,15 +41,12 @@ def lambda_handler(event, context):
     
     s3_client = boto3.client('s3')
     
-    db_host = os.environ['DB_HOST']
-    db_port = os.environ['DB_PORT']
-    db_name = os.environ['DB_NAME']
-    db_user = os.environ['DB_USER']
-    db_password = os.environ['DB_PASSWORD']
     s3_bucket = os.environ['S3_BUCKET']
-    sql_prefix = os.environ.get('SQL_PREFIX', 'init-sql/')
+    # イベントでプレフィックスを指定可能（例: index_advisorの推奨インデックスを適用）
+    sql_prefix = event.get('sql_prefix') or os.environ.get('SQL_PREFIX', 'init-sql/')
     
     created_tables = []
+    created_indexes = []
     failed_tables = []
     
     try:
@@ -69,17 +96,10 @@ def lambda_handler(event, context):
             }
         
         # データベース接続
-        print(f"データベース接続中: {db_host}:{db_port}")
+        print(f"データベース接続中: {describe_target()}")
         
         try:
-            conn = psycopg2.connect(
-                host=db_host,
-                port=int(db_port),
-                database=db_name,
-                user=db_user,
-                password=db_password,
-                connect_timeout=30
-            )
+            conn = get_db_connection()
             
             conn.autocommit = True
             cursor = conn.cursor()
@@ -117,6 +137,7 @@ def lambda_handler(event, context):
                                 if stmt.strip()]
                 
                 table_names = []
+                index_names = []
                 for i, sql_statement in enumerate(sql_statements):
                     if sql_statement:
                         print(f"SQL実行 {i+1}/{len(sql_statements)}: {sql_statement[:150]}...")
@@ -140,9 +161,18 @@ def lambda_handler(event, context):
                             table_names.append(table_name)
                             print(f"  -> テーブル '{table_name}' を検出")
                         
+                        # CREATE INDEX文からインデックス名を抽出
+                        index_match = re.search(
+                            r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?[`"]?(\w+)[`"]?',
+                            sql_statement, re.IGNORECASE
+                        )
+                        index_name = index_match.group(1) if index_match else None
+                        
                         try:
                             cursor.execute(sql_statement)
                             print(f"SQL実行成功: {i+1}")
+                            if index_name and not table_name:
+                                index_names.append(index_name)
                         except Exception as e:
                             print(f"SQL実行エラー（続行）: {e}")
                             # エラーが発生してもテーブル名は記録
@@ -153,9 +183,12 @@ def lambda_handler(event, context):
                                     'error': str(e)
                                 })
                 
+                created_indexes.extend(index_names)
                 if table_names:
                     created_tables.extend(table_names)
                     print(f"✅ テーブル作成完了: {table_names}")
+                elif index_names:
+                    print(f"✅ インデックス作成完了: {index_names}")
                 else:
                     print(f"⚠️ 警告: {sql_file} からテーブル名を抽出できませんでした")
                     
@@ -168,6 +201,9 @@ def lambda_handler(event, context):
                     'error': str(e)
                 })
         
+        # 集計テーブルの作成・初期集計（{"refresh_summaries": true} で全て集計し直す）
+        summary_tables, failed_summaries = prepare_summary_tables(conn, cursor, bool(event.get('refresh_summaries')))
+        
         # 作成済みテーブル一覧を確認
         cursor.execute("""
             SELECT table_name 
@@ -198,7 +234,10 @@ def lambda_handler(event, context):
             'body': json.dumps({
                 'message': f'テーブル作成完了: 成功{len(created_tables)}個, 失敗{len(failed_tables)}個',
                 'created_tables': created_tables,
+                'created_indexes': created_indexes,
                 'failed_tables': failed_tables,
+                'summary_tables': summary_tables,
+                'failed_summary_tables': failed_summaries,
                 'all_tables': all_table_list,
                 'sql_files_processed': len(sql_files),
                 'success_count': len(created_tables),
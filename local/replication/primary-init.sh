@@ -0,0 +1,9 @@
+#!/bin/bash
+# レプリケーション用ユーザーの作成と接続許可（docker-entrypoint-initdb.dで初回のみ実行）
+set -e
+
+psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$POSTGRES_DB" <<-SQL
+    CREATE ROLE replicator WITH REPLICATION LOGIN PASSWORD 'replicator';
+SQL
+
+echo "host replication replicator all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+csv_processorのカラムの品質統計の集計にかかる時間のベンチマーク
+
+CSVの行の解析（必要なカラムの取り出し）だけの場合と、バッチごとに統計を集計する場合を比較する。
+データベースには接続しない（挿入の時間は含まないため、実際のロードに対する割合はこれより小さい）。
+使い方: python scripts/bench-column-stats.py --rows 100000 --columns 40 [--sample-every 1]
+"""
+
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda-code'))
+
+from column_stats import COLUMN_STATS_SAMPLE_EVERY, ColumnStatsCollector
+from csv_processor import iter_projected_rows
+
+BATCH_SIZE = 5000
+
+# カラムの種類: (データ型, 値の生成)。ID・コード値・金額・日付・自由記述が混ざるSalesforceのエクスポートを想定
+COLUMN_KINDS = [
+    ('character varying', lambda n: f"a0{n:016d}"),
+    ('character varying', lambda n: random.choice(['Active', 'Inactive', 'Pending', ''])),
+    ('numeric', lambda n: f"{random.random() * 100000:.2f}" if random.random() > 0.2 else ''),
+    ('integer', lambda n: str(random.randrange(1000))),
+    ('date', lambda n: f"2024-{random.randrange(1, 13):02d}-{random.randrange(1, 29):02d}"),
+    ('text', lambda n: ' '.join(random.choice(['lorem', 'ipsum', 'dolor', 'sit']) for _ in range(random.randrange(12)))),
+]
+
+def generate_csv(rows, columns):
+    random.seed(0)
+    kinds = [COLUMN_KINDS[n % len(COLUMN_KINDS)] for n in range(columns)]
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    for row_number in range(rows):
+        writer.writerow([generate(row_number) for _, generate in kinds])
+    return output.getvalue().splitlines(keepends=True), [(f"col_{n}", data_type) for n, (data_type, _) in enumerate(kinds)]
+
+def run(lines, columns, collect, sample_every=COLUMN_STATS_SAMPLE_EVERY):
+    """行を解析してバッチにまとめる（collectの場合はバッチごとに統計を集計）"""
+    projection = list(range(len(columns)))
+    collector = ColumnStatsCollector(columns, sample_every) if collect else None
+    batch = []
+    for row in iter_projected_rows(iter(lines), projection):
+        batch.append(tuple(None if value == '' else value for value in row) if '' in row else row)
+        if len(batch) >= BATCH_SIZE:
+            if collector:
+                collector.add_rows(batch)
+            batch = []
+    if collector:
+        collector.add_rows(batch)
+    return collector
+
+def measure(lines, columns, collect, repeat, sample_every):
+    """全体の時間と、そのうち統計の集計（add_rows）にかかった時間のそれぞれの最小値"""
+    elapsed = []
+    collect_elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        collector = run(lines, columns, collect, sample_every)
+        elapsed.append(time.perf_counter() - start)
+        collect_elapsed.append(collector.elapsed if collector else 0.0)
+    return min(elapsed), min(collect_elapsed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="カラムの品質統計の集計のベンチマーク")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--columns", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--sample-every", type=int, default=COLUMN_STATS_SAMPLE_EVERY, help="統計に抽出する行の間隔（1で全行）")
+    args = parser.parse_args()
+    
+    print(f"CSV生成: {args.rows}行 x {args.columns}列（統計は{args.sample_every}行ごとに抽出）")
+    lines, columns = generate_csv(args.rows, args.columns)
+    
+    parse_seconds, _ = measure(lines, columns, False, args.repeat, args.sample_every)
+    stats_seconds, collect_seconds = measure(lines, columns, True, args.repeat, args.sample_every)
+    values = args.rows * args.columns
+    print(f"解析のみ: {parse_seconds:.3f}秒 ({args.rows / parse_seconds:,.0f}行/秒)")
+    print(f"解析+統計: {stats_seconds:.3f}秒 ({args.rows / stats_seconds:,.0f}行/秒)")
+    # 差し引きは実行ごとのばらつきに埋もれるため、集計の時間はadd_rowsの中で計った値を使う
+    print(f"統計の集計: {collect_seconds / values * 1e6:.3f}µs/値（解析の{collect_seconds / parse_seconds:.1%}）")
+    
+    summary = run(lines, columns, True, args.sample_every).summary()
+    for name, _ in columns[:len(COLUMN_KINDS)]:
+        print(f"  {name}: {summary[name]}")
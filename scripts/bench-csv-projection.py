@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+csv_processorの行の解析のベンチマーク（全カラムを解析 / 必要なカラムだけを取り出す）
+
+列数の多いCSV（Salesforceのエクスポートなど）から一部のカラムだけを挿入する場合を比較する。
+データベースには接続しない。
+使い方: python scripts/bench-csv-projection.py --rows 100000 --columns 150 --needed 40 [--quote-all]
+"""
+
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda-code'))
+
+from csv_processor import iter_csv_rows, iter_projected_rows, make_row_picker
+
+BATCH_SIZE = 5000
+
+def generate_csv(rows, columns, quote_all, special_ratio):
+    """ベンチマーク用のCSVを生成（一部の値はカンマ・引用符・改行を含む）"""
+    random.seed(0)
+    output = io.StringIO()
+    writer = csv.writer(output, quoting=csv.QUOTE_ALL if quote_all else csv.QUOTE_MINIMAL, lineterminator='\n')
+    writer.writerow([f"col_{n}" for n in range(columns)])
+    for row_number in range(rows):
+        values = [f"value_{row_number}_{n}" if random.random() > 0.1 else '' for n in range(columns)]
+        if random.random() < special_ratio:
+            values[random.randrange(columns)] = 'a, "quoted"\nmulti-line value'
+        writer.writerow(values)
+    # 入力バッファを計測対象に含めないよう、行のリストで渡す
+    return output.getvalue().splitlines(keepends=True)
+
+def run_full(lines, projection):
+    """変更前の処理: csv.readerで全カラムを解析し、バッチには全カラムの行と挿入値を保持"""
+    csv_reader = csv.reader(lines)
+    width = len(next(csv_reader))
+    pick = make_row_picker(projection)
+    batch = []
+    rows = 0
+    for row_number, row in enumerate(iter_csv_rows(csv_reader, width), 1):
+        values = pick(row)
+        batch.append((row_number, row, values))
+        rows += 1
+        if len(batch) >= BATCH_SIZE:
+            batch = []
+    return rows
+
+def run_projected(lines, projection):
+    """変更後の処理: 必要なカラムの位置までだけ分割し、バッチには取り出したカラムのみ保持"""
+    line_iter = iter(lines)
+    next(line_iter)
+    pick = make_row_picker(list(range(len(projection))))
+    batch = []
+    rows = 0
+    for row_number, row in enumerate(iter_projected_rows(line_iter, projection), 1):
+        values = pick(row)
+        batch.append((row_number, row, values))
+        rows += 1
+        if len(batch) >= BATCH_SIZE:
+            batch = []
+    return rows
+
+def measure(func, lines, projection, repeat):
+    """最速の実行時間とピークメモリを計測"""
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(lines, projection)
+        elapsed.append(time.perf_counter() - start)
+    
+    tracemalloc.start()
+    func(lines, projection)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(elapsed), peak
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CSVの行の解析のベンチマーク")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--columns", type=int, default=150)
+    parser.add_argument("--needed", type=int, default=40, help="挿入するカラム数（先頭から均等に選ぶ）")
+    parser.add_argument("--quote-all", action="store_true", help="全ての値を引用符で囲む（Salesforceのエクスポート形式）")
+    parser.add_argument("--special-ratio", type=float, default=0.01, help="カンマ・引用符・改行を含む値がある行の割合")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    
+    print(f"CSV生成: {args.rows}行 x {args.columns}列（必要なカラム: {args.needed}）")
+    lines = generate_csv(args.rows, args.columns, args.quote_all, args.special_ratio)
+    step = args.columns / args.needed
+    projection = sorted({int(n * step) for n in range(args.needed)})
+    
+    csv_reader = csv.reader(lines)
+    expected = list(map(make_row_picker(projection), iter_csv_rows(csv_reader, len(next(csv_reader)))))
+    if list(iter_projected_rows(iter(lines[1:]), projection)) != expected:
+        print("NG: 解析結果が一致しません")
+        sys.exit(1)
+    
+    results = {}
+    for name, func in [("full parse", run_full), ("projected", run_projected)]:
+        results[name] = measure(func, lines, projection, args.repeat)
+        seconds, peak = results[name]
+        print(f"{name:>10}: {seconds:.3f}秒 ({args.rows / seconds:,.0f}行/秒), ピークメモリ {peak / 1024 / 1024:.1f}MB")
+    
+    full_seconds, full_peak = results["full parse"]
+    projected_seconds, projected_peak = results["projected"]
+    print(f"CPU時間: {full_seconds / projected_seconds:.2f}倍高速, ピークメモリ: {full_peak / projected_peak:.2f}分の1")
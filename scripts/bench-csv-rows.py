@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+csv_processorの行処理ループのベンチマーク（辞書行 / 位置指定のタプル行）
+
+データベースには接続せず、CSV解析から挿入値の作成・失敗行の記録までを比較する。
+使い方: python scripts/bench-csv-rows.py --rows 100000 --columns 80
+"""
+
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda-code'))
+
+from csv_processor import FAILED_DETAILS_LIMIT, iter_csv_rows, make_row_picker
+
+BATCH_SIZE = 1000
+SOURCE_FILE = "s3://bench-bucket/data/bench_table.csv"
+
+def generate_csv(rows, columns, empty_ratio):
+    """ベンチマーク用のCSVを生成"""
+    random.seed(0)
+    header = [f"col_{n}" for n in range(columns)]
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(header)
+    for row_number in range(rows):
+        writer.writerow([
+            '' if random.random() < empty_ratio else f"value_{row_number}_{n}"
+            for n in range(columns)
+        ])
+    # 入力バッファを計測対象に含めないよう、行のリストで渡す
+    return output.getvalue().splitlines(keepends=True), header
+
+def run_dict_rows(csv_lines, insert_columns, fail_every):
+    """変更前の処理: DictReaderの辞書行から列名で値を取り出し、失敗行は値と行をコピーして保持"""
+    batch = []
+    failed_details = []
+    for i, row in enumerate(csv.DictReader(csv_lines)):
+        values = []
+        for col in insert_columns:
+            value = row.get(col, '')
+            if value == '':
+                values.append(None)
+            else:
+                values.append(str(value))
+        values.append(SOURCE_FILE)
+        
+        if (i + 1) % fail_every == 0:
+            failed_details.append({
+                'row_number': i + 1,
+                'error': 'simulated',
+                'values': values,
+                'row_data': row
+            })
+            continue
+        
+        batch.append(values)
+        if len(batch) >= BATCH_SIZE:
+            batch = []
+    return failed_details
+
+def run_tuple_rows(csv_lines, insert_columns, fail_every):
+    """変更後の処理: 列順のリストから位置指定でタプルを取り出し、失敗行は上限件数のみ保持"""
+    batch = []
+    failed_details = []
+    csv_reader = csv.reader(csv_lines)
+    csv_columns = next(csv_reader)
+    pick_values = make_row_picker([csv_columns.index(col) for col in insert_columns])
+    
+    for row_number, row in enumerate(iter_csv_rows(csv_reader, len(csv_columns)), 1):
+        values = pick_values(row)
+        if '' in values:
+            values = tuple(None if value == '' else value for value in values)
+        
+        if row_number % fail_every == 0:
+            if len(failed_details) < FAILED_DETAILS_LIMIT:
+                failed_details.append({
+                    'row_number': row_number,
+                    'error': 'simulated',
+                    'row_data': dict(zip(csv_columns, row))
+                })
+            continue
+        
+        batch.append((row_number, row, values))
+        if len(batch) >= BATCH_SIZE:
+            batch = []
+    return failed_details
+
+def measure(func, csv_lines, insert_columns, fail_every, repeat):
+    """最速の実行時間とピークメモリを計測"""
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(csv_lines, insert_columns, fail_every)
+        elapsed.append(time.perf_counter() - start)
+    
+    tracemalloc.start()
+    func(csv_lines, insert_columns, fail_every)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(elapsed), peak
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="csv_processorの行処理ループのベンチマーク")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--columns", type=int, default=80)
+    parser.add_argument("--empty-ratio", type=float, default=0.05, help="空欄の割合")
+    parser.add_argument("--fail-every", type=int, default=50, help="N行に1行を失敗行として扱う")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    
+    print(f"CSV生成: {args.rows}行 x {args.columns}列")
+    csv_lines, header = generate_csv(args.rows, args.columns, args.empty_ratio)
+    
+    results = {}
+    for name, func in [("dict rows", run_dict_rows), ("tuple rows", run_tuple_rows)]:
+        results[name] = measure(func, csv_lines, header, args.fail_every, args.repeat)
+        seconds, peak = results[name]
+        print(f"{name:>10}: {seconds:.3f}秒 ({args.rows / seconds:,.0f}行/秒), ピークメモリ {peak / 1024 / 1024:.1f}MB")
+    
+    dict_seconds, dict_peak = results["dict rows"]
+    tuple_seconds, tuple_peak = results["tuple rows"]
+    print(f"CPU時間: {dict_seconds / tuple_seconds:.2f}倍高速, ピークメモリ: {dict_peak / tuple_peak:.2f}分の1")
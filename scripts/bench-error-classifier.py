@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+csv_processorのエラー解析のベンチマーク（メッセージの正規表現解析 / SQLSTATEとerror.diagによる振り分け）
+
+データベースには接続せず、PostgreSQLが返すものと同じSQLSTATE・diag・メッセージを持つエラーで比較する。
+影響カラムの判定が正しかった割合も出力する。
+使い方: python scripts/bench-error-classifier.py --errors 20000 --columns 80
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda-code'))
+
+from csv_processor import parse_postgres_error, summarize_error
+
+class Diag:
+    """psycopg2のerror.diagと同じ属性を持つ入力データ"""
+    
+    def __init__(self, message_primary, message_detail=None, column_name=None, constraint_name=None, table_name=None):
+        self.message_primary = message_primary
+        self.message_detail = message_detail
+        self.column_name = column_name
+        self.constraint_name = constraint_name
+        self.table_name = table_name
+
+class BenchError(Exception):
+    """pgcodeとdiagを持つエラー（str()はpsycopg2と同じく本文と詳細を改行でつなげたもの）"""
+    
+    def __init__(self, pgcode, diag):
+        message = diag.message_primary
+        if diag.message_detail:
+            message += f"\nDETAIL:  {diag.message_detail}"
+        super().__init__(message)
+        self.pgcode = pgcode
+        self.diag = diag
+
+def parse_postgres_error_regex(error, row_data, column_info):
+    """変更前の処理: 6つの正規表現をメッセージに毎回適用し、カラムはrow_dataの値から推測"""
+    error_info = {
+        'error_type': 'UNKNOWN',
+        'error_code': getattr(error, 'pgcode', 'UNKNOWN'),
+        'error_message': str(error),
+        'affected_columns': [],
+        'details': []
+    }
+    error_msg = str(error)
+    
+    null_matches = re.findall(r'null value in column "([^"]+)" violates not-null constraint', error_msg)
+    if null_matches:
+        error_info['error_type'] = 'NOT_NULL_VIOLATION'
+        for col in null_matches:
+            error_info['affected_columns'].append(col)
+            error_info['details'].append(f"カラム '{col}' にNULL値は許可されていません")
+    
+    pk_match = re.search(r'duplicate key value violates unique constraint "([^"]+)".*Key \(([^)]+)\)=\(([^)]+)\)', error_msg)
+    if pk_match:
+        constraint_name, key_columns, key_values = pk_match.groups()
+        if 'pk' in constraint_name.lower() or 'pkey' in constraint_name.lower():
+            error_info['error_type'] = 'PRIMARY_KEY_VIOLATION'
+        else:
+            error_info['error_type'] = 'UNIQUE_CONSTRAINT_VIOLATION'
+        error_info['affected_columns'].append(key_columns)
+        error_info['details'].append(f"制約 '{constraint_name}' 違反: キー({key_columns})=({key_values}) は既に存在します")
+    
+    fk_match = re.search(r'violates foreign key constraint "([^"]+)".*Key \(([^)]+)\)=\(([^)]+)\) is not present', error_msg)
+    if fk_match:
+        error_info['error_type'] = 'FOREIGN_KEY_VIOLATION'
+        constraint_name, key_columns, key_values = fk_match.groups()
+        error_info['affected_columns'].append(key_columns)
+        error_info['details'].append(f"外部キー制約 '{constraint_name}' 違反: 参照先に値({key_values})が存在しません")
+    
+    type_matches = re.findall(r'invalid input syntax for type (\w+): "([^"]+)"', error_msg)
+    if type_matches:
+        error_info['error_type'] = 'DATA_TYPE_MISMATCH'
+        for data_type, value in type_matches:
+            for col, col_info in column_info.items():
+                if col in row_data and str(row_data[col]) == value:
+                    error_info['affected_columns'].append(col)
+                    error_info['details'].append(f"カラム '{col}' (型: {data_type}): 値 '{value}' は無効な形式です")
+                    break
+    
+    length_match = re.search(r'value too long for type character varying\((\d+)\)', error_msg)
+    if length_match:
+        error_info['error_type'] = 'STRING_LENGTH_EXCEEDED'
+        max_length = length_match.group(1)
+        for col, value in row_data.items():
+            if value and len(str(value)) > int(max_length):
+                error_info['affected_columns'].append(col)
+                error_info['details'].append(f"カラム '{col}': 値の長さ {len(str(value))} が最大長 {max_length} を超過")
+    
+    if re.search(r'numeric field overflow', error_msg):
+        error_info['error_type'] = 'NUMERIC_OVERFLOW'
+        error_info['details'].append("数値が許容範囲を超えています")
+    
+    check_match = re.search(r'new row for relation "([^"]+)" violates check constraint "([^"]+)"', error_msg)
+    if check_match:
+        error_info['error_type'] = 'CHECK_CONSTRAINT_VIOLATION'
+        error_info['details'].append(f"CHECK制約 '{check_match.group(2)}' 違反")
+    
+    return error_info
+
+def summarize_error_regex(error_summary, row_number, error_info):
+    """変更前の集計"""
+    error_type = error_info['error_type']
+    if error_type not in error_summary:
+        error_summary[error_type] = {'count': 0, 'examples': []}
+    error_summary[error_type]['count'] += 1
+    if len(error_summary[error_type]['examples']) < 3:
+        error_summary[error_type]['examples'].append({
+            'row_number': row_number,
+            'affected_columns': error_info['affected_columns'],
+            'details': error_info['details']
+        })
+
+def build_columns(columns):
+    """テキスト・整数・日付・varchar(20)のカラムが混在するテーブル定義"""
+    column_info = {}
+    for n in range(columns):
+        data_type, max_length = [
+            ('text', None), ('integer', None), ('date', None), ('character varying', 20)
+        ][n % 4]
+        column_info[f"col_{n}"] = {
+            'column_name': f"col_{n}",
+            'data_type': data_type,
+            'character_maximum_length': max_length
+        }
+    return column_info
+
+def generate_errors(count, column_info):
+    """(行データ, エラー, 正しい影響カラム)のリストを生成
+    
+    型エラーの値はテキストのカラムにも同じ値を入れ、値だけでは判別できない行にする。
+    """
+    random.seed(0)
+    names = list(column_info)
+    cases = []
+    for n in range(count):
+        row_data = {col: f"v{n}_{i}" for i, col in enumerate(names)}
+        kind = n % 5
+        if kind == 0:
+            col = names[1 + 4 * random.randrange(len(names) // 4)]
+            row_data[col] = row_data['col_0'] = 'abc'
+            error = BenchError('22P02', Diag(f'invalid input syntax for type integer: "abc"'))
+        elif kind == 1:
+            col = names[3 + 4 * random.randrange(len(names) // 4)]
+            row_data[col] = 'x' * 30
+            error = BenchError('22001', Diag('value too long for type character varying(20)'))
+        elif kind == 2:
+            col = names[4 * random.randrange(len(names) // 4)]
+            row_data[col] = None
+            error = BenchError('23502', Diag(
+                f'null value in column "{col}" of relation "bench" violates not-null constraint',
+                'Failing row contains (...).', column_name=col, constraint_name=None, table_name='bench'
+            ))
+        elif kind == 3:
+            col = 'col_0'
+            error = BenchError('23505', Diag(
+                'duplicate key value violates unique constraint "bench_pkey"',
+                f'Key (col_0)=({row_data[col]}) already exists.', constraint_name='bench_pkey', table_name='bench'
+            ))
+        else:
+            col = 'col_1'
+            error = BenchError('23503', Diag(
+                'insert or update on table "bench" violates foreign key constraint "bench_col_1_fkey"',
+                f'Key (col_1)=({row_data[col]}) is not present in table "parent".',
+                constraint_name='bench_col_1_fkey', table_name='bench'
+            ))
+        cases.append((row_data, error, col))
+    return cases
+
+def run(parse, summarize, cases, column_info):
+    """全エラーを解析・集計し、影響カラムが正しかった件数を返す"""
+    error_summary = {}
+    correct = 0
+    for row_number, (row_data, error, expected_column) in enumerate(cases, 1):
+        error_info = parse(error, row_data, column_info)
+        summarize(error_summary, row_number, error_info)
+        if error_info['affected_columns'] == [expected_column]:
+            correct += 1
+    return correct
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="csv_processorのエラー解析のベンチマーク")
+    parser.add_argument("--errors", type=int, default=20000)
+    parser.add_argument("--columns", type=int, default=80)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    
+    column_info = build_columns(args.columns)
+    cases = generate_errors(args.errors, column_info)
+    print(f"エラー生成: {args.errors}件 x {args.columns}列")
+    
+    results = {}
+    for name, parse, summarize in [
+        ("regex", parse_postgres_error_regex, summarize_error_regex),
+        ("sqlstate", parse_postgres_error, summarize_error)
+    ]:
+        elapsed = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            correct = run(parse, summarize, cases, column_info)
+            elapsed.append(time.perf_counter() - start)
+        results[name] = min(elapsed)
+        print(f"{name:>8}: {results[name]:.3f}秒 ({args.errors / results[name]:,.0f}件/秒), 影響カラムの正解率 {correct / args.errors:.1%}")
+    
+    print(f"SQLSTATE振り分け: {results['regex'] / results['sqlstate']:.2f}倍高速")
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+CSVファイルをサンプリングしてカラムの型・長さ・NOT NULL・候補キーを推定し、CREATE TABLE文のSQLファイルを作成する
+
+新しいフィードの init-sql/ のテーブル定義の下書きに使う。データベースには接続しない。
+テーブル名はcsv_processorと同じくファイル名から決める（--tableで指定も可）。
+使い方: python scripts/profile-csv.py ./20240101_sfc_contacts.csv --output init-sql/11_sfc_contacts_table.sql
+"""
+
+import argparse
+import contextlib
+import csv
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda-code'))
+
+from schema_profiler import PROFILE_SAMPLE_ROWS, profile_csv, profile_csv_lines, render_ddl
+
+def derive_table_name(file_name):
+    """csv_processorと同じ規則でテーブル名を決める（ログ出力は抑止）"""
+    from csv_processor import derive_table_name as derive
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        return derive(file_name)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CSVからテーブル定義を推定")
+    parser.add_argument("path", help="CSVファイル")
+    parser.add_argument("--table", help="テーブル名（省略時はファイル名から決定）")
+    parser.add_argument("--sample-rows", type=int, default=PROFILE_SAMPLE_ROWS, help="抽出する行数")
+    parser.add_argument("--seed", type=int, help="抽出の乱数シード（同じ結果を再現する場合）")
+    parser.add_argument("--output", help="SQLファイルの出力先（省略時は標準出力）")
+    parser.add_argument("--parse-all", action="store_true", help="全ての行をCSVとして解析して抽出する（改行を含む値が多いファイル向け、低速）")
+    args = parser.parse_args()
+    
+    table_name = args.table or derive_table_name(os.path.basename(args.path))
+    
+    start = time.monotonic()
+    if args.parse_all:
+        with open(args.path, newline='', encoding='utf-8') as f:
+            csv_reader = csv.reader(f)
+            csv_columns = next(csv_reader, [])
+            profile = profile_csv(csv_columns, csv_reader, args.sample_rows, args.seed)
+    else:
+        # 読み飛ばす行は解析せず、抽出した物理行だけをCSVとして解析する
+        with open(args.path, 'rb') as f:
+            csv_columns = next(csv.reader([f.readline().decode('utf-8')]), [])
+            profile = profile_csv_lines(csv_columns, f, args.sample_rows, args.seed)
+    elapsed = time.monotonic() - start
+    
+    ddl = render_ddl(table_name, profile, os.path.abspath(args.path))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(ddl)
+    
+    print(ddl if not args.output else f"出力: {args.output}")
+    size = os.path.getsize(args.path)
+    print(
+        f"{profile['total_rows']}行（{size / 1024 / 1024:,.1f}MB）から{profile['sampled_rows']}行を抽出: "
+        f"{elapsed:.1f}秒（{size / 1024 / 1024 / max(elapsed, 0.001):,.0f}MB/秒）",
+        file=sys.stderr
+    )
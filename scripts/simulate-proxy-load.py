@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+多数のLambda同時起動を模擬し、プロキシ経由でPostgreSQL側の接続数が一定に保たれるかを確認する
+
+local/pgbouncer の docker compose 環境に対して実行する。
+使い方: python scripts/simulate-proxy-load.py --invocations 500 [--direct]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda-code'))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="プロキシ経由の同時接続シミュレーション")
+    parser.add_argument("--invocations", type=int, default=500, help="同時に起動する数")
+    parser.add_argument("--work-ms", type=int, default=50, help="1起動あたりのトランザクション内の処理時間")
+    parser.add_argument("--db-host", default="localhost")
+    parser.add_argument("--db-port", type=int, default=55432)
+    parser.add_argument("--proxy-host", default="localhost")
+    parser.add_argument("--proxy-port", type=int, default=6432)
+    parser.add_argument("--database", default="postgres")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="postgres")
+    parser.add_argument("--direct", action="store_true", help="プロキシを使わず直接接続する（比較用）")
+    parser.add_argument("--expect-max", type=int, default=25, help="プロキシ経由で許容するサーバー側の最大接続数")
+    return parser.parse_args()
+
+def configure_environment(args):
+    """Lambdaと同じ環境変数を設定（db_connectionのimport前に行う）"""
+    os.environ['DB_HOST'] = args.db_host
+    os.environ['DB_PORT'] = str(args.db_port)
+    os.environ['DB_NAME'] = args.database
+    os.environ['DB_USER'] = args.user
+    os.environ['DB_PASSWORD'] = args.password
+    os.environ['DB_CONNECT_TIMEOUT'] = '60'
+    if not args.direct:
+        os.environ['DB_PROXY_HOST'] = args.proxy_host
+        os.environ['DB_PROXY_PORT'] = str(args.proxy_port)
+
+def simulate_invocation(index, barrier, work_ms, errors):
+    """1回分のLambda起動: 接続し、1トランザクションで書き込んで切断する"""
+    from db_connection import get_db_connection
+    
+    barrier.wait()
+    try:
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO debug_test_table (name) VALUES (%s)", (f"proxy-sim-{index}",))
+            cursor.execute("SELECT pg_sleep(%s)", (work_ms / 1000,))
+            conn.commit()
+        finally:
+            conn.close()
+    except psycopg2.Error as e:
+        errors.append(str(e).strip())
+
+def monitor_connections(args, stop_event, samples):
+    """PostgreSQLに直接接続し、クライアント接続数を定期的に記録する"""
+    conn = psycopg2.connect(
+        host=args.db_host,
+        port=args.db_port,
+        database=args.database,
+        user=args.user,
+        password=args.password
+    )
+    conn.autocommit = True
+    cursor = conn.cursor()
+    while not stop_event.is_set():
+        cursor.execute("""
+            SELECT count(*)
+            FROM pg_stat_activity
+            WHERE backend_type = 'client backend'
+            AND pid <> pg_backend_pid()
+        """)
+        samples.append(cursor.fetchone()[0])
+        time.sleep(0.05)
+    conn.close()
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure_environment(args)
+    
+    from db_connection import describe_target
+    print(f"接続先: {describe_target()}")
+    print(f"同時起動数: {args.invocations}")
+    
+    samples = []
+    errors = []
+    stop_event = threading.Event()
+    monitor = threading.Thread(target=monitor_connections, args=(args, stop_event, samples))
+    monitor.start()
+    
+    barrier = threading.Barrier(args.invocations)
+    workers = [
+        threading.Thread(target=simulate_invocation, args=(n, barrier, args.work_ms, errors))
+        for n in range(args.invocations)
+    ]
+    
+    start = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - start
+    
+    stop_event.set()
+    monitor.join()
+    
+    peak = max(samples) if samples else 0
+    print(f"所要時間: {elapsed:.2f}秒")
+    print(f"成功: {args.invocations - len(errors)}, 失敗: {len(errors)}")
+    if errors:
+        print(f"エラー例: {errors[0]}")
+    print(f"PostgreSQL側の接続数: 最大 {peak}, 平均 {sum(samples) / max(len(samples), 1):.1f}（{len(samples)}回計測）")
+    
+    if not args.direct and (errors or peak > args.expect_max):
+        print(f"NG: プロキシ経由で接続数が {args.expect_max} を超えたか、エラーが発生しました")
+        sys.exit(1)
+    print("OK" if not args.direct else "（直接接続での比較結果）")
@@ -9,6 +9,7 @@ import pandas as pd
 import json
 import subprocess
 import sys
+import urllib.request
 
 def get_terraform_output(key):
     """Terraformのアウトプットから値を取得"""
@@ -70,6 +71,37 @@ def test_connection(username, query="SELECT * FROM accounts LIMIT 5"):
         if conn:
             conn.close()
 
+def test_batch_api(queries):
+    """API Gatewayの/batchエンドポイントで複数クエリを一括実行"""
+    api_url = get_terraform_output("api_gateway_batch_url")
+    api_key = get_terraform_output("api_key_value")
+    
+    request = urllib.request.Request(
+        api_url,
+        data=json.dumps({"queries": queries}).encode("utf-8"),
+        headers={"Content-Type": "application/json", "x-api-key": api_key},
+        method="POST"
+    )
+    
+    try:
+        with urllib.request.urlopen(request, timeout=35) as response:
+            body = json.loads(response.read().decode("utf-8"))
+    except Exception as e:
+        print(f"エラー: {e}")
+        return {}
+    
+    print(f"バッチ実行完了: {body['query_count']}件, 合計 {body['total_execution_time_ms']}ms")
+    
+    dataframes = {}
+    for name, result in body["results"].items():
+        if result["success"]:
+            print(f"  - {name}: {result['row_count']}行 ({result['execution_time_ms']}ms)")
+            dataframes[f"Batch_{name}"] = pd.DataFrame(result["rows"], columns=result["columns"])
+        else:
+            print(f"  - {name}: エラー {result['message']}")
+    
+    return dataframes
+
 def export_to_excel(dataframes, filename="rds_test_results.xlsx"):
     """結果をExcelファイルに出力"""
     with pd.ExcelWriter(filename) as writer:
@@ -93,5 +125,11 @@ if __name__ == "__main__":
     # 制限付きユーザー（accountsテーブルのみ）
     results["Limited_User"] = test_connection("test_limited")
     
+    # API経由の一括実行
+    results.update(test_batch_api([
+        {"name": "accounts", "sql": "SELECT * FROM accounts LIMIT 5"},
+        {"name": "products", "sql": "SELECT * FROM products LIMIT 5"}
+    ]))
+    
     # Excelに出力
     export_to_excel(results)
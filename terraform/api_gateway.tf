@@ -42,13 +42,111 @@ resource "aws_api_gateway_integration" "query_lambda" {
   uri                     = aws_lambda_function.api_query_executor.invoke_arn
 }
 
+# バッチ実行用リソース
+resource "aws_api_gateway_resource" "batch" {
+  rest_api_id = aws_api_gateway_rest_api.query_api.id
+  parent_id   = aws_api_gateway_rest_api.query_api.root_resource_id
+  path_part   = "batch"
+}
+
+resource "aws_api_gateway_method" "batch_post" {
+  rest_api_id   = aws_api_gateway_rest_api.query_api.id
+  resource_id   = aws_api_gateway_resource.batch.id
+  http_method   = "POST"
+  authorization = "NONE"
+  api_key_required = true
+}
+
+resource "aws_api_gateway_integration" "batch_lambda" {
+  rest_api_id = aws_api_gateway_rest_api.query_api.id
+  resource_id = aws_api_gateway_resource.batch.id
+  http_method = aws_api_gateway_method.batch_post.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.api_query_executor.invoke_arn
+}
+
+# ジョブ操作用リソース（長時間クエリの投入・状態確認・キャンセル）
+resource "aws_api_gateway_resource" "jobs" {
+  rest_api_id = aws_api_gateway_rest_api.query_api.id
+  parent_id   = aws_api_gateway_rest_api.query_api.root_resource_id
+  path_part   = "jobs"
+}
+
+resource "aws_api_gateway_method" "jobs_post" {
+  rest_api_id   = aws_api_gateway_rest_api.query_api.id
+  resource_id   = aws_api_gateway_resource.jobs.id
+  http_method   = "POST"
+  authorization = "NONE"
+  api_key_required = true
+}
+
+resource "aws_api_gateway_integration" "jobs_lambda" {
+  rest_api_id = aws_api_gateway_rest_api.query_api.id
+  resource_id = aws_api_gateway_resource.jobs.id
+  http_method = aws_api_gateway_method.jobs_post.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.api_query_executor.invoke_arn
+}
+
+# 登録済みクエリの差分取得用リソース（Excelの差分更新）
+resource "aws_api_gateway_resource" "refresh" {
+  rest_api_id = aws_api_gateway_rest_api.query_api.id
+  parent_id   = aws_api_gateway_rest_api.query_api.root_resource_id
+  path_part   = "refresh"
+}
+
+resource "aws_api_gateway_method" "refresh_post" {
+  rest_api_id   = aws_api_gateway_rest_api.query_api.id
+  resource_id   = aws_api_gateway_resource.refresh.id
+  http_method   = "POST"
+  authorization = "NONE"
+  api_key_required = true
+}
+
+resource "aws_api_gateway_integration" "refresh_lambda" {
+  rest_api_id = aws_api_gateway_rest_api.query_api.id
+  resource_id = aws_api_gateway_resource.refresh.id
+  http_method = aws_api_gateway_method.refresh_post.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.api_query_executor.invoke_arn
+}
+
 # デプロイメント
 resource "aws_api_gateway_deployment" "api" {
   rest_api_id = aws_api_gateway_rest_api.query_api.id
 
+  triggers = {
+    redeployment = sha1(jsonencode([
+      aws_api_gateway_resource.query.id,
+      aws_api_gateway_method.query_post.id,
+      aws_api_gateway_integration.query_lambda.id,
+      aws_api_gateway_resource.batch.id,
+      aws_api_gateway_method.batch_post.id,
+      aws_api_gateway_integration.batch_lambda.id,
+      aws_api_gateway_resource.jobs.id,
+      aws_api_gateway_method.jobs_post.id,
+      aws_api_gateway_integration.jobs_lambda.id,
+      aws_api_gateway_resource.refresh.id,
+      aws_api_gateway_method.refresh_post.id,
+      aws_api_gateway_integration.refresh_lambda.id
+    ]))
+  }
+
   depends_on = [
     aws_api_gateway_method.query_post,
-    aws_api_gateway_integration.query_lambda
+    aws_api_gateway_integration.query_lambda,
+    aws_api_gateway_method.batch_post,
+    aws_api_gateway_integration.batch_lambda,
+    aws_api_gateway_method.jobs_post,
+    aws_api_gateway_integration.jobs_lambda,
+    aws_api_gateway_method.refresh_post,
+    aws_api_gateway_integration.refresh_lambda
   ]
 
   lifecycle {
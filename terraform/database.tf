@@ -25,6 +25,9 @@ resource "aws_db_instance" "main" {
   db_subnet_group_name   = aws_db_subnet_group.main.name
   vpc_security_group_ids = [aws_security_group.rds.id]
 
+  # リードレプリカの作成には自動バックアップの有効化が必要
+  backup_retention_period = var.db_read_replica_count > 0 ? 1 : null
+
   skip_final_snapshot = true
   deletion_protection = false
 
@@ -58,6 +58,25 @@ resource "aws_iam_role_policy" "lambda_s3_access" {
   })
 }
 
+# Lambda間の呼び出し用インラインポリシー（ジョブの非同期実行・API経由のジョブ操作）
+resource "aws_iam_role_policy" "lambda_invoke" {
+  name = "${var.project_name}-lambda-invoke"
+  role = aws_iam_role.lambda_execution.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "lambda:InvokeFunction"
+        ]
+        Resource = "arn:aws:lambda:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:function:${var.project_name}-*"
+      }
+    ]
+  })
+}
+
 # カスタムリソース用IAMロール
 resource "aws_iam_role" "custom_resource_lambda" {
   name_prefix = "etl-custom-res-"
@@ -36,6 +36,8 @@ resource "aws_lambda_function" "table_creator" {
       DB_PASSWORD = var.db_master_password
       S3_BUCKET  = var.source_bucket
       SQL_PREFIX = var.init_sql_prefix
+
+      DB_PROXY_HOST = local.db_proxy_host
     }
   }
 
@@ -55,11 +57,19 @@ resource "aws_lambda_function" "csv_processor" {
   timeout       = 900
   memory_size   = 1024
 
+  # 大量のファイルが同時に置かれた場合のDB接続数の上限（-1は制限なし）
+  reserved_concurrent_executions = var.csv_processor_reserved_concurrency
+
   s3_bucket = var.source_bucket
   s3_key    = var.csv_processor_code_key
 
   layers = [aws_lambda_layer_version.psycopg2.arn]
 
+  # 重複除去で大きなファイルを/tmpに退避するための領域
+  ephemeral_storage {
+    size = var.csv_processor_ephemeral_storage_mb
+  }
+
   vpc_config {
     security_group_ids = [aws_security_group.lambda.id]
     subnet_ids         = [aws_subnet.private_1.id, aws_subnet.private_2.id]
@@ -73,6 +83,20 @@ resource "aws_lambda_function" "csv_processor" {
       DB_USER     = var.db_master_username
       DB_PASSWORD = var.db_master_password
       S3_BUCKET   = aws_s3_bucket.data.bucket
+
+      LOAD_CONFIG               = jsonencode(var.csv_load_config)
+      INDEX_REBUILD_WORKERS     = var.csv_index_rebuild_workers
+      COMMIT_BATCH_SIZE         = var.csv_commit_batch_size
+      BATCH_SIZE_MIN            = var.csv_batch_size_min
+      BATCH_SIZE_MAX            = var.csv_batch_size_max
+      BATCH_TARGET_MS           = var.csv_batch_target_ms
+      CONTINUATION_THRESHOLD_MS = var.csv_continuation_threshold_ms
+      DEDUP_MEMORY_ROWS         = var.csv_dedup_memory_rows
+      LOAD_MAX_WRITERS          = var.csv_load_max_writers
+      SCHEMA_PROPOSAL_PREFIX    = "schema-proposals/"
+      TRACE_PREFIX              = "load-traces/"
+
+      DB_PROXY_HOST = local.db_proxy_host
     }
   }
 
@@ -111,6 +135,14 @@ resource "aws_lambda_function" "query_executor" {
       DB_PASSWORD  = var.db_master_password
       S3_BUCKET    = aws_s3_bucket.data.bucket
       OUTPUT_PREFIX = "query-results/"
+
+      EXPORT_FETCH_SIZE         = var.export_fetch_size
+      JOB_PROGRESS_INTERVAL_SEC = var.job_progress_interval_sec
+
+      DB_PROXY_HOST = local.db_proxy_host
+
+      DB_REPLICA_HOSTS    = local.db_replica_hosts
+      REPLICA_MAX_LAG_SEC = var.replica_max_lag_sec
     }
   }
 
@@ -118,7 +150,10 @@ resource "aws_lambda_function" "query_executor" {
     Name = "${var.project_name}-query-executor"
   }
 
-  depends_on = [aws_iam_role_policy.lambda_s3_access]
+  depends_on = [
+    aws_iam_role_policy.lambda_s3_access,
+    aws_iam_role_policy.lambda_invoke
+  ]
 }
 
 # Lambda Permission for S3
@@ -275,6 +310,23 @@ resource "aws_lambda_function" "api_query_executor" {
       DB_NAME     = aws_db_instance.main.db_name
       DB_USER     = var.db_master_username
       DB_PASSWORD = var.db_master_password
+
+      BATCH_MAX_QUERIES      = var.api_batch_max_queries
+      BATCH_MAX_WORKERS      = var.api_batch_max_workers
+      BATCH_QUERY_TIMEOUT_MS = var.api_batch_query_timeout_ms
+
+      QUERY_EXECUTOR_FUNCTION_NAME = aws_lambda_function.query_executor.function_name
+
+      STATEMENT_TIMEOUT_MS = var.api_statement_timeout_ms
+      MAX_QUERY_COST       = var.api_max_query_cost
+      MAX_ESTIMATED_ROWS   = var.api_max_estimated_rows
+      QUERY_GUARD_MODE     = var.api_query_guard_mode
+      DOWNGRADE_ROW_LIMIT  = var.api_downgrade_row_limit
+
+      DB_PROXY_HOST = local.db_proxy_host
+
+      DB_REPLICA_HOSTS    = local.db_replica_hosts
+      REPLICA_MAX_LAG_SEC = var.replica_max_lag_sec
     }
   }
 
@@ -294,3 +346,66 @@ resource "aws_lambda_permission" "api_gateway_invoke" {
   source_arn    = "${aws_api_gateway_rest_api.query_api.execution_arn}/*/*"
 }
 
+# Index Advisor Lambda Function
+resource "aws_lambda_function" "index_advisor" {
+  function_name = "${var.project_name}-index-advisor"
+  runtime       = "python3.11"
+  handler       = "index_advisor.lambda_handler"
+  role          = aws_iam_role.lambda_execution.arn
+  timeout       = 300
+  memory_size   = 512
+
+  s3_bucket = var.source_bucket
+  s3_key    = var.index_advisor_code_key
+
+  layers = [aws_lambda_layer_version.psycopg2.arn]
+
+  vpc_config {
+    security_group_ids = [aws_security_group.lambda.id]
+    subnet_ids         = [aws_subnet.private_1.id, aws_subnet.private_2.id]
+  }
+
+  environment {
+    variables = {
+      DB_HOST     = aws_db_instance.main.address
+      DB_PORT     = aws_db_instance.main.port
+      DB_NAME     = aws_db_instance.main.db_name
+      DB_USER     = var.db_master_username
+      DB_PASSWORD = var.db_master_password
+      S3_BUCKET   = aws_s3_bucket.data.bucket
+
+      INDEX_ADVISOR_PREFIX        = "index-recommendations/"
+      ADVISOR_MIN_TOTAL_TIME_MS   = var.index_advisor_min_total_time_ms
+      ADVISOR_MIN_TABLE_ROWS      = var.index_advisor_min_table_rows
+      ADVISOR_MAX_RECOMMENDATIONS = var.index_advisor_max_recommendations
+
+      DB_PROXY_HOST = local.db_proxy_host
+    }
+  }
+
+  tags = {
+    Name = "${var.project_name}-index-advisor"
+  }
+
+  depends_on = [aws_iam_role_policy.lambda_s3_access]
+}
+
+# Index Advisorの定期実行
+resource "aws_cloudwatch_event_rule" "index_advisor" {
+  name                = "${var.project_name}-index-advisor"
+  description         = "Periodically analyze observed queries and emit index recommendations"
+  schedule_expression = var.index_advisor_schedule
+}
+
+resource "aws_cloudwatch_event_target" "index_advisor" {
+  rule = aws_cloudwatch_event_rule.index_advisor.name
+  arn  = aws_lambda_function.index_advisor.arn
+}
+
+resource "aws_lambda_permission" "allow_events_index_advisor" {
+  statement_id  = "AllowExecutionFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.index_advisor.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.index_advisor.arn
+}
@@ -23,6 +23,16 @@ output "rds_port" {
   value       = aws_db_instance.main.port
 }
 
+output "db_proxy_endpoint" {
+  description = "RDS Proxy Endpoint (empty when the proxy is disabled)"
+  value       = local.db_proxy_host
+}
+
+output "db_replica_endpoints" {
+  description = "RDS read replica endpoints used for read-only queries"
+  value       = aws_db_instance.replica[*].address
+}
+
 output "table_creator_function_name" {
   description = "Table Creator Lambda Function Name"
   value       = aws_lambda_function.table_creator.function_name
@@ -38,6 +48,11 @@ output "query_executor_function_name" {
   value       = aws_lambda_function.query_executor.function_name
 }
 
+output "index_advisor_function_name" {
+  description = "Index Advisor Lambda Function Name"
+  value       = aws_lambda_function.index_advisor.function_name
+}
+
 output "lambda_layer_arn" {
   description = "psycopg2 Lambda Layer ARN"
   value       = aws_lambda_layer_version.psycopg2.arn
@@ -64,6 +79,21 @@ output "api_gateway_url" {
   value       = "https://${aws_api_gateway_rest_api.query_api.id}.execute-api.${var.aws_region}.amazonaws.com/${aws_api_gateway_stage.prod.stage_name}/query"
 }
 
+output "api_gateway_batch_url" {
+  description = "API Gateway URL for Excel batch queries"
+  value       = "https://${aws_api_gateway_rest_api.query_api.id}.execute-api.${var.aws_region}.amazonaws.com/${aws_api_gateway_stage.prod.stage_name}/batch"
+}
+
+output "api_gateway_jobs_url" {
+  description = "API Gateway URL for submitting and polling long-running query jobs"
+  value       = "https://${aws_api_gateway_rest_api.query_api.id}.execute-api.${var.aws_region}.amazonaws.com/${aws_api_gateway_stage.prod.stage_name}/jobs"
+}
+
+output "api_gateway_refresh_url" {
+  description = "API Gateway URL for incremental refresh of registered queries"
+  value       = "https://${aws_api_gateway_rest_api.query_api.id}.execute-api.${var.aws_region}.amazonaws.com/${aws_api_gateway_stage.prod.stage_name}/refresh"
+}
+
 output "api_key_value" {
   description = "API Key for Excel access"
   value       = aws_api_gateway_api_key.excel_key.value
@@ -81,6 +111,8 @@ output "excel_setup_instructions" {
     
     3. VBAコードに以下を設定:
        - API_URL = "${aws_api_gateway_deployment.api.invoke_url}/query"
+       - BATCH_API_URL = "${aws_api_gateway_deployment.api.invoke_url}/batch"
+       - REFRESH_API_URL = "${aws_api_gateway_deployment.api.invoke_url}/refresh"
        - API_KEY = "<上記で取得したキー>"
   EOT
 }
\ No newline at end of file
@@ -0,0 +1,148 @@
+# RDS Proxy（トランザクションプーリング）
+# enable_rds_proxy = true の場合、DBに接続するLambda関数はDB_PROXY_HOST経由で接続する
+
+locals {
+  db_proxy_host = var.enable_rds_proxy ? aws_db_proxy.main[0].endpoint : ""
+}
+
+# プロキシが使用する認証情報
+resource "aws_secretsmanager_secret" "db_proxy" {
+  count       = var.enable_rds_proxy ? 1 : 0
+  name_prefix = "${var.project_name}-db-proxy-"
+
+  tags = {
+    Name = "${var.project_name}-db-proxy-secret"
+  }
+}
+
+resource "aws_secretsmanager_secret_version" "db_proxy" {
+  count     = var.enable_rds_proxy ? 1 : 0
+  secret_id = aws_secretsmanager_secret.db_proxy[0].id
+  secret_string = jsonencode({
+    username = var.db_master_username
+    password = var.db_master_password
+  })
+}
+
+# プロキシ用IAMロール
+resource "aws_iam_role" "db_proxy" {
+  count       = var.enable_rds_proxy ? 1 : 0
+  name_prefix = "${var.project_name}-db-proxy-"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "rds.amazonaws.com"
+        }
+      }
+    ]
+  })
+
+  tags = {
+    Name = "${var.project_name}-db-proxy-role"
+  }
+}
+
+resource "aws_iam_role_policy" "db_proxy_secret" {
+  count = var.enable_rds_proxy ? 1 : 0
+  name  = "${var.project_name}-db-proxy-secret"
+  role  = aws_iam_role.db_proxy[0].id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect   = "Allow"
+        Action   = ["secretsmanager:GetSecretValue"]
+        Resource = [aws_secretsmanager_secret.db_proxy[0].arn]
+      }
+    ]
+  })
+}
+
+resource "aws_security_group" "db_proxy" {
+  count       = var.enable_rds_proxy ? 1 : 0
+  name_prefix = "${var.project_name}-db-proxy-sg-"
+  description = "Security group for RDS Proxy"
+  vpc_id      = aws_vpc.main.id
+
+  ingress {
+    description     = "PostgreSQL from Lambda"
+    from_port       = 5432
+    to_port         = 5432
+    protocol        = "tcp"
+    security_groups = [aws_security_group.lambda.id]
+  }
+
+  egress {
+    description = "PostgreSQL access to RDS"
+    from_port   = 5432
+    to_port     = 5432
+    protocol    = "tcp"
+    cidr_blocks = [var.vpc_cidr]
+  }
+
+  tags = {
+    Name = "${var.project_name}-db-proxy-sg"
+  }
+
+  lifecycle {
+    create_before_destroy = true
+  }
+}
+
+resource "aws_security_group_rule" "rds_from_db_proxy" {
+  count                    = var.enable_rds_proxy ? 1 : 0
+  description              = "PostgreSQL from RDS Proxy"
+  type                     = "ingress"
+  from_port                = 5432
+  to_port                  = 5432
+  protocol                 = "tcp"
+  security_group_id        = aws_security_group.rds.id
+  source_security_group_id = aws_security_group.db_proxy[0].id
+}
+
+resource "aws_db_proxy" "main" {
+  count                  = var.enable_rds_proxy ? 1 : 0
+  name                   = "${var.project_name}-db-proxy"
+  engine_family          = "POSTGRESQL"
+  role_arn               = aws_iam_role.db_proxy[0].arn
+  vpc_subnet_ids         = [aws_subnet.private_1.id, aws_subnet.private_2.id]
+  vpc_security_group_ids = [aws_security_group.db_proxy[0].id]
+  require_tls            = false
+  idle_client_timeout    = 1800
+
+  auth {
+    auth_scheme = "SECRETS"
+    iam_auth    = "DISABLED"
+    secret_arn  = aws_secretsmanager_secret.db_proxy[0].arn
+  }
+
+  tags = {
+    Name = "${var.project_name}-db-proxy"
+  }
+
+  depends_on = [aws_secretsmanager_secret_version.db_proxy]
+}
+
+resource "aws_db_proxy_default_target_group" "main" {
+  count         = var.enable_rds_proxy ? 1 : 0
+  db_proxy_name = aws_db_proxy.main[0].name
+
+  connection_pool_config {
+    max_connections_percent      = var.db_proxy_max_connections_percent
+    max_idle_connections_percent = 10
+    connection_borrow_timeout    = 120
+  }
+}
+
+resource "aws_db_proxy_target" "main" {
+  count                  = var.enable_rds_proxy ? 1 : 0
+  db_proxy_name          = aws_db_proxy.main[0].name
+  target_group_name      = aws_db_proxy_default_target_group.main[0].name
+  db_instance_identifier = aws_db_instance.main.identifier
+}
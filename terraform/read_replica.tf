@@ -0,0 +1,23 @@
+# リードレプリカ
+# db_read_replica_count > 0 の場合、query_executor / api_query_executorの読み取り専用クエリはレプリカで実行する
+# （遅延が replica_max_lag_sec を超えたレプリカは除外し、使えるレプリカがなければプライマリで実行）
+
+locals {
+  db_replica_hosts = join(",", aws_db_instance.replica[*].address)
+}
+
+resource "aws_db_instance" "replica" {
+  count               = var.db_read_replica_count
+  identifier          = "${var.project_name}-pg-replica-${count.index + 1}"
+  replicate_source_db = aws_db_instance.main.identifier
+  instance_class      = var.db_replica_instance_class != "" ? var.db_replica_instance_class : var.db_instance_class
+
+  vpc_security_group_ids = [aws_security_group.rds.id]
+
+  skip_final_snapshot = true
+  deletion_protection = false
+
+  tags = {
+    Name = "${var.project_name}-rds-replica-${count.index + 1}"
+  }
+}
@@ -86,4 +86,199 @@ variable "api_query_executor_code_key" {
   description = "S3 Key for API Query Executor Lambda code"
   type        = string
   default     = "lambda-code/api_query_executor.zip"
+}
+
+variable "api_batch_max_queries" {
+  description = "Maximum number of queries accepted by the /batch endpoint"
+  type        = number
+  default     = 10
+}
+
+variable "api_batch_max_workers" {
+  description = "Maximum concurrent DB connections used by one /batch request"
+  type        = number
+  default     = 5
+}
+
+variable "api_batch_query_timeout_ms" {
+  description = "Per-query statement_timeout for /batch requests in milliseconds"
+  type        = number
+  default     = 25000
+}
+
+variable "export_fetch_size" {
+  description = "Rows fetched per round trip when streaming query results to S3"
+  type        = number
+  default     = 5000
+}
+
+variable "job_progress_interval_sec" {
+  description = "Interval in seconds between progress updates of background query jobs"
+  type        = number
+  default     = 5
+}
+
+variable "api_statement_timeout_ms" {
+  description = "Upper bound of statement_timeout applied to each API query in milliseconds"
+  type        = number
+  default     = 25000
+}
+
+variable "api_max_query_cost" {
+  description = "Maximum planner total cost (EXPLAIN) accepted for API queries"
+  type        = number
+  default     = 1000000
+}
+
+variable "api_max_estimated_rows" {
+  description = "Maximum planner row estimate accepted for API queries without downgrading"
+  type        = number
+  default     = 100000
+}
+
+variable "api_query_guard_mode" {
+  description = "Action for queries over the cost or row limits (reject or downgrade)"
+  type        = string
+  default     = "downgrade"
+
+  validation {
+    condition     = contains(["reject", "downgrade"], var.api_query_guard_mode)
+    error_message = "api_query_guard_mode must be reject or downgrade."
+  }
+}
+
+variable "api_downgrade_row_limit" {
+  description = "Row limit applied to downgraded API queries"
+  type        = number
+  default     = 10000
+}
+
+variable "index_advisor_code_key" {
+  description = "S3 Key for Index Advisor Lambda code"
+  type        = string
+  default     = "lambda-code/index_advisor.zip"
+}
+
+variable "index_advisor_schedule" {
+  description = "Schedule expression for the index advisor"
+  type        = string
+  default     = "cron(0 18 * * ? *)"
+}
+
+variable "index_advisor_min_total_time_ms" {
+  description = "Minimum accumulated execution time of a query shape to be analyzed"
+  type        = number
+  default     = 1000
+}
+
+variable "index_advisor_min_table_rows" {
+  description = "Minimum estimated table rows for an index to be recommended"
+  type        = number
+  default     = 10000
+}
+
+variable "index_advisor_max_recommendations" {
+  description = "Maximum number of indexes recommended per run"
+  type        = number
+  default     = 10
+}
+
+variable "csv_load_config" {
+  description = "Per-table / per-prefix load options for the CSV processor (defaults, prefixes, tables)"
+  type        = any
+  default = {
+    defaults = {}
+    prefixes = {}
+    tables   = {}
+  }
+}
+
+variable "csv_index_rebuild_workers" {
+  description = "Parallel workers used to rebuild deferred indexes after an initial load"
+  type        = number
+  default     = 4
+}
+
+variable "csv_commit_batch_size" {
+  description = "Initial rows inserted and committed per transaction by the CSV processor (adjusted at runtime)"
+  type        = number
+  default     = 1000
+}
+
+variable "csv_dedup_memory_rows" {
+  description = "Rows the CSV processor deduplicates in memory before spilling hash partitions to /tmp"
+  type        = number
+  default     = 100000
+}
+
+variable "csv_processor_ephemeral_storage_mb" {
+  description = "Size of /tmp for the CSV processor, used when deduplication spills to disk"
+  type        = number
+  default     = 512
+}
+
+variable "csv_load_max_writers" {
+  description = "Maximum number of coordinated CSV loads merging into tables at the same time"
+  type        = number
+  default     = 4
+}
+
+variable "csv_processor_reserved_concurrency" {
+  description = "Reserved concurrency for the CSV processor, capping its database connections (-1 for unreserved)"
+  type        = number
+  default     = -1
+}
+
+variable "enable_rds_proxy" {
+  description = "Route Lambda database connections through an RDS Proxy (transaction pooling)"
+  type        = bool
+  default     = false
+}
+
+variable "db_proxy_max_connections_percent" {
+  description = "Share of the RDS max_connections the proxy may open"
+  type        = number
+  default     = 50
+}
+
+variable "csv_batch_size_min" {
+  description = "Lower bound for the CSV processor's adaptive batch size"
+  type        = number
+  default     = 100
+}
+
+variable "csv_batch_size_max" {
+  description = "Upper bound for the CSV processor's adaptive batch size"
+  type        = number
+  default     = 20000
+}
+
+variable "csv_batch_target_ms" {
+  description = "Target duration of one CSV insert batch in milliseconds"
+  type        = number
+  default     = 2000
+}
+
+variable "csv_continuation_threshold_ms" {
+  description = "Remaining time at which the CSV processor stops at the last commit and re-invokes itself to continue"
+  type        = number
+  default     = 120000
+}
+
+variable "db_read_replica_count" {
+  description = "Number of RDS read replicas used for read-only queries from the query executors"
+  type        = number
+  default     = 0
+}
+
+variable "db_replica_instance_class" {
+  description = "Instance class for read replicas (empty uses db_instance_class)"
+  type        = string
+  default     = ""
+}
+
+variable "replica_max_lag_sec" {
+  description = "Replication lag in seconds above which a replica is skipped and reads go elsewhere"
+  type        = number
+  default     = 30
 }
\ No newline at end of file